@@ -0,0 +1,221 @@
+"""
+多会话聊天服务：所有会话共享一个 RAGAgent 与向量库，会话状态由 SessionStore 管理。
+
+    python -m agents.chat_server --port 8000
+    curl -s localhost:8000/chat -d '{"session_id": "u1", "message": "支持哪些文档格式？"}'
+    curl -sN localhost:8000/chat -d '{"session_id": "u1", "message": "详细说明", "stream": true}'
+
+接口：POST /chat、POST /history、POST /reset（请求体均含 session_id），GET /health
+"""
+import argparse
+import logging
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Iterator, Optional
+
+from agents.chat_service import ChatService
+from agents.rag_agent import RAGAgent
+from agents.session_store import SessionStore
+from config.cfg import (
+    ANSWER_CACHE_PATH,
+    CHAT_MAX_CONCURRENCY,
+    CHAT_MAX_QUEUE,
+    CHAT_QUEUE_TIMEOUT,
+    CHAT_SERVER_PORT,
+    CHAT_SESSION_DB,
+    RETRIEVAL_SERVER_URL,
+)
+from utils.json_http import EventStream, HTTPError, JSONHandler, serve
+from utils.metrics import prometheus_response, start_exporter
+
+logger = logging.getLogger(__name__)
+
+# 后台清理空闲会话的间隔（秒）
+SWEEP_INTERVAL = 60
+
+
+class ConcurrencyLimiter:
+    """
+    限制同时进行的问答数（即并发的 LLM 调用数）。达到上限后请求排队等待；排队数超过 max_queue
+    时立即以 429 拒绝，等待超过 timeout 秒以 503 拒绝，避免请求无限堆积占用内存与线程
+    """
+
+    def __init__(self, max_concurrency: int = CHAT_MAX_CONCURRENCY, max_queue: int = CHAT_MAX_QUEUE,
+                 timeout: float = CHAT_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def enter(self):
+        """占用一个并发名额，排队已满或等待超时时抛出 HTTPError；之后须调用 release()"""
+        if self._slots.acquire(blocking=False):
+            # 有空闲名额时直接占用，不计入排队
+            with self._lock:
+                self.active += 1
+            return
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise HTTPError(429, "服务繁忙，请稍后重试", {"Retry-After": "1"})
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected += 1
+            else:
+                self.active += 1
+        if not acquired:
+            raise HTTPError(503, "排队超时，请稍后重试", {"Retry-After": str(int(self.timeout))})
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        self.enter()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ChatApp:
+    def __init__(self, agent: RAGAgent, sessions: SessionStore, limiter: Optional[ConcurrencyLimiter] = None):
+        self.agent = agent
+        self.sessions = sessions
+        self.limiter = limiter or ConcurrencyLimiter()
+
+    @staticmethod
+    def _session_id(body: dict) -> str:
+        session_id = body.get("session_id")
+        if not isinstance(session_id, str) or not session_id:
+            raise ValueError("缺少 session_id")
+        return session_id
+
+    def chat(self, body: dict):
+        session_id = self._session_id(body)
+        message = body.get("message", "").strip()
+        if not message:
+            raise ValueError("缺少 message")
+        where = body.get("where")
+        # 先取得会话锁再占用并发名额：同一会话排队的请求不占名额，名额只给能立即开始的请求
+        if body.get("stream"):
+            # 开始流式响应前先取得会话并占用名额，超限时直接返回错误码；两者由 EventStream.close
+            # 按相反顺序释放，流结束、出错、客户端断开或发送响应头失败时都会调用
+            stack = ExitStack()
+            try:
+                chat = stack.enter_context(self.sessions.checkout(session_id))
+                self.limiter.enter()
+                stack.callback(self.limiter.release)
+            except BaseException:
+                stack.close()
+                raise
+            return EventStream(self._stream(chat, session_id, message, where), on_close=stack.close)
+        with self.sessions.checkout(session_id) as chat, self.limiter.acquire():
+            result = chat.ask(message, where)
+        return {"session_id": session_id, **result}
+
+    def _stream(self, chat: ChatService, session_id: str, message: str, where: Optional[dict]):
+        stream = chat.ask_stream(message, where)
+        for token in stream:
+            yield {"token": token}
+        yield {"done": True, "session_id": session_id, **stream.result}
+
+    def history(self, body: dict) -> dict:
+        session_id = self._session_id(body)
+        state = self.sessions.history(session_id)
+        if state is None:
+            raise HTTPError(404, f"会话不存在: {session_id}")
+        return {"session_id": session_id, **state}
+
+    def reset(self, body: dict) -> dict:
+        session_id = self._session_id(body)
+        return {"session_id": session_id, "reset": self.sessions.reset(session_id)}
+
+    def health(self, _body) -> dict:
+        query_cache = getattr(self.agent.vector_store, "query_cache", None)
+        return {
+            "sessions": len(self.sessions),
+            "evicted_sessions": self.sessions.evicted,
+            "restored_sessions": self.sessions.restored,
+            "active": self.limiter.active,
+            "waiting": self.limiter.waiting,
+            "rejected": self.limiter.rejected,
+            # 远程检索服务的查询缓存统计见检索服务的 /health
+            "query_cache": query_cache.stats() if query_cache is not None else None,
+        }
+
+    def metrics(self, _body):
+        return prometheus_response()
+
+
+class ChatHandler(JSONHandler):
+    routes = {
+        ("GET", "/health"): "health",
+        ("GET", "/metrics"): "metrics",
+        ("POST", "/chat"): "chat",
+        ("POST", "/history"): "history",
+        ("POST", "/reset"): "reset",
+    }
+
+
+def start_chat_server(agent: RAGAgent, host: str = "127.0.0.1", port: int = 0,
+                      sessions: Optional[SessionStore] = None, limiter: Optional[ConcurrencyLimiter] = None):
+    """在后台线程启动聊天服务，返回 (server, base_url)；用完调用 server.shutdown()"""
+    app = ChatApp(agent, sessions if sessions is not None else SessionStore(agent), limiter)
+    server = serve(app, ChatHandler, host, port)
+    threading.Thread(target=server.serve_forever, name="chat-server", daemon=True).start()
+    stop = threading.Event()
+
+    def sweep():
+        while not stop.wait(SWEEP_INTERVAL):
+            app.sessions.sweep()
+    threading.Thread(target=sweep, name="session-sweeper", daemon=True).start()
+    server.stop_sweeper = stop.set
+    base_url = f"http://{host}:{server.server_address[1]}"
+    logger.info(f"聊天服务已启动: {base_url}")
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多会话聊天服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=CHAT_SERVER_PORT)
+    parser.add_argument("--session-db", default=CHAT_SESSION_DB, help="会话落盘的 SQLite 路径，留空则不落盘")
+    args = parser.parse_args()
+    from config.logging_config import setup_logging
+    setup_logging()
+    start_exporter()
+
+    from main import load_documents
+    from utils.answer_cache import SemanticAnswerCache
+    from utils.remote_store import RemoteVectorStore
+    from utils.search_batcher import SearchBatcher
+    if RETRIEVAL_SERVER_URL:
+        vector_store = RemoteVectorStore(RETRIEVAL_SERVER_URL)
+        batcher = None
+    else:
+        vector_store = load_documents()
+        # 并发会话的检索合并为批，共享编码与 FAISS 检索
+        batcher = SearchBatcher(vector_store)
+    agent = RAGAgent(vector_store, batcher=batcher, answer_cache=SemanticAnswerCache(ANSWER_CACHE_PATH))
+    sessions = SessionStore(agent, db_path=args.session_db or None)
+    server, _ = start_chat_server(agent, args.host, args.port, sessions)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.stop_sweeper()
+        sessions.close()
+
+
+if __name__ == "__main__":
+    main()
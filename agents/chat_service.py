@@ -1,13 +1,19 @@
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from agents.rag_agent import RAGAgent
+from utils.llm_response import AnswerStream, AsyncAnswerStream, summarize_history, summarize_history_async
+from utils.prompt_builder import history_tokens, split_history
+from config.cfg import PROMPT_HISTORY_TOKENS
 
 logger = logging.getLogger(__name__)
 
 class ChatService:
-    def __init__(self, agent: RAGAgent):
+    def __init__(self, agent: RAGAgent, history: Optional[List[Dict]] = None, summary: Optional[str] = None):
+        # agent 可被多个 ChatService（会话）共享，每个 ChatService 只持有自己的对话状态
         self.agent = agent
-        self.history: List[Dict] = []
+        self.history: List[Dict] = history if history is not None else []
+        # 较早对话的滚动摘要：历史超过 token 预算时生成一次并缓存，被摘要的消息从 history 中移除
+        self.summary: Optional[str] = summary
 
     def add_message(self, role: str, content: str):
         self.history.append({"role": role, "content": content})
@@ -15,12 +21,59 @@ class ChatService:
     def get_history(self) -> List[Dict]:
         return self.history
 
-    def ask(self, question: str) -> Dict[str, any]:
-        result = self.agent.run(question, self.history)
+    def _split_for_summary(self):
+        """历史超出预算时返回 (待摘要的较早消息, 保留的最近消息)，否则返回 None"""
+        if history_tokens(self.history) <= PROMPT_HISTORY_TOKENS:
+            return None
+        # 只保留预算一半的最近对话，避免每轮都触发摘要
+        older, recent = split_history(self.history, PROMPT_HISTORY_TOKENS // 2)
+        return (older, recent) if older else None
+
+    def _apply_summary(self, summary: Optional[str], older: List[Dict]):
+        if summary is None:
+            return
+        self.summary = summary
+        del self.history[:len(older)]
+        logger.info(f"已将 {len(older)} 条较早消息压缩为摘要")
+
+    def _compact_history(self):
+        split = self._split_for_summary()
+        if split:
+            self._apply_summary(summarize_history(self.summary, split[0]), split[0])
+
+    async def _acompact_history(self):
+        split = self._split_for_summary()
+        if split:
+            self._apply_summary(await summarize_history_async(self.summary, split[0]), split[0])
+
+    def ask(self, question: str, where: Optional[dict] = None) -> Dict[str, any]:
+        """where 为检索的元数据过滤条件，如 {"file_name": "sanziqi.docx"} 只从该文档中检索"""
+        self._compact_history()
+        result = self.agent.run(question, self.history, self.summary, where)
+        return self._record(question, result)
+
+    async def aask(self, question: str, where: Optional[dict] = None) -> Dict[str, any]:
+        await self._acompact_history()
+        result = await self.agent.arun(question, self.history, self.summary, where)
+        return self._record(question, result)
+
+    def ask_stream(self, question: str, where: Optional[dict] = None) -> AnswerStream:
+        """
+        流式提问：迭代返回值逐个获得 token，迭代结束后本轮问答写入历史，
+        stream.result 中包含 response、context 以及首 token 延迟和总延迟
+        """
+        self._compact_history()
+        stream = self.agent.stream(question, self.history, self.summary, where)
+        return stream.then(lambda result: {**result, **self._record(question, result)})
+
+    async def aask_stream(self, question: str, where: Optional[dict] = None) -> AsyncAnswerStream:
+        await self._acompact_history()
+        stream = await self.agent.astream(question, self.history, self.summary, where)
+        return stream.then(lambda result: {**result, **self._record(question, result)})
+
+    def _record(self, question: str, result: Dict) -> Dict[str, any]:
         response = result["response"]
         self.add_message("user", question)
         self.add_message("assistant", response)
-        # 更新服务的对话历史
-        self.chat_history = result["chat_history"]
-        logger.info(f"对话历史长度: {len(self.history)}")
-        return {"response": response, "context": result.get("context")}
\ No newline at end of file
+        logger.debug("对话历史长度: %d", len(self.history))
+        return {"response": response, "context": result.get("context"), "cached": result.get("cached", False)}
\ No newline at end of file
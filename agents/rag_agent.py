@@ -1,75 +1,276 @@
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, TypedDict
 from utils.vector_store import VectorStore
-from utils.llm_response import get_llm_answer
+from utils.search_batcher import SearchBatcher
+from utils.answer_cache import SemanticAnswerCache, context_fingerprint
+from utils.llm_response import (
+    AnswerStream,
+    AsyncAnswerStream,
+    CachedAnswerStream,
+    astream_llm_answer,
+    get_llm_answer,
+    get_llm_answer_async,
+    stream_llm_answer,
+)
+from utils.prompt_builder import select_context
+from utils.reranker import CrossEncoderReranker
+from utils.metrics import ANSWER_CACHE, REQUESTS, observe_stage, run_in_context, stage
+from config.logging_config import PER_QUERY
+from config.cfg import RERANK_FETCH_K, RETRIEVAL_THREADS, RETRIEVAL_TOP_K
 
 logger = logging.getLogger(__name__)
 
+class RAGState(TypedDict, total=False):
+    query: str
+    chat_history: List[Dict]
+    history_summary: Optional[str]
+    # 元数据过滤条件，如 {"file_name": "sanziqi.docx"}，见 VectorStore.search_batch
+    where: Optional[dict]
+    documents: List[dict]
+    context: str
+    response: str
+    cached: bool
+    query_embedding: Any
+    fingerprint: str
+
 class RAGAgent:
-    def __init__(self, vector_store: VectorStore):
+    def __init__(self, vector_store: VectorStore, batcher: Optional[SearchBatcher] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None,
+                 reranker: Optional[CrossEncoderReranker] = None):
         self.vector_store = vector_store
-        self.state_graph = StateGraph(dict)
+        # 并发场景下可传入 SearchBatcher，把同时到达的检索合并为一批
+        self.batcher = batcher
+        self.answer_cache = answer_cache
+        # 配置重排器时先召回 RERANK_FETCH_K 个候选，再重排取前 RETRIEVAL_TOP_K 个
+        self.reranker = reranker
+        if answer_cache is not None and vector_store is not None:
+            # 文本块被删除（文件修改或移除）后，引用它们的缓存答案随之失效
+            vector_store.add_change_listener(answer_cache.invalidate_chunks)
+        # 异步链路中检索（编码 + FAISS）是 CPU 同步调用，放到线程池执行，不阻塞事件循环
+        self._retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieve")
+        # 图只在构造时编译一次；编译后的图不持有请求状态，可被多个线程并发调用
+        self.graph = self.build_graph()
 
-    def _retrieve_context(self, query: str) -> str:
+    def _retrieve(self, query: str, where: Optional[dict] = None) -> List[dict]:
         try:
-            results = self.vector_store.search(query, k=3)
+            searcher = self.batcher or self.vector_store
+            with stage("retrieve"):
+                if self.reranker is None:
+                    results = searcher.search(query, k=RETRIEVAL_TOP_K, where=where)
+                else:
+                    candidates = searcher.search(query, k=RERANK_FETCH_K, where=where)
+                    with stage("rerank"):
+                        results = self.reranker.rerank(query, candidates, RETRIEVAL_TOP_K)
             if not results:
                 logger.warning("未检索到相关上下文")
-                return ""
-
-            context = "\n\n".join([r["text"] for r in results])
-            # logger.info(f"检索到上下文: {context}...")
-            return context
+            return results
         except Exception as e:
             logger.error(f"检索上下文失败: {e}")
-            return ""
+            return []
+
+    @staticmethod
+    def _join_context(results: List[dict]) -> str:
+        # 按排名在 token 预算内放入参考资料，超出部分截断或丢弃
+        return "\n\n".join(select_context(results))
+
+    def _retrieve_context(self, query: str, where: Optional[dict] = None) -> str:
+        return self._join_context(self._retrieve(query, where))
+
+    def _cache_lookup(self, query: str, documents: List[dict], chat_history: Optional[list] = None,
+                      history_summary: Optional[str] = None) -> RAGState:
+        """查询答案缓存；未配置缓存或未命中时 cached 为 False"""
+        if self.answer_cache is None:
+            return {"cached": False}
+        try:
+            with stage("answer_cache"):
+                query_embedding = self.vector_store.embed_query(query)
+                fingerprint = context_fingerprint(self.vector_store.store_id, [d["id"] for d in documents],
+                                                  chat_history, history_summary)
+                answer = self.answer_cache.get(query_embedding, fingerprint)
+        except Exception as e:
+            logger.error(f"查询答案缓存失败: {e}")
+            return {"cached": False}
+        ANSWER_CACHE.inc(result="hit" if answer is not None else "miss")
+        if answer is not None:
+            return {"cached": True, "response": answer}
+        return {"cached": False, "query_embedding": query_embedding, "fingerprint": fingerprint}
+
+    def _cache_store(self, state: RAGState, llm_result: dict):
+        output = llm_result.get("output", {})
+        if (self.answer_cache is None or "error" in output or output.get("interrupted")
+                or state.get("fingerprint") is None):
+            return
+        self.answer_cache.put(state["query_embedding"], state["fingerprint"], output["answer"],
+                              [d["id"] for d in state.get("documents", [])])
 
-    def _generate_response(self, query: str, context: str, chat_history: list) -> str:
+    def _generate_response(self, query: str, context: str, chat_history: list, history_summary: str = None) -> str:
         try:
             # logger.info(f"type:{type(context)}\ncontext:{context}")
             response = get_llm_answer(
                 user_query=query,
                 context_docs=[{"page_content": context, "metadata": {"title": "检索结果"}}],
-                chat_history=chat_history
+                chat_history=chat_history,
+                history_summary=history_summary
             )
 
             # # 模拟 LLM 响应（实际可接入 OpenAI）
             # response = f"根据上下文，回答如下：{query} 的相关信息是：{context[:100]}..."
-            logger.info(f"LLM 生成响应...")
+            logger.debug("LLM 生成响应...")
             return response
         except Exception as e:  
             logger.error(f"生成响应失败: {e}")
             return "抱歉，无法生成回答。"
         
-    def _process_question(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def _agenerate_response(self, query: str, context: str, chat_history: list, history_summary: str = None) -> dict:
+        response = await get_llm_answer_async(
+            user_query=query,
+            context_docs=[{"page_content": context, "metadata": {"title": "检索结果"}}],
+            chat_history=chat_history,
+            history_summary=history_summary
+        )
+        logger.debug("LLM 生成响应...")
+        return response
+
+    def _retrieve_node(self, state: RAGState) -> RAGState:
+        documents = self._retrieve(state["query"], state.get("where"))
+        return {"documents": documents, "context": self._join_context(documents)}
+
+    async def _aretrieve_node(self, state: RAGState) -> RAGState:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._retrieval_executor, run_in_context(self._retrieve_node), state)
+
+    def _cache_node(self, state: RAGState) -> RAGState:
+        return self._cache_lookup(state["query"], state.get("documents", []), state.get("chat_history"),
+                                  state.get("history_summary"))
+
+    async def _acache_node(self, state: RAGState) -> RAGState:
+        # 问题向量化是 CPU 计算，同样放到线程池
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._retrieval_executor, run_in_context(self._cache_node), state)
+
+    def _generate_node(self, state: RAGState) -> RAGState:
         try:
-            query = state["query"]
-            chat_history = state.get("chat_history", [])  # 从状态中获取历史
-            context = self._retrieve_context(query)
-            # 传入 chat_history 到生成响应的方法
-            response = self._generate_response(query, context, chat_history)['output']['answer']
-            
-            # 更新对话历史（将当前查询和响应加入历史）
-            new_chat_history = chat_history + [
-                {"role": "user", "content": query},
-                {"role": "assistant", "content": response}
-            ]
-            return {"response": response,
-                    "context": context,
-                    "chat_history": new_chat_history}
+            llm_result = self._generate_response(
+                state["query"], state.get("context", ""), state.get("chat_history") or [],
+                state.get("history_summary")
+            )
+            self._cache_store(state, llm_result)
+            return {"response": llm_result['output']['answer']}
         except Exception as e:
             logger.error(f"处理问题失败: {e}")
-            return {"response": "抱歉，处理您的问题时出错了。", "context": ""}
-        
+            return {"response": "抱歉，处理您的问题时出错了。"}
+
+    async def _agenerate_node(self, state: RAGState) -> RAGState:
+        try:
+            llm_result = await self._agenerate_response(
+                state["query"], state.get("context", ""), state.get("chat_history") or [],
+                state.get("history_summary")
+            )
+            self._cache_store(state, llm_result)
+            return {"response": llm_result['output']['answer']}
+        except Exception as e:
+            logger.error(f"处理问题失败: {e}")
+            return {"response": "抱歉，处理您的问题时出错了。"}
+
     def build_graph(self):
-        graph = self.state_graph
-        if "process" not in graph.nodes:  # 防御性检查（可选）
-            graph.add_node("process", self._process_question)
-            graph.set_entry_point("process")
-            graph.add_edge("process", END)
+        graph = StateGraph(RAGState)
+        # 同一节点同时提供同步与异步实现，invoke 与 ainvoke 共用一张编译好的图
+        graph.add_node("retrieve", RunnableLambda(self._retrieve_node, afunc=self._aretrieve_node))
+        graph.add_node("lookup_cache", RunnableLambda(self._cache_node, afunc=self._acache_node))
+        graph.add_node("generate", RunnableLambda(self._generate_node, afunc=self._agenerate_node))
+        graph.set_entry_point("retrieve")
+        graph.add_edge("retrieve", "lookup_cache")
+        # 命中答案缓存时跳过 LLM 调用
+        graph.add_conditional_edges("lookup_cache", lambda state: END if state.get("cached") else "generate")
+        graph.add_edge("generate", END)
         return graph.compile()
 
-    def run(self, query: str, chat_history: list = None) -> Dict[str, Any]:
-        logger.info(f"收到用户提问: {query}")
-        return self.build_graph().invoke({"query": query,"chat_history": chat_history})
\ No newline at end of file
+    def run(self, query: str, chat_history: list = None, history_summary: str = None,
+            where: Optional[dict] = None) -> Dict[str, Any]:
+        logger.info("收到用户提问: %s", query, extra=PER_QUERY)
+        REQUESTS.inc(mode="run")
+        with stage("request", root=True, mode="run") as span:
+            # 对话历史只读传入，由调用方（ChatService）负责追加本轮问答，避免每轮复制整段历史
+            result = self.graph.invoke({"query": query, "chat_history": chat_history or [],
+                                        "history_summary": history_summary, "where": where})
+        self._observe_graph_overhead(span)
+        return result
+
+    async def arun(self, query: str, chat_history: list = None, history_summary: str = None,
+                   where: Optional[dict] = None) -> Dict[str, Any]:
+        logger.info("收到用户提问: %s", query, extra=PER_QUERY)
+        REQUESTS.inc(mode="arun")
+        with stage("request", root=True, mode="arun") as span:
+            result = await self.graph.ainvoke(
+                {"query": query, "chat_history": chat_history or [], "history_summary": history_summary, "where": where})
+        self._observe_graph_overhead(span)
+        return result
+
+    @staticmethod
+    def _observe_graph_overhead(span):
+        """请求总耗时减去检索、缓存查询、拼装提示与 LLM 调用等阶段，剩余的即为 LangGraph 编排开销"""
+        if span is not None:
+            observe_stage("graph_overhead", max(span.duration - span.child_seconds, 0.0))
+
+    @staticmethod
+    def _stream_result(context: str, cached: bool):
+        def to_result(llm_result: dict) -> Dict[str, Any]:
+            output = llm_result["output"]
+            return {
+                "response": output["answer"],
+                "context": context,
+                "cached": cached,
+                "first_token_latency_seconds": output.get("first_token_latency_seconds"),
+                "latency_seconds": output["latency_seconds"],
+            }
+        return to_result
+
+    def _open_stream(self, state: RAGState, stream_fn):
+        context_docs = [{"page_content": state["context"], "metadata": {"title": "检索结果"}}]
+        chat_history = state.get("chat_history") or []
+        history_summary = state.get("history_summary")
+        if state.get("cached"):
+            stream = CachedAnswerStream(state["response"], state["query"], context_docs, chat_history, history_summary)
+        else:
+            stream = stream_fn(user_query=state["query"], context_docs=context_docs, chat_history=chat_history,
+                               history_summary=history_summary)
+
+            def store(llm_result: dict) -> dict:
+                self._cache_store(state, llm_result)
+                return llm_result
+            stream.then(store)
+        return stream.then(self._stream_result(state["context"], bool(state.get("cached"))))
+
+    def _prepare_stream(self, query: str, chat_history: list, history_summary: str = None,
+                        where: Optional[dict] = None) -> RAGState:
+        state: RAGState = {"query": query, "chat_history": chat_history, "history_summary": history_summary,
+                           "where": where}
+        state.update(self._retrieve_node(state))
+        state.update(self._cache_node(state))
+        return state
+
+    def stream(self, query: str, chat_history: list = None, history_summary: str = None,
+               where: Optional[dict] = None) -> AnswerStream:
+        """
+        流式问答：先完成检索，再返回逐 token 产出的回答流；迭代结束后 stream.result 为
+        {"response", "context", "cached", "first_token_latency_seconds", "latency_seconds"}
+        """
+        logger.info("收到用户提问（流式）: %s", query, extra=PER_QUERY)
+        REQUESTS.inc(mode="stream")
+        with stage("stream_prepare", root=True, mode="stream"):
+            state = self._prepare_stream(query, chat_history or [], history_summary, where)
+        return self._open_stream(state, stream_llm_answer)
+
+    async def astream(self, query: str, chat_history: list = None, history_summary: str = None,
+                      where: Optional[dict] = None) -> AsyncAnswerStream:
+        logger.info("收到用户提问（流式）: %s", query, extra=PER_QUERY)
+        REQUESTS.inc(mode="astream")
+        loop = asyncio.get_running_loop()
+        with stage("stream_prepare", root=True, mode="astream"):
+            state = await loop.run_in_executor(self._retrieval_executor, run_in_context(self._prepare_stream), query,
+                                               chat_history or [], history_summary, where)
+        return self._open_stream(state, astream_llm_answer)
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional
+
+from agents.chat_service import ChatService
+from agents.rag_agent import RAGAgent
+from config.cfg import CHAT_MAX_SESSIONS, CHAT_SESSION_IDLE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Session:
+    chat: ChatService
+    last_access: float
+    # 同一会话的请求串行执行，保证历史按轮次追加
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    # 正在处理的请求数；大于 0 时不会被淘汰
+    in_use: int = 0
+
+
+class SessionStore:
+    """
+    多会话状态：每个会话一个共享 agent 的 ChatService，按最近访问顺序保存在有界 LRU 中。
+    会话数超过 max_sessions 或空闲超过 idle_seconds 时淘汰；配置 db_path 时淘汰的会话
+    写入 SQLite，再次访问时恢复，否则直接丢弃。单个会话的历史由 ChatService 按 token 预算摘要压缩，
+    因此总内存约为 max_sessions × 单会话历史预算
+    """
+
+    def __init__(self, agent: RAGAgent, max_sessions: int = CHAT_MAX_SESSIONS,
+                 idle_seconds: float = CHAT_SESSION_IDLE_SECONDS, db_path: Optional[str] = None):
+        self.agent = agent
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.evicted = 0
+        self.restored = 0
+
+        self._conn = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " history TEXT NOT NULL,"
+                " summary TEXT,"
+                " updated REAL NOT NULL"
+                ")"
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _spill(self, session_id: str, session: Session):
+        if self._conn is None:
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, history, summary, updated) VALUES (?, ?, ?, ?)",
+            (session_id, json.dumps(session.chat.history, ensure_ascii=False), session.chat.summary,
+             session.last_access),
+        )
+        self._conn.commit()
+
+    def _load_spilled(self, session_id: str) -> Optional[Dict]:
+        """读取已写入 SQLite 的会话状态，不放回内存"""
+        if self._conn is None:
+            return None
+        row = self._conn.execute("SELECT history, summary FROM sessions WHERE session_id = ?",
+                                 (session_id,)).fetchone()
+        if row is None:
+            return None
+        return {"history": json.loads(row[0]), "summary": row[1]}
+
+    def _restore(self, session_id: str) -> Optional[ChatService]:
+        state = self._load_spilled(session_id)
+        if state is None:
+            return None
+        self.restored += 1
+        return ChatService(self.agent, **state)
+
+    def _evict(self, now: float):
+        """从最久未访问的一端淘汰空闲超时或超出数量上限的会话，跳过正在处理请求的会话"""
+        for session_id in list(self._sessions):
+            session = self._sessions[session_id]
+            over_limit = len(self._sessions) > self.max_sessions
+            idle = now - session.last_access > self.idle_seconds
+            if not over_limit and not idle:
+                break
+            if session.in_use:
+                continue
+            del self._sessions[session_id]
+            self._spill(session_id, session)
+            self.evicted += 1
+            logger.debug(f"淘汰会话 {session_id}（{'空闲超时' if idle else '超出数量上限'}）")
+
+    @contextmanager
+    def checkout(self, session_id: str) -> Iterator[ChatService]:
+        """取出会话并持有其锁直到退出 with 块；不存在时从 SQLite 恢复或新建"""
+        with self._lock:
+            now = time.time()
+            session = self._sessions.get(session_id)
+            if session is None:
+                chat = self._restore(session_id) or ChatService(self.agent)
+                session = self._sessions[session_id] = Session(chat, now)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_access = now
+            session.in_use += 1
+            self._evict(now)
+        try:
+            with session.lock:
+                yield session.chat
+        finally:
+            with self._lock:
+                session.in_use -= 1
+                session.last_access = time.time()
+
+    def history(self, session_id: str) -> Optional[Dict]:
+        """查看会话历史；已淘汰的会话直接读 SQLite，不恢复到内存，也不计入 restored"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return self._load_spilled(session_id)
+            return {"history": list(session.chat.history), "summary": session.chat.summary}
+
+    def reset(self, session_id: str) -> bool:
+        with self._lock:
+            existed = self._sessions.pop(session_id, None) is not None
+            if self._conn is not None:
+                existed |= self._conn.execute("DELETE FROM sessions WHERE session_id = ?",
+                                              (session_id,)).rowcount > 0
+                self._conn.commit()
+        return existed
+
+    def sweep(self):
+        """淘汰空闲超时的会话；由服务的后台线程定期调用，无请求时内存也会回收"""
+        with self._lock:
+            self._evict(time.time())
+
+    def close(self):
+        """把内存中的会话全部写入 SQLite（若已配置）"""
+        with self._lock:
+            for session_id, session in self._sessions.items():
+                self._spill(session_id, session)
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
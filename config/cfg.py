@@ -0,0 +1,136 @@
+# config/cfg.py
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 向量库持久化目录（索引、文本与元数据）
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join("storage", "index"))
+
+# Embedding 模型本地目录（首次使用时下载并保存到此处）
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+# 交互式启动时在后台线程预加载 Embedding 模型，首个问题无需等待模型加载
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
+# 文本块向量缓存（SQLite），按模型名 + 文本哈希寻址
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("storage", "embedding_cache.sqlite3"))
+
+# 并行入库：解析/切分进程数、大 PDF 每个任务的页数、向量化批大小
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 256))
+
+# 向量化：批大小、torch 线程数（0 表示保持 torch 默认）、输出精度、是否归一化
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+EMBED_NUM_THREADS = int(os.getenv("EMBED_NUM_THREADS", 0))
+EMBED_DTYPE = os.getenv("EMBED_DTYPE", "float32")
+EMBED_NORMALIZE = os.getenv("EMBED_NORMALIZE", "false").lower() == "true"
+
+# 向量索引类型：flat（精确）、hnsw、ivf、ivfpq，以及标量量化的 sq8（1 字节/维）、fp16（2 字节/维）。
+# 文本块数低于阈值时使用精确的 flat 索引，超过阈值后自动重建为 INDEX_TYPE 指定的索引
+INDEX_TYPE = os.getenv("INDEX_TYPE", "hnsw")
+# 距离度量：l2，或 ip（向量先做 L2 归一化，内积即余弦相似度）
+INDEX_METRIC = os.getenv("INDEX_METRIC", "l2")
+# 有损索引（sq8、ivfpq）先取 k * INDEX_RESCORE_FACTOR 个候选，再用原始 float 向量重新打分；0 表示不重打分。
+# 重打分需在索引旁另存一份 float32 向量，内存占用与 flat 索引相当，只为召回率而非省内存时才开启
+INDEX_RESCORE_FACTOR = int(os.getenv("INDEX_RESCORE_FACTOR", 4))
+INDEX_REBUILD_THRESHOLD = int(os.getenv("INDEX_REBUILD_THRESHOLD", 50000))
+# HNSW 不支持删除，删除的文本块先记为墓碑、检索时跳过；墓碑数超过索引向量数的该比例时重建压缩
+INDEX_TOMBSTONE_RATIO = float(os.getenv("INDEX_TOMBSTONE_RATIO", 0.1))
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+# IVF_NLIST 为 0 时按 4 * sqrt(N) 自动选择
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+PQ_M = int(os.getenv("PQ_M", 32))
+PQ_NBITS = int(os.getenv("PQ_NBITS", 8))
+
+# 检索微批：并发请求在等待窗口内合并为一次批量检索
+SEARCH_BATCH_MAX_SIZE = int(os.getenv("SEARCH_BATCH_MAX_SIZE", 32))
+SEARCH_BATCH_WAIT_MS = float(os.getenv("SEARCH_BATCH_WAIT_MS", 5))
+
+# 查询缓存（进程内 LRU）：查询文本 -> top-k 结果的 id 与分数，以及查询文本 -> 查询向量。
+# 结果按向量库的版本号标记，add_texts / delete 之后旧条目不再命中；条目数为 0 表示关闭
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 10000))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 10000))
+
+# LLM 接口（OpenAI 兼容），可指向本地桩服务做压测
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen-plus")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+# 共享 HTTP 连接池的大小（keep-alive 连接复用，避免每次请求重新握手）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+# 异步链路中检索所用的线程池大小
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", 8))
+
+# 语义答案缓存：问题向量余弦相似度阈值、有效期（秒）、最大条目数与持久化位置
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", os.path.join("storage", "answer_cache.sqlite3"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 10000))
+
+# 提示词 token 预算：参考资料、对话历史，以及历史超过预算时生成的滚动摘要长度
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", 1500))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", 1000))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", 300))
+
+# 混合检索：BM25 关键词检索与向量检索各取 HYBRID_FETCH_K 个候选，以 RRF 融合
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", 20))
+RRF_K = int(os.getenv("RRF_K", 60))
+BM25_K1 = float(os.getenv("BM25_K1", 1.5))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+
+# 近似重复检测：入库时为文本块计算 MinHash 签名（字符 DEDUP_SHINGLE_SIZE 元组），经 LSH 分桶
+# （DEDUP_BANDS 个桶，每桶 DEDUP_NUM_PERM / DEDUP_BANDS 行）找到估计 Jaccard 相似度不低于 DEDUP_THRESHOLD
+# 的已有文本块时，只在元数据中记录 duplicate_of，不再向量化与写入索引。
+# 检索时相似度不低于 DEDUP_COLLAPSE_THRESHOLD 的结果折叠为一条（大于 1 时不折叠）
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.85))
+DEDUP_COLLAPSE_THRESHOLD = float(os.getenv("DEDUP_COLLAPSE_THRESHOLD", 0.7))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", 64))
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", 16))
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", 5))
+
+# 两阶段检索：第一阶段召回 RERANK_FETCH_K 个候选，交叉编码器重排后取 RETRIEVAL_TOP_K 个；
+# 重排超出时间预算时退回第一阶段的顺序
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 3))
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", 50))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 16))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 150))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 100000))
+
+# 元数据过滤检索：匹配的文本块不超过该数量时按 id 取回子集向量（reconstruct_batch）精确检索；
+# 更多时带 ID 选择器检索，并按子集占比放大 efSearch / nprobe（efSearch 不超过 FILTER_MAX_EF_SEARCH）
+FILTER_EXACT_MAX_IDS = int(os.getenv("FILTER_EXACT_MAX_IDS", 20000))
+FILTER_MAX_EF_SEARCH = int(os.getenv("FILTER_MAX_EF_SEARCH", 1024))
+
+# 分片检索服务：设置 RETRIEVAL_SERVER_URL 后 main.py 通过 HTTP 使用远程检索服务，不在本进程加载向量库
+RETRIEVAL_SERVER_URL = os.getenv("RETRIEVAL_SERVER_URL", "")
+RETRIEVAL_SHARDS = int(os.getenv("RETRIEVAL_SHARDS", 4))
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", 30))
+
+# 多会话聊天服务：会话按 LRU 保留在内存中，超过上限或空闲超时后淘汰（配置 CHAT_SESSION_DB 时写入 SQLite，
+# 再次访问时恢复）；同时处理的问答数达到 CHAT_MAX_CONCURRENCY 后排队，排队数超过 CHAT_MAX_QUEUE
+# 或等待超过 CHAT_QUEUE_TIMEOUT 秒时返回 429 / 503
+CHAT_SERVER_PORT = int(os.getenv("CHAT_SERVER_PORT", 8000))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", 1000))
+CHAT_SESSION_IDLE_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", 1800))
+CHAT_SESSION_DB = os.getenv("CHAT_SESSION_DB", "storage/sessions.sqlite")
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 32))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", 256))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", 30))
+
+# 指标与追踪：各阶段耗时直方图与计数器保存在进程内，聊天服务与检索服务通过 GET /metrics 以 Prometheus
+# 文本格式暴露；main.py 交互模式下 METRICS_PORT 不为 0 时单独启动 /metrics 服务。
+# OTEL_EXPORT_PATH 不为空时按 OTLP/JSON 格式定期把指标与采样的追踪（比例为 TRACE_SAMPLE_RATE）追加到该文件
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+OTEL_EXPORT_PATH = os.getenv("OTEL_EXPORT_PATH", "")
+OTEL_EXPORT_INTERVAL = float(os.getenv("OTEL_EXPORT_INTERVAL", 30))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+# 逐条请求的日志（收到的问题、延迟等）在 INFO 级别下按该比例采样输出，DEBUG 级别时全部输出
+QUERY_LOG_SAMPLE_RATE = float(os.getenv("QUERY_LOG_SAMPLE_RATE", 0.01))
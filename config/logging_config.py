@@ -5,11 +5,39 @@ import os
 # safetynet/config/logging_config.py
 import logging
 import os
+import random
 from logging.handlers import RotatingFileHandler
 
+from config.cfg import QUERY_LOG_SAMPLE_RATE
+
+# 逐条请求的日志（每个问题都会打印的内容）带上该 extra，由 QueryLogSampler 按比例采样，例如：
+#     logger.info("收到用户提问: %s", query, extra=PER_QUERY)
+# 使用 %s 参数而非 f-string，未被采样的记录不会格式化消息
+PER_QUERY = {"per_query": True}
+
+
+class QueryLogSampler(logging.Filter):
+    """
+    对标记为逐条请求的日志按 sample_rate 采样，其余日志原样通过；根 logger 为 DEBUG 级别时全部通过。
+    采样结果记在日志记录上，控制台与文件两个处理器对同一条记录的取舍一致
+    """
+
+    def __init__(self, sample_rate: float = QUERY_LOG_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "per_query", False):
+            return True
+        sampled = getattr(record, "sampled", None)
+        if sampled is None:
+            sampled = record.sampled = (logging.getLogger().isEnabledFor(logging.DEBUG)
+                                        or random.random() < self.sample_rate)
+        return sampled
+
 def setup_logging(log_dir="logs", log_file="app.log", level=logging.INFO):
     """
-    设置全局日志格式和处理器
+    设置全局日志格式和处理器；逐条请求的日志按 QUERY_LOG_SAMPLE_RATE 采样（见 QueryLogSampler）
     """
     # 确保日志目录存在
     os.makedirs(log_dir, exist_ok=True)
@@ -39,6 +67,10 @@ def setup_logging(log_dir="logs", log_file="app.log", level=logging.INFO):
         )
         file_handler.setFormatter(file_formatter)
 
+        sampler = QueryLogSampler()
+        console_handler.addFilter(sampler)
+        file_handler.addFilter(sampler)
+
         # 添加处理器
         root_logger.addHandler(console_handler)
         root_logger.addHandler(file_handler)
@@ -1,59 +1,147 @@
+import argparse
+import json
 import logging
-import os
+import threading
+from concurrent.futures import Future
 from pathlib import Path
-from config.logging_config import setup_logging
-from utils.document_parser import parse_document, create_documents_with_metadata
-from utils.vector_store import VectorStore
-from agents.rag_agent import RAGAgent
-from agents.chat_service import ChatService
-
-# 初始化日志
-setup_logging()
+from config.logging_config import PER_QUERY, setup_logging
+from config.cfg import (INDEX_DIR, EMBEDDING_CACHE_PATH, ANSWER_CACHE_PATH, METRICS_PORT, MODEL_WARMUP, RERANK_ENABLED,
+                        RETRIEVAL_SERVER_URL)
+
+# faiss、langchain、langgraph、openai 以及 torch（sentence_transformers）等较重的模块均在函数内按需导入，
+# 交互模式可以立即显示输入提示，只查看索引的子命令（stats）不会导入 torch
 logger = logging.getLogger(__name__)
 
-def load_documents(doc_dir: str = r"data"):
-    logger.info("加载文档并构建向量库")
-    vector_store = VectorStore()
+def load_documents(doc_dir: str = r"data", persist_dir: str = INDEX_DIR, rebuild: bool = False):
+    from utils.embedding_cache import EmbeddingCache
+    from utils.ingest import IngestManifest, sync_directory
+    from utils.vector_store import VectorStore
+
     doc_dir = Path(doc_dir)
     if not doc_dir.exists():
         logger.error(f"文档目录不存在: {doc_dir} ")
         return None
-    logger.info(f"正在处理目录: {doc_dir}")
-    for file_path in doc_dir.glob("*.*"):
+
+    vector_store = None
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    manifest = IngestManifest.load(persist_dir)
+    if not rebuild and VectorStore.exists(persist_dir):
         try:
-            # text = parse_document(file_path)
-            # #按字符数切分文本为块
-            # chunks = split_text_into_chunks(text, chunk_size=300)
-            logger.info(f"正在处理文件: {file_path}")
-            documents = create_documents_with_metadata(file_path)
-            texts = [doc.page_content for doc in documents]
-            metadatas = [doc.metadata for doc in documents]
-            # metadata = [{"source_doc": str(file_path),"content":str(chunk.page_content), "text": chunk.metadata, } for chunk in chunks]
-            # logging.info(metadatas)
-            vector_store.add_texts(texts, metadatas)
+            vector_store = VectorStore.load(persist_dir, embedding_cache=embedding_cache)
         except Exception as e:
-            logger.error(f"处理文件失败: {file_path}, 错误: {e}")
-    logger.info(f"共加载 {len(vector_store.embeddings)} 个文本块")
+            logger.error(f"加载已持久化的向量库失败，重新构建: {e}")
+    if vector_store is None:
+        logger.info("加载文档并构建向量库")
+        vector_store = VectorStore(embedding_cache=embedding_cache)
+        manifest.files.clear()
+
+    # 只对新增、修改和删除的文件做增量处理
+    logger.info(f"正在处理目录: {doc_dir}")
+    stats = sync_directory(vector_store, str(doc_dir), manifest)
+    if stats["added"] or stats["updated"] or stats["removed"]:
+        vector_store.save(persist_dir)
+    manifest.save()
+    logger.info(f"共加载 {len(vector_store)} 个文本块")
     return vector_store
 
-def main():
+def inspect_index(persist_dir: str = INDEX_DIR):
+    """
+    读取已持久化的向量库并返回概况；只加载索引与 ChunkStore，不加载 Embedding 模型，
+    因此不会导入 torch。向量库不存在时返回 None
+    """
+    from utils.index_factory import index_type_of, is_lossy, metric_of
+    from utils.ingest import IngestManifest
+    from utils.vector_store import VectorStore
+
+    if not VectorStore.exists(persist_dir):
+        return None
+    store = VectorStore.load(persist_dir, mmap=True)
+    manifest = IngestManifest.load(persist_dir)
+    disk_bytes = sum(p.stat().st_size for p in Path(persist_dir).iterdir() if p.is_file())
+    return {
+        "persist_dir": persist_dir,
+        "embedding_model_name": store.embedding_model_name,
+        "store_id": store.store_id,
+        "chunks": len(store),
+        "duplicates": len(store) - store.num_indexed,
+        "files": len(manifest.files),
+        "index_type": index_type_of(store.index),
+        "metric": metric_of(store.index),
+        "lossy": is_lossy(store.index),
+        "dim": store.index.d,
+        "hybrid": store.bm25 is not None,
+        "disk_bytes": disk_bytes,
+    }
+
+def build_chat_service(doc_dir: str = r"data", warmup: bool = MODEL_WARMUP):
+    """加载向量库并构建问答服务；warmup=True 时在后台线程预加载 Embedding 模型"""
+    from utils.answer_cache import SemanticAnswerCache
+    from utils.reranker import CrossEncoderReranker
+    from utils.vector_store import VectorStore
+    from agents.rag_agent import RAGAgent
+    from agents.chat_service import ChatService
+
+    if RETRIEVAL_SERVER_URL:
+        from utils.remote_store import RemoteVectorStore
+        # 使用分片检索服务，文档由服务端（python -m utils.retrieval_server --doc-dir ...）入库
+        vector_store = RemoteVectorStore(RETRIEVAL_SERVER_URL)
+    else:
+        vector_store = load_documents(doc_dir)
+    answer_cache = None
+    if vector_store is None:
+        # 没有向量库时仍可对话（不带参考资料），答案缓存依赖文本块 id，不启用
+        logger.info("向量库加载失败，请上传文件")
+    else:
+        answer_cache = SemanticAnswerCache(ANSWER_CACHE_PATH)
+        if warmup and isinstance(vector_store, VectorStore):
+            vector_store.warmup(background=True)
+    agent = RAGAgent(vector_store, answer_cache=answer_cache,
+                     reranker=CrossEncoderReranker() if RERANK_ENABLED else None)
+    return ChatService(agent)
+
+def parse_question(text: str):
+    """“@文件名 问题” 形式的输入只在该文件中检索，返回 (问题, 过滤条件)"""
+    if text.startswith("@") and " " in text:
+        file_name, question = text[1:].split(" ", 1)
+        return question.strip(), {"file_name": file_name}
+    return text, None
+
+def print_answer(chat_service, question: str):
+    """流式输出回答，首个 token 到达即开始打印"""
+    question, where = parse_question(question)
+    print(f"问: {question}")
+    print("答: ", end="", flush=True)
+    stream = chat_service.ask_stream(question, where)
+    for token in stream:
+        print(token, end="", flush=True)
+    print("\n")
+    logger.info("首 token 延迟: %ss，总延迟: %ss", stream.result['first_token_latency_seconds'],
+                stream.result['latency_seconds'], extra=PER_QUERY)
+
+def chat(doc_dir: str = r"data", warmup: bool = MODEL_WARMUP):
     try:
         logger.info("RAG Agent 项目启动")
-        valid = False
-        doc_dir=r'D:\C_Documents\sanziqi.docx'
-        vector_store = load_documents()
-        if vector_store is None:
-            logger.info("向量库加载失败，请上传文件")
-        agent = RAGAgent(vector_store)
-        chat_service = ChatService(agent)
-        
+        # 向量库加载与问答服务构建放到后台线程，先显示输入提示，首个问题提交时再等待其完成；
+        # 守护线程不阻塞退出，索引保存先写临时文件再替换，中途退出不会写坏已有索引
+        pending = Future()
+
+        def prepare():
+            try:
+                pending.set_result(build_chat_service(doc_dir, warmup))
+            except Exception as e:
+                pending.set_exception(e)
+        threading.Thread(target=prepare, name="startup", daemon=True).start()
+        chat_service = None
+
         while True:
 
-            questions = input('请输入问题！')
+            questions = input('请输入问题（“@文件名 问题”只在该文件中检索）！')
             if questions.strip().lower() == 'exit':
                 logger.info("用户选择退出程序")
                 break
-            elif not questions.strip():
+            if chat_service is None:
+                chat_service = pending.result()
+            if not questions.strip():
                 # # 模拟用户提问
                 questions = [
                     "项目的核心功能是什么？",
@@ -61,17 +149,55 @@ def main():
                     "支持哪些文档格式？"
                 ]
                 for q in questions:
-                    result = chat_service.ask(q)
-                    print(f"问: {q}")
-                    print(f"答: {result['response']}\n")
-
-            result = chat_service.ask(questions)
-            print(f"问: {questions}")
-            print(f"答: {result['response']}\n")
-    
+                    print_answer(chat_service, q)
+                continue
+
+            print_answer(chat_service, questions)
+
     except KeyboardInterrupt:
         logger.info("程序中断，正在退出...")
     except Exception as e:
         logger.critical(f"程序异常终止: {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Agent")
+    subparsers = parser.add_subparsers(dest="command")
+    chat_parser = subparsers.add_parser("chat", help="交互式问答（默认）")
+    chat_parser.add_argument("--doc-dir", default="data")
+    chat_parser.add_argument("--no-warmup", action="store_true", help="不在后台预加载 Embedding 模型")
+    ingest_parser = subparsers.add_parser("ingest", help="将文档目录增量同步入库后退出")
+    ingest_parser.add_argument("--doc-dir", default="data")
+    ingest_parser.add_argument("--persist-dir", default=INDEX_DIR)
+    ingest_parser.add_argument("--rebuild", action="store_true", help="忽略已有向量库，全部重新入库")
+    stats_parser = subparsers.add_parser("stats", help="查看已持久化向量库的概况（不加载模型）")
+    stats_parser.add_argument("--persist-dir", default=INDEX_DIR)
+    stats_parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args(argv)
+
+    # 初始化日志
+    setup_logging()
+    if args.command == "ingest":
+        if load_documents(args.doc_dir, args.persist_dir, args.rebuild) is None:
+            raise SystemExit(1)
+    elif args.command == "stats":
+        info = inspect_index(args.persist_dir)
+        if info is None:
+            logger.error(f"向量库不存在: {args.persist_dir}")
+            raise SystemExit(1)
+        if args.json:
+            print(json.dumps(info, ensure_ascii=False, indent=1))
+        else:
+            for key, value in info.items():
+                print(f"{key:<22}{value}")
+    else:
+        from utils.metrics import start_exporter, start_metrics_server
+        start_exporter()
+        if METRICS_PORT:
+            start_metrics_server(port=METRICS_PORT)
+        if args.command == "chat":
+            chat(args.doc_dir, warmup=MODEL_WARMUP and not args.no_warmup)
+        else:
+            chat()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
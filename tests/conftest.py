@@ -0,0 +1,64 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from utils import llm_response
+from utils.llm_response import configure_client
+from utils.openai_stub import start_stub_server
+from utils.vector_store import VectorStore
+
+DIM = 32
+
+
+class StubModel:
+    """替代 SentenceTransformer 的确定性模型：向量由文本的哈希决定，同一文本总得到同一向量"""
+
+    def __init__(self, dim: int = DIM):
+        self.dim = dim
+        self.encoded = 0
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, normalize_embeddings=False,
+               show_progress_bar=False):
+        self.encoded += len(texts)
+        vectors = np.stack([
+            np.random.default_rng(int(hashlib.sha1(t.encode("utf-8")).hexdigest()[:12], 16)).standard_normal(self.dim)
+            for t in texts
+        ]).astype(np.float32)
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+@pytest.fixture
+def stub_model():
+    return StubModel()
+
+
+@pytest.fixture
+def make_store(stub_model):
+    """创建使用 StubModel 的向量库；默认关闭混合检索、近似重复检测与查询缓存，由各测试按需开启"""
+    def make(**kwargs):
+        kwargs.setdefault("hybrid", False)
+        kwargs.setdefault("dedup", False)
+        kwargs.setdefault("query_cache_size", 0)
+        store = VectorStore(**kwargs)
+        store._model = stub_model
+        return store
+    return make
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    """把 LLM 调用指向本地桩服务，桩服务把问题原样拼进回答"""
+    monkeypatch.setenv("qianwen_api_key", "test-key")
+    original = llm_response.LLM_BASE_URL
+    server, base_url = start_stub_server()
+    configure_client(base_url)
+    yield base_url
+    configure_client(original)
+    server.shutdown()
+
+
+def corpus(n: int, prefix: str = "文本块"):
+    return [f"{prefix} {i}：第 {i} 段内容，编号 {i * 7919 % 10007}" for i in range(n)]
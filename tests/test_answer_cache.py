@@ -0,0 +1,49 @@
+from agents.rag_agent import RAGAgent
+from utils.answer_cache import SemanticAnswerCache, context_fingerprint
+from tests.conftest import corpus
+
+
+def make_agent(make_store):
+    store = make_store()
+    store.add_texts(corpus(20))
+    return RAGAgent(store, answer_cache=SemanticAnswerCache())
+
+
+def lookup_and_store(agent, query, chat_history, answer):
+    documents = agent._retrieve(query)
+    state = {"query": query, "documents": documents, "chat_history": chat_history}
+    state.update(agent._cache_lookup(query, documents, chat_history))
+    if not state["cached"]:
+        agent._cache_store(state, {"output": {"answer": answer}})
+    return state
+
+
+def test_fingerprint_depends_on_history():
+    assert context_fingerprint("s", [2, 1]) == context_fingerprint("s", [1, 2])
+    assert context_fingerprint("s", [1], []) == context_fingerprint("s", [1])
+    history = [{"role": "user", "content": "介绍一下三子棋"}]
+    assert context_fingerprint("s", [1], history) != context_fingerprint("s", [1])
+    assert context_fingerprint("s", [1], history, "摘要") != context_fingerprint("s", [1], history)
+
+
+def test_same_question_with_different_history_does_not_hit(make_store):
+    agent = make_agent(make_store)
+    first = [{"role": "user", "content": "介绍一下三子棋"}, {"role": "assistant", "content": "三子棋是……"}]
+    second = [{"role": "user", "content": "介绍一下五子棋"}, {"role": "assistant", "content": "五子棋是……"}]
+
+    assert not lookup_and_store(agent, "详细说明", first, "三子棋的详细规则")["cached"]
+    other = lookup_and_store(agent, "详细说明", second, "五子棋的详细规则")
+    assert not other["cached"]
+
+    again = lookup_and_store(agent, "详细说明", first, "")
+    assert again["cached"] and again["response"] == "三子棋的详细规则"
+    again = lookup_and_store(agent, "详细说明", second, "")
+    assert again["cached"] and again["response"] == "五子棋的详细规则"
+
+
+def test_cached_answer_invalidated_when_chunk_deleted(make_store):
+    agent = make_agent(make_store)
+    state = lookup_and_store(agent, "第 3 段内容", [], "答案")
+    assert lookup_and_store(agent, "第 3 段内容", [], "")["cached"]
+    agent.vector_store.delete([state["documents"][0]["id"]])
+    assert not lookup_and_store(agent, "第 3 段内容", [], "")["cached"]
@@ -0,0 +1,22 @@
+from utils.benchmark import compare, percentiles
+
+
+def test_compare_flags_regressions_only_beyond_tolerance():
+    baseline = {"results": {"ingest": {"chunks_per_second": 1000, "chunks": 500},
+                            "search": {"qps": 200, "p50_ms": 2.0, "p95_ms": 5.0},
+                            "chat": {"llm_delay_ms": 50, "p50_ms": 60.0},
+                            "stages": {"encode": {"mean_ms": 0.1}}}}
+    results = {"ingest": {"chunks_per_second": 850, "chunks": 100},
+               "search": {"qps": 150, "p50_ms": 2.3, "p95_ms": 7.0},
+               "chat": {"llm_delay_ms": 500, "p50_ms": 61.0},
+               "stages": {"encode": {"mean_ms": 9.0}},
+               "model_load_seconds": 30}
+    regressions = compare(results, baseline, tolerance=0.2)
+    # 计数、桩服务延迟与各阶段耗时不参与判定，基线没有的指标也跳过
+    assert sorted(r.split(":")[0] for r in regressions) == ["search.p95_ms", "search.qps"]
+    assert compare(baseline, baseline) == []
+
+
+def test_percentiles():
+    stats = percentiles([0.001 * i for i in range(1, 101)])
+    assert stats["p50_ms"] < stats["p95_ms"] < stats["p99_ms"] <= 100.0
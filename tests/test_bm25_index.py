@@ -0,0 +1,15 @@
+import os
+
+from utils.bm25_index import BM25Index
+
+
+def test_save_load_round_trip(tmp_path):
+    index = BM25Index()
+    index.add([0, 1, 2], ["三子棋 的 规则", "五子棋 的 规则", "围棋 入门"])
+    index.remove([1], ["五子棋 的 规则"])
+    index.save(str(tmp_path))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    loaded = BM25Index.load(str(tmp_path))
+    assert len(loaded) == len(index)
+    assert loaded.search("三子棋 规则", 3) == index.search("三子棋 规则", 3)
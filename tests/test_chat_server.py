@@ -0,0 +1,185 @@
+import json
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import pytest
+
+from agents.chat_server import ChatApp, ChatHandler, ConcurrencyLimiter
+from utils.json_http import HTTPError, serve
+
+
+def test_limiter_queues_until_a_slot_is_released():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1, timeout=5)
+    limiter.enter()
+    entered = threading.Event()
+
+    def wait_for_slot():
+        limiter.enter()
+        entered.set()
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.001)
+    assert not entered.is_set()
+
+    limiter.release()
+    waiter.join(timeout=5)
+    assert entered.is_set() and limiter.active == 1 and limiter.waiting == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+def test_limiter_rejects_when_queue_full_or_timed_out():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=0, timeout=0.01)
+    with limiter.acquire():
+        with pytest.raises(HTTPError) as error:
+            limiter.enter()
+        assert error.value.status == 429
+    assert limiter.active == 0
+
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1, timeout=0.01)
+    with limiter.acquire():
+        with pytest.raises(HTTPError) as error:
+            limiter.enter()
+        assert error.value.status == 503 and "Retry-After" in error.value.headers
+    assert limiter.rejected == 1 and limiter.active == 0 and limiter.waiting == 0
+
+
+class FakeStream:
+    def __init__(self, tokens, fail=False):
+        self.tokens, self.fail = tokens, fail
+        self.result = {"answer": "".join(tokens)}
+
+    def __iter__(self):
+        yield from self.tokens
+        if self.fail:
+            raise RuntimeError("LLM 调用失败")
+
+
+class FakeSessions:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    @contextmanager
+    def checkout(self, session_id):
+        chat = type("Chat", (), {})()
+        chat.ask_stream = lambda message, where: FakeStream(["你", "好"], self.fail)
+        yield chat
+
+
+def events(response) -> list:
+    return [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+
+
+@pytest.fixture
+def chat_server():
+    servers = []
+
+    def start(fail=False):
+        app = ChatApp(agent=None, sessions=FakeSessions(fail), limiter=ConcurrencyLimiter(1, 0, 0.01))
+        server = serve(app, ChatHandler, "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return app, f"http://127.0.0.1:{server.server_address[1]}"
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_stream_releases_slot_and_reports_errors(chat_server):
+    app, url = chat_server(fail=True)
+    for _ in range(2):
+        response = httpx.post(url + "/chat", json={"session_id": "s", "message": "你好", "stream": True})
+        assert response.status_code == 200
+        assert events(response) == [{"token": "你"}, {"token": "好"}, {"error": "LLM 调用失败"}]
+        # 名额在响应发送完毕后才释放，客户端可能先一步读完响应
+        assert wait_until(lambda: app.limiter.active == 0)
+
+
+def test_stream_releases_slot_when_never_started():
+    app = ChatApp(agent=None, sessions=FakeSessions(), limiter=ConcurrencyLimiter(1, 0, 0.01))
+    stream = app.chat({"session_id": "s", "message": "你好", "stream": True})
+    assert app.limiter.active == 1
+    stream.close()
+    stream.close()
+    assert app.limiter.active == 0
+
+
+class RecordingLimiter(ConcurrencyLimiter):
+    def __init__(self, log, **kwargs):
+        super().__init__(**kwargs)
+        self.log = log
+
+    def enter(self):
+        self.log.append("enter")
+        super().enter()
+
+    def release(self):
+        self.log.append("release")
+        super().release()
+
+
+class RecordingSessions:
+    def __init__(self, log):
+        self.log = log
+
+    @contextmanager
+    def checkout(self, session_id):
+        self.log.append("checkout")
+        chat = type("Chat", (), {})()
+        chat.ask = lambda message, where: {"response": message}
+        chat.ask_stream = lambda message, where: FakeStream(["你", "好"])
+        try:
+            yield chat
+        finally:
+            self.log.append("checkin")
+
+
+def test_session_is_checked_out_before_taking_a_slot():
+    log = []
+    app = ChatApp(agent=None, sessions=RecordingSessions(log),
+                  limiter=RecordingLimiter(log, max_concurrency=1, max_queue=0, timeout=0.01))
+    assert app.chat({"session_id": "s", "message": "你好"})["response"] == "你好"
+    assert log == ["checkout", "enter", "release", "checkin"]
+
+    log.clear()
+    stream = app.chat({"session_id": "s", "message": "你好", "stream": True})
+    assert log == ["checkout", "enter"]
+    assert [event.get("token") for event in stream.events] == ["你", "好", None]
+    stream.close()
+    assert log == ["checkout", "enter", "release", "checkin"]
+
+    # 名额已满被拒绝时同样归还会话
+    log.clear()
+    app.limiter.enter()
+    with pytest.raises(HTTPError):
+        app.chat({"session_id": "s", "message": "你好", "stream": True})
+    assert log == ["enter", "checkout", "enter", "checkin"] and app.limiter.active == 1
+
+
+def test_malformed_request_body_returns_400(chat_server):
+    _, url = chat_server()
+    for content in (b'{"session_id": "s", "message": ', "[1, 2]".encode(), b"\xff\xfe"):
+        response = httpx.post(url + "/chat", content=content)
+        assert response.status_code == 400 and "请求体无效" in response.json()["error"]
+
+    host, port = url[len("http://"):].split(":")
+    for length in ("abc", "-1"):
+        with socket.create_connection((host, int(port)), timeout=5) as sock:
+            sock.sendall(f"POST /chat HTTP/1.1\r\nHost: x\r\nContent-Length: {length}\r\n\r\n{{}}".encode())
+            reply = sock.makefile("rb").read()
+        assert reply.startswith(b"HTTP/1.1 400")
+
+    # 服务仍可正常处理后续请求
+    response = httpx.post(url + "/chat", json={"session_id": "s", "message": "你好", "stream": True})
+    assert response.status_code == 200 and events(response)[-1]["done"]
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.chunk_store import COLUMNS_FILE, DUPLICATE_OF_KEY, ChunkStore
+
+
+def sample_store():
+    store = ChunkStore()
+    for batch in range(3):
+        ids = list(range(batch * 10, batch * 10 + 10))
+        texts = [f"第 {i} 块：中文与 ascii 混合 text" for i in ids]
+        metadata = [{"source": f"doc{i % 2}.pdf", "file_name": f"doc{i % 2}.pdf", "chunk_index": i, "page": i // 4 + 1}
+                    for i in ids]
+        store.add(ids, texts, metadata)
+    return store
+
+
+def test_text_and_metadata_lookup():
+    store = sample_store()
+    assert len(store) == 30 and 7 in store and 30 not in store
+    assert store.text(7) == "第 7 块：中文与 ascii 混合 text"
+    assert store.metadata(7) == {"source": "doc1.pdf", "file_name": "doc1.pdf", "chunk_index": 7, "page": 2}
+    assert store.texts([3, 99, 1]) == [store.text(3), store.text(1)]
+    # 元数据按文件去重，只有两个文件条目
+    assert len(store._files) == 2
+    with pytest.raises(KeyError):
+        store.text(99)
+
+
+def test_select_by_file_and_chunk_fields():
+    store = sample_store()
+    assert store.select({"file_name": "doc0.pdf"}).tolist() == list(range(0, 30, 2))
+    assert store.select({"page": range(2, 4)}).tolist() == list(range(4, 12))
+    assert store.select({"file_name": ["doc1.pdf"], "chunk_index": [1, 2, 3]}).tolist() == [1, 3]
+    assert store.select({"missing": "x"}).tolist() == []
+
+
+def test_remove_and_compact_keep_remaining_chunks():
+    store = sample_store()
+    assert store.remove([2, 1, 2, 99]) == [1, 2]
+    assert 1 not in store and len(store) == 28
+    assert store.remove(range(0, 20)) == [i for i in range(20) if i not in (1, 2)]
+    # 删除比例超过阈值后已压缩，只剩一个文件的文本块时文件表也随之回收
+    assert len(store._ids) == 10
+    assert store.ids().tolist() == list(range(20, 30))
+    assert [chunk_id for chunk_id, _ in store.items()] == list(range(20, 30))
+    assert store.text(25) == "第 25 块：中文与 ascii 混合 text"
+    store.remove(range(20, 30, 2))
+    assert store.select({"file_name": "doc0.pdf"}).tolist() == []
+    store.compact()
+    assert len(store._files) == 1 and store.metadata(21)["file_name"] == "doc1.pdf"
+
+
+def test_duplicate_column_excluded_from_indexed_ids():
+    store = sample_store()
+    store.set_values(DUPLICATE_OF_KEY, [4, 5], 3)
+    assert store.values(DUPLICATE_OF_KEY, [3, 4, 5]).tolist() == [-1, 3, 3]
+    assert 4 not in store.ids(indexed_only=True) and 4 in store.ids()
+    assert store.metadata(4)[DUPLICATE_OF_KEY] == 3
+
+
+@pytest.mark.parametrize("mmap_mode", [True, False])
+def test_save_load_round_trip(tmp_path, mmap_mode):
+    store = sample_store()
+    store.remove([0, 1])
+    store.save(str(tmp_path))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    loaded = ChunkStore.load(str(tmp_path), mmap_mode=mmap_mode)
+    assert len(loaded) == 28
+    assert [(i, t) for i, t in loaded.items()] == list(store.items())
+    assert loaded.metadata(13) == store.metadata(13)
+    assert loaded.select({"page": 3}).tolist() == store.select({"page": 3}).tolist()
+
+    # mmap 加载后首次写入时读入内存，不修改磁盘上的文件
+    loaded.add([30], ["新增块"], [{"source": "doc2.pdf"}])
+    loaded.remove([13])
+    assert loaded.text(30) == "新增块" and 13 not in loaded
+    assert 13 in ChunkStore.load(str(tmp_path))
+
+
+def test_load_without_newer_columns(tmp_path):
+    store = sample_store()
+    store.save(str(tmp_path))
+    os.remove(tmp_path / COLUMNS_FILE.format(DUPLICATE_OF_KEY))
+    loaded = ChunkStore.load(str(tmp_path))
+    assert (loaded.values(DUPLICATE_OF_KEY, range(30)) == -1).all()
+    np.testing.assert_array_equal(loaded.ids(indexed_only=True), np.arange(30))
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from utils.document_parser import (StreamingChunker, _make_splitter, iter_docx_paragraphs, iter_documents,
+                                   parse_document, split_text_to_documents)
+
+
+def reference_chunks(text, chunk_size=512, chunk_overlap=80):
+    """流式切分之前的做法：整个文件解析为一个字符串后一次性切分"""
+    chunks = _make_splitter(chunk_size, chunk_overlap).split_text(text)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def write_long_text(path, paragraphs=400):
+    rng = random.Random(7)
+    sentences = ["三子棋的棋盘为三乘三。", "双方轮流落子；", "先连成一线者获胜。", "平局时重新开始，",
+                 "先手通常占优。", "本段用于测试切分"]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(paragraphs):
+            body = "".join(rng.choice(sentences) for _ in range(rng.randint(3, 60)))
+            f.write(f"第 {i} 段 {body}\n" + ("\n" if i % 3 else ""))
+
+
+def test_iter_documents_matches_whole_file_split(tmp_path):
+    path = tmp_path / "long.txt"
+    write_long_text(path)
+    expected = reference_chunks(parse_document(str(path)))
+    # 文件大于 iter_text_blocks 的块大小与 StreamingChunker 的窗口，会跨块、跨窗口切分多次
+    assert path.stat().st_size > 1 << 16 and len(expected) > 50
+
+    documents = list(iter_documents(str(path)))
+    assert [doc.page_content for doc in documents] == expected
+    assert [doc.metadata["chunk_index"] for doc in documents] == list(range(len(expected)))
+    assert all(doc.metadata["file_name"] == "long.txt" and "page" not in doc.metadata for doc in documents)
+    assert [doc.page_content for doc in split_text_to_documents(parse_document(str(path)), str(path))] == expected
+
+
+def test_streaming_chunker_fed_in_pieces_matches_whole_split(tmp_path):
+    path = tmp_path / "long.txt"
+    write_long_text(path)
+    text = parse_document(str(path))
+    chunker = StreamingChunker(str(path))
+    documents = []
+    for start in range(0, len(text), 700):
+        documents.extend(chunker.feed(text[start:start + 700]))
+    documents.extend(chunker.finish())
+    assert [doc.page_content for doc in documents] == reference_chunks(text)
+
+
+def test_streaming_chunker_records_start_page():
+    chunker = StreamingChunker("book.pdf", chunk_size=100, chunk_overlap=10, window=300)
+    documents = []
+    for page in range(1, 6):
+        documents.extend(chunker.feed(f"第 {page} 页。" + "内容" * 60 + "\n\n", page))
+    documents.extend(chunker.finish())
+    pages = [doc.metadata["page"] for doc in documents]
+    assert pages == sorted(pages) and pages[0] == 1 and pages[-1] == 5
+    for doc in documents:
+        if doc.page_content.startswith("第 "):
+            assert doc.page_content.startswith(f"第 {doc.metadata['page']} 页")
+
+
+def test_docx_paragraphs_follow_page_breaks(tmp_path):
+    docx = pytest.importorskip("docx")
+    from docx.enum.text import WD_BREAK
+
+    document = docx.Document()
+    document.add_paragraph("第一页的段落")
+    document.add_paragraph("").add_run().add_break(WD_BREAK.PAGE)
+    document.add_paragraph("第二页的段落")
+    document.add_paragraph("   ")
+    document.add_paragraph("仍在第二页")
+    path = tmp_path / "paged.docx"
+    document.save(str(path))
+
+    assert list(iter_docx_paragraphs(str(path))) == [
+        (1, "第一页的段落\n"), (2, "第二页的段落\n"), (2, "仍在第二页\n")]
+    documents = list(iter_documents(str(path)))
+    assert [doc.metadata["page"] for doc in documents] == [1]
+    assert documents[0].page_content == "第一页的段落\n第二页的段落\n仍在第二页"
+
+
+def test_unsupported_format_is_rejected(tmp_path):
+    path = tmp_path / "table.csv"
+    path.write_text("a,b\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_documents(str(path)))
+    with pytest.raises(FileNotFoundError):
+        parse_document(str(tmp_path / "missing.txt"))
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from tests.conftest import StubModel
+from utils.embedder import EmbeddingExecutor
+
+
+class RecordingModel(StubModel):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.tokenized = 0
+
+    def tokenizer(self, texts, **kwargs):
+        self.tokenized += len(texts)
+        return {"input_ids": [[0] * len(t) for t in texts]}
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        return super().encode(texts, **kwargs)
+
+
+def test_results_keep_input_order_and_batches_group_by_length():
+    texts = ["长" * n for n in (50, 3, 20, 1, 40, 7, 30)]
+    model = RecordingModel()
+    embeddings = EmbeddingExecutor(batch_size=3, num_threads=0, dtype="float32", normalize=True).encode(model, texts)
+    np.testing.assert_allclose(embeddings, StubModel().encode(texts, normalize_embeddings=True), rtol=1e-6)
+    # 按长度排序后分批，同一批内文本长度相近
+    assert [[len(t) for t in batch] for batch in model.batches] == [[1, 3, 7], [20, 30, 40], [50]]
+    # 排序用字符数估计长度，不额外调用分词器
+    assert model.tokenized == 0
+
+
+def test_float16_output():
+    texts = [f"文本 {i}" for i in range(10)]
+    embeddings = EmbeddingExecutor(batch_size=4, num_threads=0, dtype="float16", normalize=True).encode(StubModel(), texts)
+    assert embeddings.dtype == np.float16 and embeddings.shape == (10, 32)
+    np.testing.assert_allclose(embeddings, StubModel().encode(texts, normalize_embeddings=True), atol=1e-2)
+
+
+def test_unsupported_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        EmbeddingExecutor(dtype="int8")
@@ -0,0 +1,27 @@
+import numpy as np
+
+from tests.conftest import corpus
+from utils.index_eval import evaluate, recall_at_k
+
+
+def test_recall_at_k_ignores_padding():
+    truth = np.array([[1, 2, 3], [4, 5, -1]])
+    found = np.array([[3, 9, 1], [5, -1, -1]])
+    assert recall_at_k(truth, found) == 3 / 5
+
+
+def test_compression_counts_raw_vectors_for_rescoring(make_store):
+    store = make_store()
+    store.add_texts(corpus(300))
+    queries = np.asarray(store._encode(corpus(10)), dtype=np.float32)
+    flat_bytes = 300 * store.index.d * 4
+
+    rows = {row["index_type"]: row for row in evaluate(store, queries, ["flat", "sq8"], k=5, rescore_factor=4)}
+    assert rows["flat"]["raw_vector_bytes"] == 0 and rows["flat"]["rescored_recall@5"] is None
+    sq8 = rows["sq8"]
+    assert sq8["raw_vector_bytes"] == flat_bytes + 300 * 8
+    assert sq8["compression"] == round(flat_bytes / (sq8["index_bytes"] + sq8["raw_vector_bytes"]), 2) < 1
+    assert sq8["rescored_recall@5"] == 1.0
+
+    sq8 = evaluate(store, queries, ["sq8"], k=5, rescore_factor=0)[0]
+    assert sq8["raw_vector_bytes"] == 0 and sq8["compression"] > 3
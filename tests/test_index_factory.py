@@ -0,0 +1,68 @@
+import faiss
+import numpy as np
+import pytest
+
+from utils.index_factory import (
+    INDEX_TYPES,
+    build_index,
+    can_reconstruct,
+    ensure_direct_map,
+    exact_search,
+    filtered_search,
+    index_type_of,
+)
+
+LOSSY_RECALL = 0.8
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+    ids = np.arange(len(vectors), dtype=np.int64) * 3
+    queries = rng.standard_normal((8, 16)).astype(np.float32)
+    return vectors, ids, queries
+
+
+def recall(found: np.ndarray, expected: np.ndarray) -> float:
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found.tolist(), expected.tolist())])
+
+
+@pytest.mark.parametrize("index_type", sorted(INDEX_TYPES))
+def test_small_filter_uses_exact_search(data, index_type):
+    vectors, ids, queries = data
+    index = build_index(index_type, 16, train_vectors=vectors)
+    index.add_with_ids(vectors, ids)
+    assert index_type_of(index) == index_type
+    assert can_reconstruct(index)
+
+    subset = ids[::40]
+    _, expected = exact_search(queries, vectors[::40], subset, 5)
+    _, found = filtered_search(index, queries, 5, subset)
+    assert np.isin(found, subset).all()
+    assert recall(found, expected) >= (LOSSY_RECALL if index_type in ("ivfpq", "sq8") else 1.0)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf"])
+def test_large_filter_stays_within_subset(data, index_type):
+    vectors, ids, queries = data
+    index = build_index(index_type, 16, train_vectors=vectors)
+    index.add_with_ids(vectors, ids)
+    subset = ids[::2]
+    _, found = filtered_search(index, queries, 5, subset, exact_max_ids=10)
+    assert (found >= 0).all() and np.isin(found, subset).all()
+
+
+def test_ivf_without_direct_map_gets_one_after_mmap_load(data, tmp_path):
+    vectors, ids, queries = data
+    index = build_index("ivf", 16, train_vectors=vectors)
+    faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.NoMap)
+    index.add_with_ids(vectors, ids)
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(index, path)
+
+    loaded = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    assert not can_reconstruct(loaded)
+    ensure_direct_map(loaded)
+    assert can_reconstruct(loaded)
+    np.testing.assert_array_equal(loaded.reconstruct_batch(ids[:10]), vectors[:10])
@@ -0,0 +1,72 @@
+import os
+
+from utils.document_parser import create_documents_with_metadata
+from utils.ingest import IngestManifest, bulk_ingest, sync_directory
+
+
+def write_doc(path, topic, paragraphs=20):
+    path.write_text("".join(f"{topic}第 {i} 段：" + f"关于{topic}的说明。" * 20 + "\n\n" for i in range(paragraphs)),
+                    encoding="utf-8")
+
+
+def test_sync_directory_only_reembeds_changed_files(make_store, stub_model, tmp_path):
+    docs, persist = tmp_path / "docs", tmp_path / "store"
+    docs.mkdir()
+    for name in ("a", "b", "c"):
+        write_doc(docs / f"{name}.txt", name)
+    store = make_store()
+    manifest = IngestManifest.load(str(persist))
+    assert sync_directory(store, str(docs), manifest, max_workers=1) == {
+        "added": 3, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    manifest.save()
+    total = len(store)
+    assert stub_model.encoded == total
+
+    # 只修改 b、删除 c、touch a（内容不变），再新增 d
+    write_doc(docs / "b.txt", "b", paragraphs=5)
+    os.remove(docs / "c.txt")
+    stat = os.stat(docs / "a.txt")
+    os.utime(docs / "a.txt", (stat.st_atime, stat.st_mtime + 10))
+    write_doc(docs / "d.txt", "d", paragraphs=3)
+
+    manifest = IngestManifest.load(str(persist))
+    old_b, old_c = manifest.files[str(docs / "b.txt")]["chunk_ids"], manifest.files[str(docs / "c.txt")]["chunk_ids"]
+    encoded = stub_model.encoded
+    assert sync_directory(store, str(docs), manifest, max_workers=1) == {
+        "added": 1, "updated": 1, "unchanged": 1, "removed": 1, "failed": 0}
+    new_b, new_d = manifest.files[str(docs / "b.txt")]["chunk_ids"], manifest.files[str(docs / "d.txt")]["chunk_ids"]
+    assert stub_model.encoded == encoded + len(new_b) + len(new_d)
+    assert not set(old_b + old_c) & set(store.chunks.ids())
+    assert len(store) == total - len(old_b) - len(old_c) + len(new_b) + len(new_d)
+    assert manifest.files[str(docs / "a.txt")]["mtime"] == os.stat(docs / "a.txt").st_mtime
+
+    # 没有任何变化时不编码
+    encoded = stub_model.encoded
+    assert sync_directory(store, str(docs), manifest, max_workers=1)["unchanged"] == 3
+    assert stub_model.encoded == encoded
+
+
+def test_parallel_bulk_ingest_matches_serial(make_store, tmp_path):
+    paths = []
+    for name in ("甲", "乙", "丙"):
+        path = tmp_path / f"{name}.txt"
+        write_doc(path, name)
+        paths.append(str(path))
+
+    serial, parallel = make_store(), make_store()
+    serial_ids = bulk_ingest(serial, paths, max_workers=1, batch_size=16)
+    parallel_ids = bulk_ingest(parallel, paths, max_workers=2, batch_size=16)
+    for path in paths:
+        expected = [doc.page_content for doc in create_documents_with_metadata(path)]
+        assert [serial.chunks.text(i) for i in serial_ids[path]] == expected
+        assert [parallel.chunks.text(i) for i in parallel_ids[path]] == expected
+        assert [parallel.chunks.metadata(i)["chunk_index"] for i in parallel_ids[path]] == list(range(len(expected)))
+
+
+def test_bulk_ingest_reports_failed_files(make_store, tmp_path):
+    good = tmp_path / "good.txt"
+    write_doc(good, "好")
+    store = make_store()
+    results = bulk_ingest(store, [str(tmp_path / "missing.txt"), str(good)], max_workers=1)
+    assert results[str(tmp_path / "missing.txt")] is None
+    assert len(results[str(good)]) == len(store) > 0
@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import main
+from tests.conftest import corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "sentence_transformers", "langgraph", "openai")
+
+SCRIPT = """
+import json, sys
+import main
+main.main(["stats", "--persist-dir", sys.argv[1], "--json"])
+print(json.dumps([name for name in sys.argv[2:] if name in sys.modules]))
+"""
+
+
+def test_stats_does_not_import_heavy_modules(make_store, tmp_path):
+    store = make_store(dedup=True)
+    store.add_texts(corpus(10) + [corpus(10)[0]])
+    store.save(str(tmp_path / "index"))
+
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    # 在临时目录中运行，日志文件不写入仓库
+    output = subprocess.run([sys.executable, "-c", SCRIPT, str(tmp_path / "index"), *HEAVY_MODULES],
+                            cwd=tmp_path, env=env, capture_output=True, text=True, check=True).stdout
+    info_text, imported = output.rsplit("\n", 2)[:2]
+    assert json.loads(imported) == []
+    info = json.loads(info_text)
+    assert info["chunks"] == 11 and info["duplicates"] == 1 and info["index_type"] == "flat"
+
+
+def test_chat_starts_without_documents(stub_llm, tmp_path):
+    # 文档目录不存在时向量库为 None，仍可不带参考资料地对话
+    service = main.build_chat_service(str(tmp_path / "missing"), warmup=False)
+    assert service.agent.vector_store is None and service.agent.answer_cache is None
+    result = service.ask("你好")
+    assert result["response"] == "桩服务回答：你好" and not result["context"]
+
+
+def test_parse_question_extracts_file_filter():
+    assert main.parse_question("@sanziqi.docx 怎么赢") == ("怎么赢", {"file_name": "sanziqi.docx"})
+    assert main.parse_question("普通问题") == ("普通问题", None)
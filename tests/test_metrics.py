@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from utils import metrics
+from utils.metrics import REGISTRY, STAGE_SECONDS, Counter, Histogram, OTLPFileExporter, stage
+
+
+def test_histogram_quantile_and_prometheus_buckets():
+    histogram = Histogram("test_seconds", "测试耗时", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 2.0):
+        histogram.observe(value, stage="a")
+    assert histogram.quantile(0.5, stage="a") == pytest.approx(0.55)
+    assert histogram.quantile(0.5, stage="b") is None
+    lines = histogram.render_prometheus()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="1"} 3' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="a"} 4' in lines
+
+
+def test_counter_requires_declared_labels():
+    counter = Counter("test_total", "测试计数", ("result",))
+    counter.inc(result="hit")
+    counter.inc(2, result="hit")
+    assert counter.value(result="hit") == 3 and counter.value(result="miss") == 0
+    with pytest.raises(ValueError):
+        counter.inc(kind="hit")
+
+
+def test_stage_records_duration_and_renders():
+    before = STAGE_SECONDS.snapshot().get(("test_stage",), (None, 0.0, 0))[2]
+    with stage("test_stage"):
+        pass
+    with pytest.raises(RuntimeError):
+        with stage("test_stage"):
+            raise RuntimeError("阶段内的异常照常抛出，耗时仍然记录")
+    assert STAGE_SECONDS.snapshot()[("test_stage",)][2] == before + 2
+    assert 'rag_stage_seconds_count{stage="test_stage"}' in REGISTRY.render_prometheus()
+    assert metrics.stage_summary()["test_stage"]["count"] == before + 2
+
+
+def test_sampled_request_exports_nested_spans(tmp_path, monkeypatch):
+    exporter = OTLPFileExporter(str(tmp_path / "otlp.jsonl"))
+    monkeypatch.setattr(metrics, "_exporter", exporter)
+    monkeypatch.setattr(metrics, "TRACE_SAMPLE_RATE", 1.0)
+    with stage("test_request", root=True, mode="sync") as root:
+        with stage("test_child"):
+            pass
+    assert root.child_seconds <= root.duration
+    exporter.flush()
+
+    with open(tmp_path / "otlp.jsonl", encoding="utf-8") as f:
+        spans_line, metrics_line = [json.loads(line) for line in f]
+    spans = {s["name"]: s for s in spans_line["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+    assert spans["test_child"]["parentSpanId"] == spans["test_request"]["spanId"]
+    assert spans["test_child"]["traceId"] == spans["test_request"]["traceId"]
+    assert "parentSpanId" not in spans["test_request"]
+    assert "rag_stage_seconds" in json.dumps(metrics_line)
@@ -0,0 +1,29 @@
+from utils.near_duplicates import NearDuplicateIndex, shingle_hashes
+
+BASE = "检索增强生成先从知识库中检索与问题相关的文本块，再把它们作为参考资料交给大模型生成回答。" * 2
+
+
+def test_shingles_ignore_case_and_whitespace():
+    assert (shingle_hashes("Hello   World\n") == shingle_hashes("hello world")).all()
+
+
+def test_finds_near_duplicates_but_not_different_texts():
+    index = NearDuplicateIndex(threshold=0.8)
+    index.add_texts([1, 2], [BASE, "向量索引把文本块编码为向量，按相似度返回最接近的若干条，与关键词检索互为补充。" * 2])
+    assert index.find(index.signature(BASE + "。")) == 1
+    assert index.find(index.signature(BASE.replace("大模型", "语言模型"))) == 1
+    assert index.find(index.signature("完全无关的内容：今天的天气晴朗，适合外出散步。")) is None
+
+    index.remove([1, 42])
+    assert 1 not in index and len(index) == 1
+    assert index.find(index.signature(BASE)) is None
+
+
+def test_save_load_round_trip(tmp_path):
+    index = NearDuplicateIndex()
+    index.add_texts(range(3), [BASE, BASE[::-1], "第三段"])
+    index.save(str(tmp_path))
+    loaded = NearDuplicateIndex.load(str(tmp_path))
+    assert len(loaded) == 3 and loaded.find(loaded.signature(BASE)) == 0
+    # 签名参数变化后加载为空索引，由调用方重建
+    assert len(NearDuplicateIndex.load(str(tmp_path), seed=2)) == 0
@@ -0,0 +1,31 @@
+from utils.prompt_builder import count_tokens, history_tokens, select_context, split_history, truncate_to_tokens
+
+
+def test_select_context_stays_within_budget():
+    documents = [{"text": f"第 {i} 条参考资料。" + "内容" * 100} for i in range(10)]
+    selected = select_context(documents, budget=500)
+    assert sum(count_tokens(text) for text in selected) <= 500
+    # 按检索排名放入，最后一条截断保留
+    assert selected[:-1] == [doc["text"] for doc in documents[:len(selected) - 1]]
+    assert documents[len(selected) - 1]["text"].startswith(selected[-1]) and selected[-1] != documents[len(selected) - 1]["text"]
+    assert select_context(documents, budget=10) == []
+
+
+def test_truncate_prefers_sentence_boundary():
+    text = "第一句话说明规则。" * 20 + "最后一句没有句号" * 20
+    cut = truncate_to_tokens(text, 150)
+    assert count_tokens(cut) <= 150 and cut.endswith("。") and text.startswith(cut)
+    assert truncate_to_tokens("短文本", 10) == "短文本"
+
+
+def test_split_history_keeps_recent_turns_starting_with_user():
+    history = []
+    for i in range(10):
+        history += [{"role": "user", "content": f"问题 {i} " + "问" * 30},
+                    {"role": "assistant", "content": f"回答 {i} " + "答" * 60}]
+    older, recent = split_history(history, budget=300)
+    assert older + recent == history
+    assert recent and recent[0]["role"] == "user" and history_tokens(recent) <= 300
+    assert len(recent) % 2 == 0 and recent[-1] == history[-1]
+    assert split_history(history, budget=100000) == ([], history)
+    assert split_history(history, budget=10) == (history, [])
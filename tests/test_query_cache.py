@@ -0,0 +1,34 @@
+import numpy as np
+
+from utils.query_cache import QueryCache
+
+
+def test_results_expire_with_version_and_drop_hydrated_fields():
+    cache = QueryCache(max_results=2, max_embeddings=2)
+    cache.put_results(("q", 3, None), 1, [{"id": 7, "score": 0.5, "text": "正文", "metadata": {"source": "a"}}])
+    assert cache.get_results(("q", 3, None), 1) == [{"id": 7, "score": 0.5}]
+    assert cache.get_results(("q", 3, None), 2) is None
+    # 过期条目已移除，回到旧版本号也不再命中
+    assert cache.get_results(("q", 3, None), 1) is None
+    assert cache.stats()["result_stale"] == 1
+
+
+def test_lru_eviction():
+    cache = QueryCache(max_results=2, max_embeddings=2)
+    for key in ("a", "b"):
+        cache.put_results(key, 0, [])
+        cache.put_embedding(key, np.zeros(2, dtype=np.float32))
+    cache.get_results("a", 0)
+    cache.get_embedding("a")
+    cache.put_results("c", 0, [])
+    cache.put_embedding("c", np.ones(2, dtype=np.float32))
+    assert cache.get_results("b", 0) is None and cache.get_results("a", 0) == []
+    assert cache.get_embedding("b") is None and cache.get_embedding("a") is not None
+    assert cache.stats()["results"] == cache.stats()["embeddings"] == 2
+
+
+def test_zero_size_disables_cache():
+    cache = QueryCache(max_results=0, max_embeddings=0)
+    cache.put_results("q", 0, [{"id": 1}])
+    cache.put_embedding("q", np.zeros(2, dtype=np.float32))
+    assert cache.get_results("q", 0) is None and cache.get_embedding("q") is None
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from agents.chat_service import ChatService
+from agents.rag_agent import RAGAgent
+from tests.conftest import corpus
+from utils.answer_cache import SemanticAnswerCache
+
+
+@pytest.fixture
+def agent(make_store, stub_llm):
+    store = make_store()
+    store.add_texts(corpus(30))
+    return RAGAgent(store)
+
+
+def test_run_retrieves_and_answers(agent):
+    graph = agent.graph
+    question = corpus(30)[3]
+    result = agent.run(question)
+    assert result["response"] == f"桩服务回答：{question}"
+    assert result["context"].startswith(question)
+    # 图在构造时编译一次，之后的请求复用
+    agent.run("另一个问题")
+    assert agent.graph is graph
+
+
+def test_arun_matches_run(agent):
+    async def ask_all():
+        return await asyncio.gather(*(agent.arun(f"问题 {i}") for i in range(5)))
+
+    results = asyncio.run(ask_all())
+    assert [r["response"] for r in results] == [f"桩服务回答：问题 {i}" for i in range(5)]
+    assert results[0]["context"] == agent.run("问题 0")["context"]
+
+
+def test_stream_tokens_join_to_response(agent):
+    stream = agent.stream("流式提问")
+    tokens = list(stream)
+    assert len(tokens) > 1 and "".join(tokens) == "桩服务回答：流式提问"
+    assert stream.result["response"] == "".join(tokens)
+    assert stream.result["first_token_latency_seconds"] <= stream.result["latency_seconds"]
+
+    async def consume():
+        astream = await agent.astream("异步流式提问")
+        return [token async for token in astream], astream.result
+
+    tokens, result = asyncio.run(consume())
+    assert "".join(tokens) == result["response"] == "桩服务回答：异步流式提问"
+
+
+def test_chat_service_records_history(agent):
+    service = ChatService(agent)
+    assert service.ask("第一个问题")["response"] == "桩服务回答：第一个问题"
+    stream = service.ask_stream("第二个问题")
+    assert "".join(stream) == "桩服务回答：第二个问题"
+    assert service.get_history() == [
+        {"role": "user", "content": "第一个问题"}, {"role": "assistant", "content": "桩服务回答：第一个问题"},
+        {"role": "user", "content": "第二个问题"}, {"role": "assistant", "content": "桩服务回答：第二个问题"}]
+
+
+def test_stream_stopped_early_still_records_the_turn(make_store, stub_llm):
+    store = make_store()
+    store.add_texts(corpus(30))
+    agent = RAGAgent(store, answer_cache=SemanticAnswerCache())
+    service = ChatService(agent)
+    stream = service.ask_stream("提前结束的问题")
+    for token in stream:
+        break
+    # 已产出的部分作为回答写入历史，但不完整的回答不写入答案缓存
+    assert stream.result["response"] == token
+    assert service.get_history() == [{"role": "user", "content": "提前结束的问题"},
+                                     {"role": "assistant", "content": token}]
+    again = agent.stream("提前结束的问题")
+    assert "".join(again) == "桩服务回答：提前结束的问题" and not again.result["cached"]
+    cached = agent.stream("提前结束的问题")
+    assert "".join(cached) == "桩服务回答：提前结束的问题" and cached.result["cached"]
+
+    async def consume_one():
+        astream = await agent.astream("异步提前结束")
+        tokens = astream.__aiter__()
+        first = await tokens.__anext__()
+        await tokens.aclose()
+        return first, astream.result
+
+    first, result = asyncio.run(consume_one())
+    assert result["response"] == first
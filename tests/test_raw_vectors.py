@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from utils.raw_vectors import RawVectorStore
+
+
+def test_add_remove_and_lookup_out_of_order(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((10, 4)).astype(np.float32)
+    store = RawVectorStore()
+    store.add(range(5, 10), vectors[5:])
+    store.add(range(0, 5), vectors[:5])
+    assert store.remove([7, 3, 7, 42]) == 2
+    assert len(store) == 8
+    np.testing.assert_array_equal(store.vectors([9, 0, 4]), vectors[[9, 0, 4]])
+    with pytest.raises(KeyError):
+        store.vectors([3])
+
+    store.save(str(tmp_path))
+    loaded = RawVectorStore.load(str(tmp_path), mmap_mode=True)
+    ids, loaded_vectors = loaded.items()
+    assert ids.tolist() == [0, 1, 2, 4, 5, 6, 8, 9]
+    np.testing.assert_array_equal(loaded_vectors, vectors[ids])
+    loaded.add([10], vectors[:1])
+    np.testing.assert_array_equal(loaded.vectors([10]), vectors[:1])
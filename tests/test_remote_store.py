@@ -0,0 +1,19 @@
+from utils.remote_store import RemoteVectorStore
+from utils.search_batcher import SearchBatcher
+
+
+def test_search_batcher_over_remote_store(monkeypatch):
+    store = RemoteVectorStore.__new__(RemoteVectorStore)
+    calls = []
+
+    def call(method, path, body=None):
+        calls.append(body)
+        return {"results": [[{"id": 3, "score": 0.1, "text": q, "metadata": {}}] for q in body["queries"]]}
+    monkeypatch.setattr(store, "_call", call)
+    batcher = SearchBatcher(store)
+    try:
+        assert store.cached_search("三子棋", 3) is None
+        assert batcher.search("三子棋", 3)[0]["text"] == "三子棋"
+        assert calls[0]["queries"] == ["三子棋"]
+    finally:
+        batcher.close()
@@ -0,0 +1,47 @@
+import time
+
+from utils.reranker import CrossEncoderReranker
+
+
+class StubCrossEncoder:
+    """按文本中问题字符出现的次数打分"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.pairs = 0
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        time.sleep(self.delay)
+        self.pairs += len(pairs)
+        return [sum(text.count(ch) for ch in query) for query, text in pairs]
+
+
+def make_hits():
+    texts = ["无关内容", "三子棋规则", "三子棋三子棋", "棋"]
+    return [{"id": i, "text": text, "score": 1.0 - i / 10} for i, text in enumerate(texts)]
+
+
+def test_rerank_orders_by_cross_encoder_and_caches_scores():
+    reranker = CrossEncoderReranker(batch_size=2, budget_ms=10000)
+    reranker._model = StubCrossEncoder()
+    ranked = reranker.rerank("三子棋", make_hits(), top_k=3)
+    assert [h["id"] for h in ranked] == [2, 1, 3]
+    assert ranked[0]["rerank_score"] == 6 and ranked[0]["text"] == "三子棋三子棋"
+
+    assert reranker.rerank("三子棋", make_hits(), top_k=3) == ranked
+    assert reranker._model.pairs == 4
+    stats = reranker.stats()
+    assert stats["calls"] == 2 and stats["fallbacks"] == 0 and stats["cache_hit_rate"] == 0.5
+
+
+def test_rerank_falls_back_to_first_stage_order_over_budget():
+    reranker = CrossEncoderReranker(batch_size=1, budget_ms=5)
+    reranker._model = StubCrossEncoder(delay=0.02)
+    hits = make_hits()
+    assert reranker.rerank("三子棋", hits, top_k=2) == hits[:2]
+    assert reranker.fallbacks == 1
+    # 超出预算前算出的分数已写入缓存，下次只需补算其余候选
+    assert 0 < reranker._model.pairs < len(hits)
+    reranker.budget = 10
+    assert [h["id"] for h in reranker.rerank("三子棋", hits, top_k=2)] == [2, 1]
+    assert reranker._model.pairs == len(hits)
@@ -0,0 +1,121 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.conftest import corpus
+from utils.retrieval_server import CoordinatorApp, ShardApp, shard_of, to_global_id, to_local_id
+from utils.search_batcher import SearchBatcher
+
+NUM_SHARDS = 3
+
+
+def make_shard(store, shard):
+    app = ShardApp.__new__(ShardApp)
+    app.shard, app.num_shards, app.store = shard, NUM_SHARDS, store
+    app._lock = threading.Lock()
+    app.batcher = SearchBatcher(store, lock=app._lock)
+    return app
+
+
+@pytest.fixture
+def cluster(make_store):
+    """协调器直接调用进程内的 ShardApp，不经过 HTTP；failing 中的分片在 /add 时抛出异常"""
+    shards = [make_shard(make_store(), i) for i in range(NUM_SHARDS)]
+    failing = set()
+
+    def call(shard, method, path, body=None):
+        if path == "/add" and shard in failing:
+            raise RuntimeError("分片不可用")
+        return getattr(shards[shard], path.strip("/"))(body)
+
+    app = CoordinatorApp.__new__(CoordinatorApp)
+    app.shard_urls = [f"shard-{i}" for i in range(NUM_SHARDS)]
+    app.num_shards = NUM_SHARDS
+    app.executor = ThreadPoolExecutor(max_workers=NUM_SHARDS)
+    app.metric, app.higher_is_better = "l2", False
+    app._call = call
+    yield app, shards, failing
+    for shard in shards:
+        shard.batcher.close()
+    app.executor.shutdown()
+
+
+def test_global_id_round_trip():
+    for shard in range(NUM_SHARDS):
+        for local_id in (0, 1, 17):
+            assert to_local_id(to_global_id(local_id, shard, NUM_SHARDS), NUM_SHARDS) == (shard, local_id)
+
+
+def add_documents(app, n=30):
+    texts = corpus(n)
+    metadata = [{"source": f"doc{i % 5}.txt", "chunk_index": i} for i in range(n)]
+    return texts, metadata, app.add({"texts": texts, "metadata": metadata})["ids"]
+
+
+def test_add_routes_by_source_and_maps_ids(cluster):
+    app, shards, _ = cluster
+    texts, metadata, ids = add_documents(app)
+    assert len(ids) == len(texts) and len(set(ids)) == len(ids)
+    for chunk_id, text, meta in zip(ids, texts, metadata):
+        shard, local_id = to_local_id(chunk_id, NUM_SHARDS)
+        assert shard == shard_of(meta["source"], NUM_SHARDS)
+        assert shards[shard].store.chunks.text(local_id) == text
+
+    hits = app.search({"queries": [texts[7]], "k": 3})["results"][0]
+    assert hits[0]["id"] == ids[7] and hits[0]["text"] == texts[7]
+    hits = app.search({"queries": [texts[7]], "k": 3, "where": {"source": "doc2.txt"}})["results"][0]
+    assert hits[0]["id"] == ids[7] and {h["metadata"]["source"] for h in hits} == {"doc2.txt"}
+
+    assert app.delete({"ids": [ids[7], ids[8]]})["removed"] == 2
+    assert ids[7] not in [h["id"] for h in app.search({"queries": [texts[7]], "k": 3})["results"][0]]
+
+
+def test_partial_add_failure_rolls_back(cluster):
+    app, shards, failing = cluster
+    failing.add(shard_of("doc1.txt", NUM_SHARDS))
+    reply = app.add({"texts": corpus(30), "metadata": [{"source": f"doc{i % 5}.txt"} for i in range(30)]})
+    assert reply["ids"] == [] and reply["error"]
+    assert sum(len(shard.store) for shard in shards) == 0
+
+
+def test_shard_search_waits_for_writes(make_store):
+    shard = make_shard(make_store(), 0)
+    texts = corpus(20)
+    shard.add({"texts": texts})
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        # 写入持有锁期间，合批检索与多查询检索都不会读取向量库
+        with shard._lock:
+            single = pool.submit(shard.search, {"queries": [texts[3]], "k": 2})
+            multi = pool.submit(shard.search, {"queries": texts[:2], "k": 2})
+            assert not single.done() and not multi.done()
+            threading.Event().wait(0.05)
+            assert not single.done() and not multi.done()
+        assert single.result(timeout=5)["results"][0][0]["id"] == to_global_id(3, 0, NUM_SHARDS)
+        assert len(multi.result(timeout=5)["results"]) == 2
+    shard.batcher.close()
+
+
+def test_shard_concurrent_add_delete_and_search(make_store):
+    # 小阈值下写入会把 flat 重建为 HNSW，删除积累墓碑后再次重建，检索与之交错进行
+    shard = make_shard(make_store(index_type="hnsw", rebuild_threshold=50), 0)
+    texts = corpus(400)
+    shard.add({"texts": texts[:40]})
+
+    def write(start):
+        ids = shard.add({"texts": texts[start:start + 40]})["ids"]
+        shard.delete({"ids": [to_local_id(i, NUM_SHARDS)[1] for i in ids[:20]]})
+
+    def read(i):
+        queries = [texts[i % 40]] if i % 2 else texts[i % 40:i % 40 + 3]
+        return shard.search({"queries": queries, "k": 3})["results"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        writes = [pool.submit(write, start) for start in range(40, 400, 40)]
+        reads = [pool.submit(read, i) for i in range(200)]
+        for future in writes + reads:
+            future.result(timeout=30)
+    assert len(shard.store) == 40 + 9 * 20
+    hits = shard.search({"queries": [texts[5]], "k": 1})["results"][0]
+    assert hits[0]["id"] == to_global_id(5, 0, NUM_SHARDS)
+    shard.batcher.close()
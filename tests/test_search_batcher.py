@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from tests.conftest import corpus
+from utils.search_batcher import SearchBatcher
+
+
+@pytest.fixture
+def store(make_store):
+    store = make_store()
+    store.add_texts(corpus(50))
+    return store
+
+
+def test_concurrent_searches_match_direct_search(store):
+    batcher = SearchBatcher(store, max_wait_ms=20)
+    texts = corpus(50)
+    queries = [(texts[i], 1 + i % 4, {"chunk_index": -1} if i % 3 == 0 else None) for i in range(24)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda q: batcher.search(*q), queries))
+    assert results == [store.search(*q) for q in queries]
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.search(texts[0])
+
+
+def test_worker_survives_failures(store, monkeypatch):
+    batcher = SearchBatcher(store, max_wait_ms=1)
+    texts = corpus(50)
+
+    # 检索失败时异常传给调用方
+    search_batch = store.search_batch
+    monkeypatch.setattr(store, "search_batch", lambda *args: (_ for _ in ()).throw(RuntimeError("检索失败")))
+    with pytest.raises(RuntimeError, match="检索失败"):
+        batcher.search(texts[1])
+    monkeypatch.setattr(store, "search_batch", search_batch)
+
+    # 合批等查询之外的步骤出错时，已取出的查询同样收到异常，工作线程继续运行
+    collect = batcher._collect
+    monkeypatch.setattr(batcher, "_collect", lambda batch: (_ for _ in ()).throw(RuntimeError("合批失败")))
+    with pytest.raises(RuntimeError, match="合批失败"):
+        batcher.search(texts[2])
+    monkeypatch.setattr(batcher, "_collect", collect)
+    assert batcher._worker.is_alive()
+    assert batcher.search(texts[3], k=1)[0]["id"] == 3
+    batcher.close()
+
+
+def test_cancelled_requests_are_skipped(store):
+    batcher = SearchBatcher(store, max_wait_ms=1)
+    gate = threading.Event()
+    search_batch = store.search_batch
+    store.search_batch = lambda *args: gate.wait() and search_batch(*args)
+    blocked = threading.Thread(target=batcher.search, args=(corpus(50)[0],))
+    blocked.start()
+
+    # 工作线程阻塞在第一批时排入一个查询再取消，之后不应检索它，也不应因 set_result 失败而退出
+    cancelled: Future = Future()
+    batcher._queue.put(("已取消的查询", 3, None, cancelled))
+    assert cancelled.cancel()
+    gate.set()
+    blocked.join(timeout=5)
+    assert batcher.search(corpus(50)[4], k=1)[0]["id"] == 4
+    assert batcher._worker.is_alive()
+    batcher.close()
@@ -0,0 +1,52 @@
+import time
+
+from agents.session_store import SessionStore
+
+
+def ask(store, session_id, message):
+    with store.checkout(session_id) as chat:
+        chat.add_message("user", message)
+
+
+def test_lru_eviction_spills_and_restores(tmp_path):
+    store = SessionStore(agent=None, max_sessions=2, idle_seconds=3600, db_path=str(tmp_path / "sessions.db"))
+    ask(store, "a", "第一个问题")
+    ask(store, "b", "第二个问题")
+    ask(store, "a", "追问")
+    ask(store, "c", "第三个问题")
+    # b 最久未访问，被淘汰并写入 SQLite
+    assert len(store) == 2 and store.evicted == 1
+    assert store.history("b")["history"] == [{"role": "user", "content": "第二个问题"}]
+    # 查看历史只读 SQLite，不把会话恢复到内存
+    assert len(store) == 2 and store.restored == 0
+
+    ask(store, "b", "回来了")
+    assert store.restored == 1
+    assert [m["content"] for m in store.history("b")["history"]] == ["第二个问题", "回来了"]
+
+
+def test_idle_sessions_swept_unless_in_use():
+    store = SessionStore(agent=None, max_sessions=10, idle_seconds=0.01)
+    ask(store, "idle", "问题")
+    with store.checkout("busy"):
+        time.sleep(0.02)
+        store.sweep()
+        assert len(store) == 1
+    time.sleep(0.02)
+    store.sweep()
+    assert len(store) == 0
+    # 未配置 SQLite 时淘汰的会话直接丢弃
+    assert store.history("idle") is None
+
+
+def test_reset_and_close(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(agent=None, db_path=db_path)
+    ask(store, "a", "问题")
+    ask(store, "b", "问题")
+    assert store.reset("a") and not store.reset("a")
+    store.close()
+
+    reopened = SessionStore(agent=None, db_path=db_path)
+    assert reopened.history("a") is None
+    assert reopened.history("b")["history"] == [{"role": "user", "content": "问题"}]
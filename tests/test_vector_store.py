@@ -0,0 +1,270 @@
+import json
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from tests.conftest import corpus
+from utils.chunk_store import DUPLICATE_OF_KEY
+from utils.embedding_cache import EmbeddingCache
+from utils.index_factory import build_index, index_type_of
+from utils.vector_store import DOCSTORE_FILE, FORMAT_VERSION, INDEX_FILE, VectorStore
+
+LOAD_KWARGS = {"hybrid": False, "dedup": False, "query_cache_size": 0}
+
+
+def top_ids(store, queries, k=5):
+    return [[hit["id"] for hit in hits] for hits in store.search_batch(queries, k)]
+
+
+def recall(found, expected):
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)])
+
+
+@pytest.mark.parametrize("index_type,min_recall", [
+    ("hnsw", 0.95), ("ivf", 0.6), ("fp16", 1.0), ("sq8", 0.95), ("ivfpq", 0.6),
+])
+def test_upgraded_index_matches_flat(make_store, index_type, min_recall):
+    texts = corpus(800)
+    flat = make_store(index_type="flat")
+    upgraded = make_store(index_type=index_type, rebuild_threshold=400)
+    for store in (flat, upgraded):
+        store.add_texts(texts[:500])
+        store.add_texts(texts[500:])
+    assert index_type_of(flat.index) == "flat"
+    assert index_type_of(upgraded.index) == index_type
+
+    # 以库内文本为查询时，自身必须排在第一位
+    queries = texts[::40]
+    found = top_ids(upgraded, queries)
+    assert [ids[0] for ids in found] == list(range(0, 800, 40))
+    assert recall(found, top_ids(flat, queries)) >= min_recall
+
+
+def test_inner_product_scores_are_cosine(make_store):
+    store = make_store(metric="ip")
+    texts = corpus(50)
+    store.add_texts(texts)
+    hits = store.search(texts[3], k=3)
+    assert hits[0]["id"] == 3 and hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert all(-1.0 - 1e-5 <= h["score"] <= 1.0 + 1e-5 for h in hits)
+    assert hits[0]["score"] >= hits[1]["score"] >= hits[2]["score"]
+
+
+def test_search_batch_matches_single_searches(make_store):
+    store = make_store()
+    texts = corpus(100)
+    store.add_texts(texts)
+    queries = [texts[1], texts[50], "不在库中的问题"]
+    assert store.search_batch(queries, k=4) == [store.search(q, k=4) for q in queries]
+    assert store.search_batch([], k=4) == []
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf"])
+def test_ids_stable_across_delete_and_rebuild(make_store, index_type):
+    texts = corpus(300)
+    store = make_store(index_type="flat")
+    assert store.add_texts(texts) == list(range(300))
+    deleted = list(range(0, 300, 3))
+    assert store.delete(deleted + deleted[:5]) == len(deleted)
+    assert store.delete(deleted) == 0
+
+    store.rebuild(index_type)
+    assert index_type_of(store.index) == index_type
+    assert len(store) == store.num_indexed == 200
+    for chunk_id in (1, 2, 151, 299):
+        assert store.search(texts[chunk_id], k=1)[0]["id"] == chunk_id
+        assert store.chunks.text(chunk_id) == texts[chunk_id]
+    assert not set(deleted) & {h["id"] for q in texts[::7] for h in store.search(q, k=5)}
+    # id 不复用，新文本块接着已分配的最大 id 编号
+    assert store.add_texts(["新增的文本块"]) == [300]
+
+
+def test_hnsw_delete_uses_tombstones_until_compaction(make_store):
+    texts = corpus(200)
+    store = make_store(index_type="hnsw", rebuild_threshold=100)
+    store.add_texts(texts)
+    index = store.index
+    store.delete([5, 6])
+    assert store.index is index and store._tombstones.tolist() == [5, 6]
+    assert store.num_indexed == 198
+    assert {5, 6}.isdisjoint(h["id"] for h in store.search(texts[5], k=10))
+
+    store.delete(range(10, 40))
+    assert store.index is not index and len(store._tombstones) == 0
+    assert store.index.ntotal == store.num_indexed == 168
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(make_store, stub_model, tmp_path, mmap):
+    texts = corpus(120)
+    store = make_store(index_type="hnsw", rebuild_threshold=50)
+    store.add_texts(texts, [{"source": f"doc{i % 3}.txt", "chunk_index": i} for i in range(120)])
+    store.delete([7, 8])
+    store.save(str(tmp_path))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    loaded = VectorStore.load(str(tmp_path), mmap=mmap, **LOAD_KWARGS)
+    loaded._model = stub_model
+    assert len(loaded) == 118 and loaded.store_id == store.store_id
+    assert index_type_of(loaded.index) == "hnsw"
+    assert top_ids(loaded, texts[::10]) == top_ids(store, texts[::10])
+    assert loaded.search(texts[9], k=1, where={"source": "doc0.txt"})[0]["metadata"] == {
+        "source": "doc0.txt", "chunk_index": 9}
+
+    # mmap 加载的索引在首次写入时载入内存
+    assert loaded.add_texts(["加载后新增"]) == [120]
+    loaded.delete([9])
+    loaded.save(str(tmp_path))
+    again = VectorStore.load(str(tmp_path), **LOAD_KWARGS)
+    assert len(again) == 118 and 9 not in again.chunks and again.chunks.text(120) == "加载后新增"
+
+
+def test_load_format_v2_and_upgrade_to_v3(stub_model, tmp_path):
+    texts = corpus(20)
+    ids = list(range(0, 40, 2))
+    metadata = [{"source": "old.txt", "chunk_index": i} for i in range(20)]
+    index = build_index("flat", stub_model.dim)
+    index.add_with_ids(stub_model.encode(texts), np.array(ids, dtype=np.int64))
+    faiss.write_index(index, str(tmp_path / INDEX_FILE))
+    with open(tmp_path / DOCSTORE_FILE, "w", encoding="utf-8") as f:
+        json.dump({"format_version": 2, "embedding_model_name": "all-MiniLM-L6-v2", "next_id": 40,
+                   "ids": ids, "texts": texts, "metadata": metadata}, f, ensure_ascii=False)
+
+    store = VectorStore.load(str(tmp_path), **LOAD_KWARGS)
+    store._model = stub_model
+    assert len(store) == 20
+    hit = store.search(texts[4], k=1)[0]
+    assert hit["id"] == 8 and hit["metadata"] == metadata[4]
+    assert store.add_texts(["新文本"]) == [40]
+
+    store.save(str(tmp_path))
+    with open(tmp_path / DOCSTORE_FILE, encoding="utf-8") as f:
+        assert json.load(f)["format_version"] == FORMAT_VERSION
+    upgraded = VectorStore.load(str(tmp_path), **LOAD_KWARGS)
+    assert len(upgraded) == 21 and upgraded.chunks.text(8) == texts[4]
+
+
+def test_load_rejects_unknown_format(make_store, tmp_path):
+    store = make_store()
+    store.add_texts(corpus(3))
+    store.save(str(tmp_path))
+    with open(tmp_path / DOCSTORE_FILE, "w", encoding="utf-8") as f:
+        json.dump({"format_version": 99}, f)
+    with pytest.raises(ValueError):
+        VectorStore.load(str(tmp_path))
+
+
+def test_query_cache_invalidated_by_add_and_delete(make_store, stub_model):
+    store = make_store(query_cache_size=100)
+    texts = corpus(30)
+    store.add_texts(texts[:20])
+    first = store.search(texts[25], k=3)
+    assert store.cached_search(texts[25], k=3) == first
+    encoded = stub_model.encoded
+    assert store.search(texts[25], k=3) == first
+    assert stub_model.encoded == encoded
+
+    store.add_texts(texts[20:])
+    assert store.cached_search(texts[25], k=3) is None
+    assert store.search(texts[25], k=3)[0]["id"] == 25
+    # 查询向量与索引内容无关，写入后仍然命中
+    assert stub_model.encoded == encoded + 10
+
+    store.delete([25])
+    assert store.cached_search(texts[25], k=3) is None
+    assert 25 not in [h["id"] for h in store.search(texts[25], k=3)]
+
+
+def test_embedding_cache_skips_model_for_known_texts(make_store, stub_model, tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    texts = corpus(40)
+    first = make_store(embedding_cache=cache)
+    first.add_texts(texts)
+    encoded = stub_model.encoded
+
+    second = make_store(embedding_cache=cache)
+    second.add_texts(texts[:30] + ["一段新文本"])
+    assert stub_model.encoded == encoded + 1
+    assert cache.hits >= 30
+    assert top_ids(second, texts[:5], k=1) == [[i] for i in range(5)]
+    cache.close()
+
+
+def test_near_duplicates_are_stored_but_not_indexed(make_store):
+    store = make_store(dedup=True)
+    base = "三子棋是一种在三乘三棋盘上进行的双人游戏，先将三枚棋子连成一线的一方获胜。" * 3
+    ids = store.add_texts([base, base + "！", "完全不同的内容：五子棋在十五乘十五的棋盘上进行。" * 3],
+                          [{"source": "a.txt"}, {"source": "b.txt"}, {"source": "c.txt"}])
+    assert store.chunks.metadata(ids[1])[DUPLICATE_OF_KEY] == ids[0]
+    assert store.num_indexed == 2 and len(store) == 3
+
+    # 过滤到重复文本块所在的文件时，命中替换回该文本块
+    hit = store.search(base, k=1, where={"source": "b.txt"})[0]
+    assert hit["id"] == ids[1] and hit["metadata"]["source"] == "b.txt"
+
+    # 原文本块删除后，重复文本块写入索引取而代之
+    store.delete([ids[0]])
+    assert DUPLICATE_OF_KEY not in store.chunks.metadata(ids[1])
+    assert store.num_indexed == 2
+    assert store.search(base + "！", k=1)[0]["id"] == ids[1]
+
+
+def test_hybrid_search_finds_exact_keywords(make_store):
+    store = make_store(hybrid=True)
+    texts = corpus(100) + ["量子纠缠在通信中的应用"]
+    store.add_texts(texts)
+    # StubModel 的向量与语义无关，关键词命中只能来自 BM25
+    hits = {h["id"]: h for h in store.search("量子纠缠", k=3)}
+    assert 100 in hits and hits[100]["bm25_score"] > 0
+    store.delete([100])
+    assert 100 not in [h["id"] for h in store.search("量子纠缠", k=3)]
+
+
+@pytest.mark.parametrize("index_type", ["sq8", "ivfpq"])
+def test_rescore_reads_stored_vectors_instead_of_reencoding(make_store, stub_model, tmp_path, index_type):
+    texts = corpus(600)
+    store = make_store(index_type=index_type, rebuild_threshold=200)
+    store.add_texts(texts)
+    assert index_type_of(store.index) == index_type
+    assert len(store.raw_vectors) == 600
+
+    encoded = stub_model.encoded
+    assert store.search(texts[5], k=3)[0]["id"] == 5
+    assert stub_model.encoded == encoded + 1
+
+    store.delete(range(100))
+    store.save(str(tmp_path))
+    loaded = VectorStore.load(str(tmp_path), index_type=index_type, **LOAD_KWARGS)
+    loaded._model = stub_model
+    encoded = stub_model.encoded
+    assert loaded.search(texts[150], k=3)[0]["id"] == 150
+    assert loaded.search(texts[150], k=3, where={"chunk_index": -1})[0]["id"] == 150
+    loaded.rebuild()
+    # 只编码了两次查询
+    assert stub_model.encoded == encoded + 2
+    np.testing.assert_array_equal(loaded.raw_vectors.vectors([150]), stub_model.encode([texts[150]]))
+
+
+def test_raw_vectors_follow_the_loaded_index_type(make_store, stub_model, tmp_path):
+    texts = corpus(300)
+    # 文本块数未达阈值时仍是 flat 索引，向量可从索引取回，不另存原始向量
+    store = make_store(index_type="sq8", rebuild_threshold=1000)
+    store.add_texts(texts)
+    assert index_type_of(store.index) == "flat" and store.raw_vectors is None
+    store.save(str(tmp_path / "flat"))
+    assert VectorStore.load(str(tmp_path / "flat"), index_type="sq8", **LOAD_KWARGS).raw_vectors is None
+
+    store.rebuild("sq8")
+    assert len(store.raw_vectors) == 300
+    store.save(str(tmp_path / "sq8"))
+    # 配置的目标类型与已保存的有损索引不同时，仍按索引加载原始向量
+    loaded = VectorStore.load(str(tmp_path / "sq8"), index_type="hnsw", **LOAD_KWARGS)
+    loaded._model = stub_model
+    assert len(loaded.raw_vectors) == 300
+    encoded = stub_model.encoded
+    assert loaded.search(texts[42], k=3)[0]["id"] == 42
+    assert stub_model.encoded == encoded + 1
+    loaded.rebuild("flat")
+    assert loaded.raw_vectors is None
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from config.cfg import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL
+from config.logging_config import PER_QUERY
+
+logger = logging.getLogger(__name__)
+
+
+def context_fingerprint(store_id: str, chunk_ids: Iterable[int], chat_history: Optional[List[Dict]] = None,
+                        history_summary: Optional[str] = None) -> str:
+    """
+    回答上下文的指纹：检索到的文本块集合（与顺序无关，并带上向量库标识以免重建后的 id 冲突），
+    加上传入提示词的对话历史与历史摘要，使依赖上文的追问只在相同对话上下文中命中
+    """
+    key = store_id + ":" + ",".join(str(i) for i in sorted(chunk_ids))
+    if chat_history or history_summary:
+        key += ":" + json.dumps([chat_history or [], history_summary or ""], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    fingerprint: str
+    embedding: np.ndarray
+    answer: str
+    chunk_ids: List[int]
+    created: float
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存：上下文指纹（检索结果与对话历史，见 context_fingerprint）相同、且问题向量余弦相似度
+    不低于阈值时直接返回缓存的回答。条目按 TTL 过期、按 LRU 淘汰，可选 SQLite 持久化；
+    相关文本块被删除时条目失效
+    """
+
+    def __init__(self, db_path: Optional[str] = None, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl_seconds: float = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._by_fingerprint: Dict[str, List[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY,"
+                " fingerprint TEXT NOT NULL,"
+                " embedding BLOB NOT NULL,"
+                " answer TEXT NOT NULL,"
+                " chunk_ids TEXT NOT NULL,"
+                " created REAL NOT NULL"
+                ")"
+            )
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        expire_before = time.time() - self.ttl_seconds
+        self._conn.execute("DELETE FROM answers WHERE created < ?", (expire_before,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT key, fingerprint, embedding, answer, chunk_ids, created FROM answers"
+            " ORDER BY created DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for key, fingerprint, embedding, answer, chunk_ids, created in reversed(rows):
+            self._insert(CacheEntry(key, fingerprint, np.frombuffer(embedding, dtype=np.float32),
+                                    answer, json.loads(chunk_ids), created))
+        logger.info(f"已加载 {len(rows)} 条缓存答案")
+
+    def _insert(self, entry: CacheEntry):
+        self._entries[entry.key] = entry
+        self._by_fingerprint.setdefault(entry.fingerprint, []).append(entry.key)
+
+    def _remove(self, keys: List[str]):
+        for key in keys:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                continue
+            siblings = self._by_fingerprint.get(entry.fingerprint, [])
+            if key in siblings:
+                siblings.remove(key)
+            if not siblings:
+                self._by_fingerprint.pop(entry.fingerprint, None)
+        if self._conn is not None and keys:
+            self._conn.executemany("DELETE FROM answers WHERE key = ?", [(k,) for k in keys])
+            self._conn.commit()
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def get(self, query_embedding: np.ndarray, fingerprint: str) -> Optional[str]:
+        query = self._normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            keys = self._by_fingerprint.get(fingerprint, [])
+            expired = [k for k in keys if now - self._entries[k].created > self.ttl_seconds]
+            if expired:
+                self._remove(expired)
+                keys = self._by_fingerprint.get(fingerprint, [])
+            if keys:
+                similarities = np.stack([self._entries[k].embedding for k in keys]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry = self._entries[keys[best]]
+                    self._entries.move_to_end(entry.key)
+                    self.hits += 1
+                    logger.info("命中答案缓存（相似度 %.3f）", similarities[best], extra=PER_QUERY)
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding: np.ndarray, fingerprint: str, answer: str, chunk_ids: List[int]):
+        entry = CacheEntry(uuid.uuid4().hex, fingerprint, self._normalize(query_embedding),
+                           answer, list(chunk_ids), time.time())
+        with self._lock:
+            self._insert(entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT INTO answers (key, fingerprint, embedding, answer, chunk_ids, created)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry.key, fingerprint, entry.embedding.tobytes(), answer, json.dumps(entry.chunk_ids),
+                     entry.created),
+                )
+                self._conn.commit()
+            if len(self._entries) > self.max_entries:
+                self._remove(list(self._entries)[:len(self._entries) - self.max_entries])
+
+    def invalidate_chunks(self, chunk_ids: Iterable[int]):
+        """文本块被删除或替换后，移除引用了这些文本块的缓存条目"""
+        removed = set(chunk_ids)
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if removed.intersection(e.chunk_ids)]
+            self._remove(stale)
+        if stale:
+            logger.info(f"文本块变更，失效 {len(stale)} 条缓存答案")
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,252 @@
+"""
+端到端性能基准：生成合成语料，依次测量解析切分与入库吞吐、检索延迟分位数与 QPS，
+以及本地 OpenAI 兼容桩服务（utils.openai_stub）下 ChatService.ask 的端到端延迟。
+结果输出为 JSON；提供基线文件时逐项比较，退化超过允许比例则以非零状态码退出，可用于 CI。
+
+    python -m utils.benchmark --docs 200 --queries 500 --llm-delay 0.2 --output bench.json
+    python -m utils.benchmark --docs 200 --queries 500 --llm-delay 0.2 --baseline bench.json --tolerance 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+from config.cfg import INDEX_TYPE, INGEST_BATCH_SIZE
+from utils.metrics import stage_summary
+
+logger = logging.getLogger(__name__)
+
+# 合成语料的词表：中英文混合，保证切分、BM25 分词与向量化都走到真实路径
+_WORDS = (
+    "检索 向量 索引 文档 模型 问答 上下文 对话 缓存 分片 延迟 吞吐 召回 排序 切分 解析 "
+    "数据 服务 配置 日志 并发 批量 内存 磁盘 网络 请求 响应 用户 系统 性能 "
+    "index vector query chunk embedding latency cache shard token stream batch model"
+).split()
+_QUESTION_TEMPLATES = ("{}和{}有什么关系？", "如何优化{}的{}？", "{}为什么会影响{}？", "介绍一下{}中的{}")
+
+# 比较基线时的指标方向：以这些后缀结尾的指标越大越好，其余以 _ms / _seconds 结尾的越小越好
+HIGHER_IS_BETTER = ("_per_second", "qps")
+LOWER_IS_BETTER = ("_ms", "_seconds")
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    """latencies 单位为秒，返回毫秒的 p50/p95/p99 与均值"""
+    ms = np.asarray(latencies, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (0.0, 0.0, 0.0)
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+            "mean_ms": round(float(ms.mean()) if len(ms) else 0.0, 3)}
+
+
+def make_corpus(out_dir: str, num_docs: int, paragraphs: int = 20, seed: int = 0) -> List[str]:
+    """在 out_dir 下生成 num_docs 个 .txt / .md 文件，每个文件 paragraphs 段，返回文件路径"""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for doc in range(num_docs):
+        lines = []
+        for _ in range(paragraphs):
+            sentences = ["".join(rng.choices(_WORDS, k=rng.randint(6, 14))) + "。" for _ in range(rng.randint(3, 6))]
+            lines.append("".join(sentences))
+        path = os.path.join(out_dir, f"doc_{doc:05d}{'.md' if doc % 2 else '.txt'}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(lines))
+        paths.append(path)
+    return paths
+
+
+def make_questions(num: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [rng.choice(_QUESTION_TEMPLATES).format(*rng.sample(_WORDS, 2)) for _ in range(num)]
+
+
+def bench_ingest(store, file_paths: List[str], batch_size: int = INGEST_BATCH_SIZE) -> Dict[str, float]:
+    """分别测量 create_documents_with_metadata（解析 + 切分）与 VectorStore.add_texts（向量化 + 建索引）"""
+    from utils.document_parser import create_documents_with_metadata
+
+    total_bytes = sum(os.path.getsize(p) for p in file_paths)
+    start = time.perf_counter()
+    documents = [doc for path in file_paths for doc in create_documents_with_metadata(path)]
+    parse_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(documents), batch_size):
+        batch = documents[i:i + batch_size]
+        store.add_texts([d.page_content for d in batch], [d.metadata for d in batch])
+    add_seconds = time.perf_counter() - start
+    return {
+        "files": len(file_paths),
+        "bytes": total_bytes,
+        "chunks": len(documents),
+        "parse_seconds": round(parse_seconds, 3),
+        "parse_mb_per_second": round(total_bytes / 2 ** 20 / max(parse_seconds, 1e-9), 3),
+        "add_seconds": round(add_seconds, 3),
+        "add_chunks_per_second": round(len(documents) / max(add_seconds, 1e-9), 1),
+    }
+
+
+def bench_search(store, queries: List[str], k: int = 3, concurrency: int = 1) -> Dict[str, float]:
+    """
+    逐条测量 search 延迟分位数；concurrency > 1 时由多个线程并发检索，QPS 为整体吞吐。
+    启用查询缓存时先清空缓存测量未命中的检索，再以同一组查询测量命中缓存的延迟（hot_*）
+    """
+    for query in queries[:5]:
+        store.search(query, k)  # 预热，不计入统计
+    if store.query_cache is not None:
+        store.query_cache.clear()
+
+    def timed(query: str) -> float:
+        start = time.perf_counter()
+        store.search(query, k)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed, queries))
+    else:
+        latencies = [timed(query) for query in queries]
+    elapsed = time.perf_counter() - start
+    results = {"queries": len(queries), "k": k, "concurrency": concurrency, **percentiles(latencies),
+               "qps": round(len(queries) / max(elapsed, 1e-9), 1)}
+    if store.query_cache is not None:
+        hot = percentiles([timed(query) for query in queries])
+        results.update({f"hot_{name}": value for name, value in hot.items()})
+        results["query_cache"] = store.query_cache.stats()
+    return results
+
+
+def bench_chat(store, questions: List[str], llm_delay: float = 0.0, token_delay: float = 0.0) -> Dict[str, float]:
+    """
+    启动本地桩服务并将 LLM 客户端指向它，逐条测量 ChatService.ask 的端到端延迟。
+    每个问题使用新的 ChatService，避免历史增长与摘要调用干扰测量；不启用答案缓存
+    """
+    from agents.chat_service import ChatService
+    from agents.rag_agent import RAGAgent
+    from utils.llm_response import configure_client
+    from utils.openai_stub import start_stub_server
+
+    server, base_url = start_stub_server(delay=llm_delay, token_delay=token_delay)
+    os.environ.setdefault("qianwen_api_key", "benchmark")
+    configure_client(base_url)
+    try:
+        agent = RAGAgent(store)
+        ChatService(agent).ask(questions[0])  # 预热：建立连接、首次编译执行图
+        latencies = []
+        errors = 0
+        for question in questions:
+            start = time.perf_counter()
+            result = ChatService(agent).ask(question)
+            latencies.append(time.perf_counter() - start)
+            errors += not result["response"].startswith("桩服务回答")
+    finally:
+        server.shutdown()
+    stats = percentiles(latencies)
+    return {"questions": len(questions), "llm_delay_ms": round(llm_delay * 1000, 3), **stats,
+            # 扣除桩服务固定延迟后的中位数，即检索、拼装提示与客户端开销
+            "overhead_p50_ms": round(stats["p50_ms"] - llm_delay * 1000, 3), "errors": errors}
+
+
+def _flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> List[str]:
+    """
+    与基线逐项比较：吞吐类指标低于基线 (1 - tolerance) 倍、延迟类指标高于基线 (1 + tolerance) 倍时
+    视为退化，返回退化描述列表。只比较两边都有的指标，其余（如文件数、配置项）不参与比较
+    """
+    current, previous = _flatten(results.get("results", results)), _flatten(baseline.get("results", baseline))
+    regressions = []
+    for name, value in current.items():
+        base = previous.get(name)
+        # 各阶段耗时只用于定位，亚毫秒级的阶段抖动较大，不参与判定
+        if not base or name.startswith("stages."):
+            continue
+        # bytes、files、chunks 等计数两个后缀都不匹配，有意不参与判定
+        if name.endswith(HIGHER_IS_BETTER) and value < base * (1 - tolerance):
+            regressions.append(f"{name}: {value} < 基线 {base}（允许下降 {tolerance:.0%}）")
+        elif name.endswith(LOWER_IS_BETTER) and not name.endswith("delay_ms") and value > base * (1 + tolerance):
+            regressions.append(f"{name}: {value} > 基线 {base}（允许上升 {tolerance:.0%}）")
+    return regressions
+
+
+def run(docs: int = 100, paragraphs: int = 20, queries: int = 200, k: int = 3, concurrency: int = 1,
+        chat_questions: int = 20, llm_delay: float = 0.0, index_type: str = INDEX_TYPE,
+        seed: int = 0) -> dict:
+    """执行全部基准，返回可写入 JSON 的结果；chat_questions=0 时跳过问答基准"""
+    from utils.vector_store import VectorStore
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as work_dir:
+        file_paths = make_corpus(os.path.join(work_dir, "docs"), docs, paragraphs, seed)
+        store = VectorStore(index_type=index_type)
+        start = time.perf_counter()
+        store.warmup(background=False)
+        results["model_load_seconds"] = round(time.perf_counter() - start, 3)
+        logger.info("测量入库吞吐")
+        results["ingest"] = bench_ingest(store, file_paths)
+        logger.info("测量检索延迟")
+        results["search"] = bench_search(store, make_questions(queries, seed + 1), k, concurrency)
+        if chat_questions:
+            logger.info("测量端到端问答延迟")
+            results["chat"] = bench_chat(store, make_questions(chat_questions, seed + 2), llm_delay)
+    # 全部基准累计的各阶段耗时，便于定位退化发生在哪个阶段
+    results["stages"] = stage_summary()
+    return {
+        "config": {"docs": docs, "paragraphs": paragraphs, "queries": queries, "k": k, "concurrency": concurrency,
+                   "chat_questions": chat_questions, "llm_delay": llm_delay, "index_type": index_type,
+                   "embedding_model_name": store.embedding_model_name, "seed": seed},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG 端到端性能基准")
+    parser.add_argument("--docs", type=int, default=100, help="合成文档数")
+    parser.add_argument("--paragraphs", type=int, default=20, help="每个文档的段落数")
+    parser.add_argument("--queries", type=int, default=200, help="检索基准的查询数")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="并发检索的线程数")
+    parser.add_argument("--chat-questions", type=int, default=20, help="问答基准的问题数，0 表示跳过")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="桩服务每次响应的固定延迟（秒）")
+    parser.add_argument("--index-type", default=INDEX_TYPE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="基线结果 JSON，退化超过 --tolerance 时以状态码 1 退出")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    report = run(args.docs, args.paragraphs, args.queries, args.k, args.concurrency, args.chat_questions,
+                 args.llm_delay, args.index_type, args.seed)
+    print(json.dumps(report, ensure_ascii=False, indent=1))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            logger.error(f"性能退化 {line}")
+        if regressions:
+            sys.exit(1)
+        logger.info("未发现超出允许范围的性能退化")
+
+
+if __name__ == "__main__":
+    main()
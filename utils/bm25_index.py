@@ -0,0 +1,168 @@
+import json
+import logging
+import math
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config.cfg import BM25_B, BM25_K1
+
+logger = logging.getLogger(__name__)
+
+try:
+    import jieba
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:  # jieba 为可选依赖，缺失时中文按字符二元组切分
+    jieba = None
+
+BM25_FILE = "bm25.npz"
+BM25_TERMS_FILE = "bm25_terms.json"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+_DTYPES = {"q": np.int64, "i": np.int32}
+
+
+def _view(a: array) -> np.ndarray:
+    return np.frombuffer(a, dtype=_DTYPES[a.typecode])
+
+
+def tokenize(text: str) -> List[str]:
+    """英文与数字按词切分；中文用 jieba 搜索模式分词，未安装 jieba 时切成字符二元组"""
+    tokens = []
+    for piece in _TOKEN_RE.findall(text.lower()):
+        if not _CJK_RE.match(piece):
+            tokens.append(piece)
+        elif jieba is not None:
+            tokens.extend(t for t in jieba.lcut_for_search(piece) if t.strip())
+        elif len(piece) == 1:
+            tokens.append(piece)
+        else:
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    BM25 倒排索引：每个词的倒排表以 array 紧凑存放 (文本块 id, 词频, 文本块长度)，
+    检索时用 numpy 对命中的倒排表做向量化打分
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array, array]] = {}
+        self._doc_lens: Dict[int, int] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lens)
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]):
+        for chunk_id, text in zip(ids, texts):
+            terms = Counter(tokenize(text))
+            length = sum(terms.values())
+            self._doc_lens[chunk_id] = length
+            self._total_len += length
+            for term, tf in terms.items():
+                posting = self._postings.get(term)
+                if posting is None:
+                    posting = self._postings[term] = (array("q"), array("i"), array("i"))
+                posting[0].append(chunk_id)
+                posting[1].append(tf)
+                posting[2].append(length)
+
+    def remove(self, ids: Iterable[int], texts: Iterable[str]):
+        """移除文本块；需要原文以定位其出现过的倒排表"""
+        affected: Dict[str, List[int]] = {}
+        for chunk_id, text in zip(ids, texts):
+            if chunk_id not in self._doc_lens:
+                continue
+            self._total_len -= self._doc_lens.pop(chunk_id)
+            for term in set(tokenize(text)):
+                affected.setdefault(term, []).append(chunk_id)
+        for term, removed in affected.items():
+            ids_arr, tfs, lens = self._postings[term]
+            keep = ~np.isin(_view(ids_arr), removed)
+            if not keep.any():
+                del self._postings[term]
+                continue
+            self._postings[term] = tuple(array(a.typecode, _view(a)[keep].tobytes()) for a in (ids_arr, tfs, lens))
+
+    def search(self, query: str, k: int = 10, allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """allowed_ids 不为空时只在这些文本块中排序（需为升序数组）"""
+        if not self._doc_lens:
+            return []
+        n_docs = len(self._doc_lens)
+        avgdl = self._total_len / n_docs
+        all_ids, all_scores = [], []
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            ids = _view(posting[0])
+            tfs = _view(posting[1]).astype(np.float32)
+            lens = _view(posting[2]).astype(np.float32)
+            idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + self.k1 * (1 - self.b + self.b * lens / avgdl)))
+        if not all_ids:
+            return []
+        doc_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if allowed_ids is not None:
+            pos = np.minimum(np.searchsorted(allowed_ids, doc_ids), max(len(allowed_ids) - 1, 0))
+            keep = allowed_ids[pos] == doc_ids if len(allowed_ids) else np.zeros(len(doc_ids), dtype=bool)
+            doc_ids, scores = doc_ids[keep], scores[keep]
+        top = np.argsort(-scores)[:k]
+        return list(zip(doc_ids[top].tolist(), scores[top].tolist()))
+
+    def save(self, persist_dir: str):
+        """以 CSR 形式保存：词表写入 JSON，倒排表拼接成连续数组写入 npz"""
+        terms = list(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self._postings[t][0]) for t in terms])
+
+        def concat(i, dtype):
+            if not terms:
+                return np.zeros(0, dtype=dtype)
+            return np.concatenate([_view(self._postings[t][i]) for t in terms])
+
+        doc_ids = np.fromiter(self._doc_lens.keys(), dtype=np.int64, count=len(self._doc_lens))
+        doc_lens = np.fromiter(self._doc_lens.values(), dtype=np.int32, count=len(self._doc_lens))
+        # 先写临时文件再替换，保存中途失败不会写坏已有索引
+        postings_path = os.path.join(persist_dir, BM25_FILE)
+        terms_path = os.path.join(persist_dir, BM25_TERMS_FILE)
+        with open(postings_path + ".tmp", "wb") as f:
+            np.savez(f, offsets=offsets, ids=concat(0, np.int64), tfs=concat(1, np.int32),
+                     lens=concat(2, np.int32), doc_ids=doc_ids, doc_lens=doc_lens,
+                     params=np.array([self.k1, self.b]))
+        with open(terms_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        os.replace(postings_path + ".tmp", postings_path)
+        os.replace(terms_path + ".tmp", terms_path)
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return (os.path.exists(os.path.join(persist_dir, BM25_FILE))
+                and os.path.exists(os.path.join(persist_dir, BM25_TERMS_FILE)))
+
+    @classmethod
+    def load(cls, persist_dir: str) -> "BM25Index":
+        data = np.load(os.path.join(persist_dir, BM25_FILE))
+        with open(os.path.join(persist_dir, BM25_TERMS_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        k1, b = data["params"].tolist()
+        index = cls(k1=k1, b=b)
+        offsets, ids, tfs, lens = data["offsets"], data["ids"], data["tfs"], data["lens"]
+        for i, term in enumerate(terms):
+            start, end = offsets[i], offsets[i + 1]
+            index._postings[term] = (array("q", ids[start:end].tobytes()), array("i", tfs[start:end].tobytes()),
+                                     array("i", lens[start:end].tobytes()))
+        index._doc_lens = dict(zip(data["doc_ids"].tolist(), data["doc_lens"].tolist()))
+        index._total_len = int(data["doc_lens"].sum())
+        return index
@@ -0,0 +1,282 @@
+import json
+import logging
+import mmap
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 持久化文件名（与索引放在同一目录）
+TEXTS_FILE = "chunk_texts.bin"
+COLUMNS_FILE = "chunks.{}.npy"
+FILES_FILE = "chunk_files.json"
+# 元数据中按文本块变化、单独成列的整数字段及其类型（缺失时存 -1）；其余字段按文件去重后存入文件表。
+# duplicate_of 为近似重复文本块所对应的、写入了向量索引的文本块 id
+CHUNK_INDEX_KEY = "chunk_index"
+PAGE_KEY = "page"
+DUPLICATE_OF_KEY = "duplicate_of"
+CHUNK_COLUMNS = {CHUNK_INDEX_KEY: np.int32, PAGE_KEY: np.int32, DUPLICATE_OF_KEY: np.int64}
+COLUMNS = ("ids", "offsets", "file_ids") + tuple(CHUNK_COLUMNS)
+# 已删除的文本块占比超过该值时压缩存储
+COMPACT_RATIO = 0.25
+
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, (list, tuple, set, frozenset, range)) else [value]
+
+
+class ChunkStore:
+    """
+    列式文本块存储：全部文本顺序拼接为一段 UTF-8 缓冲区，以 offsets 数组定位；
+    元数据拆成按文件去重的文件表与 file_id、chunk_index、page、duplicate_of 等整数列。
+    id 单调递增地追加，查找用二分；删除只打墓碑标记，积累到一定比例后再压缩。
+    持久化后的各列与文本缓冲区可以 mmap 方式加载，首次写入时再读入内存
+    """
+
+    def __init__(self):
+        self._ids = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._file_ids = np.empty(0, dtype=np.int32)
+        self._chunk_columns = {key: np.empty(0, dtype=dtype) for key, dtype in CHUNK_COLUMNS.items()}
+        self._alive = np.empty(0, dtype=bool)
+        self._buffer = bytearray()
+        # 追加时先放入分段列表，读取前再合并，避免每批写入都复制整列
+        self._pending: List[Tuple[np.ndarray, ...]] = []
+        self._files: List[dict] = []
+        self._file_keys: Dict[str, int] = {}
+        self._count = 0
+        self._mmapped = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return self._row(chunk_id) is not None
+
+    def _intern_file(self, meta: dict) -> int:
+        key = json.dumps(meta, ensure_ascii=False, sort_keys=True)
+        file_id = self._file_keys.get(key)
+        if file_id is None:
+            file_id = self._file_keys[key] = len(self._files)
+            self._files.append(meta)
+        return file_id
+
+    def _ensure_writable(self):
+        if self._mmapped:
+            self._ids, self._offsets = np.array(self._ids), np.array(self._offsets)
+            self._file_ids = np.array(self._file_ids)
+            self._chunk_columns = {key: np.array(column) for key, column in self._chunk_columns.items()}
+            self._buffer = bytearray(self._buffer)
+            self._mmapped = False
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        ids, ends, file_ids, *chunk_columns = (np.concatenate(parts) for parts in zip(*self._pending))
+        self._ids = np.concatenate([self._ids, ids])
+        self._offsets = np.concatenate([self._offsets, ends])
+        self._file_ids = np.concatenate([self._file_ids, file_ids])
+        for key, column in zip(CHUNK_COLUMNS, chunk_columns):
+            self._chunk_columns[key] = np.concatenate([self._chunk_columns[key], column])
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._pending.clear()
+
+    def add(self, ids: List[int], texts: List[str], metadata: Optional[List[dict]] = None):
+        """追加文本块；ids 须大于已有的全部 id"""
+        if not ids:
+            return
+        self._ensure_writable()
+        ends = np.empty(len(ids), dtype=np.int64)
+        file_ids = np.empty(len(ids), dtype=np.int32)
+        chunk_columns = {key: np.empty(len(ids), dtype=dtype) for key, dtype in CHUNK_COLUMNS.items()}
+        for row, (text, meta) in enumerate(zip(texts, metadata or [{} for _ in texts])):
+            self._buffer += text.encode("utf-8")
+            ends[row] = len(self._buffer)
+            meta = dict(meta)
+            for key, column in chunk_columns.items():
+                value = meta.pop(key, None)
+                column[row] = -1 if value is None else value
+            file_ids[row] = self._intern_file(meta)
+        self._pending.append((np.asarray(ids, dtype=np.int64), ends, file_ids, *chunk_columns.values()))
+        self._count += len(ids)
+
+    def _row(self, chunk_id: int) -> Optional[int]:
+        self._consolidate()
+        row = int(np.searchsorted(self._ids, chunk_id))
+        if row < len(self._ids) and self._ids[row] == chunk_id and self._alive[row]:
+            return row
+        return None
+
+    def _rows(self, ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (存在的 id, 对应的行号)"""
+        self._consolidate()
+        ids = np.asarray(list(ids), dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self._ids, ids), max(len(self._ids) - 1, 0))
+        if not len(self._ids):
+            return ids[:0], rows[:0]
+        found = (self._ids[rows] == ids) & self._alive[rows]
+        return ids[found], rows[found]
+
+    def _text_at(self, row: int) -> str:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return self._buffer[start:end].decode("utf-8")
+
+    def _metadata_at(self, row: int) -> dict:
+        meta = dict(self._files[int(self._file_ids[row])])
+        for key, column in self._chunk_columns.items():
+            value = int(column[row])
+            if value >= 0:
+                meta[key] = value
+        return meta
+
+    def text(self, chunk_id: int) -> str:
+        row = self._row(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        return self._text_at(row)
+
+    def metadata(self, chunk_id: int) -> dict:
+        row = self._row(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        return self._metadata_at(row)
+
+    def texts(self, ids: Iterable[int]) -> List[str]:
+        _, rows = self._rows(ids)
+        return [self._text_at(row) for row in rows.tolist()]
+
+    def ids(self, indexed_only: bool = False) -> np.ndarray:
+        """indexed_only=True 时不含近似重复的文本块，即只返回写入了向量索引的 id"""
+        self._consolidate()
+        mask = self._alive
+        if indexed_only:
+            mask = mask & (self._chunk_columns[DUPLICATE_OF_KEY] < 0)
+        return self._ids[mask]
+
+    def values(self, key: str, ids: Iterable[int]) -> np.ndarray:
+        """返回各 id 在文本块级字段 key 上的取值（缺失为 -1），不存在的 id 被跳过"""
+        _, rows = self._rows(ids)
+        return np.asarray(self._chunk_columns[key][rows])
+
+    def set_values(self, key: str, ids: Iterable[int], value: int):
+        """把这些 id 的文本块级字段 key 设为 value（-1 表示清除）"""
+        self._ensure_writable()
+        _, rows = self._rows(ids)
+        self._chunk_columns[key][rows] = value
+
+    def select(self, where: dict) -> np.ndarray:
+        """
+        按元数据过滤，返回匹配的 id（升序）。where 的每个键是元数据字段，值为单个取值或取值列表，
+        多个键之间为“且”；chunk_index 等文本块级字段还可以是 range，如 {"file_name": "a.pdf", "page": range(1, 11)}。
+        文件级字段先在文件表上匹配，再按 file_id 列筛选，不逐个文本块构造字典
+        """
+        self._consolidate()
+        mask = self._alive.copy()
+        for key, value in where.items():
+            if key in self._chunk_columns:
+                column = self._chunk_columns[key]
+                if isinstance(value, range) and value.step == 1:
+                    mask &= (column >= value.start) & (column < value.stop)
+                else:
+                    mask &= np.isin(column, _as_list(value))
+            else:
+                values = _as_list(value)
+                matched = [i for i, meta in enumerate(self._files) if key in meta and meta[key] in values]
+                mask &= np.isin(self._file_ids, matched)
+        return self._ids[mask]
+
+    def items(self, indexed_only: bool = False) -> Iterator[Tuple[int, str]]:
+        """按 id 顺序产出 (id, 文本)；indexed_only 同 ids()"""
+        self._consolidate()
+        mask = self._alive
+        if indexed_only:
+            mask = mask & (self._chunk_columns[DUPLICATE_OF_KEY] < 0)
+        for row in np.flatnonzero(mask).tolist():
+            yield int(self._ids[row]), self._text_at(row)
+
+    def remove(self, ids: Iterable[int]) -> List[int]:
+        """标记删除，返回实际存在并被删除的 id（升序，重复的 id 只计一次）"""
+        found, rows = self._rows(np.unique(np.asarray(list(ids), dtype=np.int64)))
+        if not len(found):
+            return []
+        self._alive[rows] = False
+        self._count -= len(found)
+        if len(self._ids) - self._count > COMPACT_RATIO * len(self._ids):
+            self.compact()
+        return found.tolist()
+
+    def compact(self):
+        """物理移除已删除的文本块并回收文本缓冲区与文件表中不再引用的条目"""
+        self._consolidate()
+        rows = np.flatnonzero(self._alive)
+        starts, ends = self._offsets[rows], self._offsets[rows + 1]
+        lengths = ends - starts
+        buffer = np.frombuffer(self._buffer, dtype=np.uint8)
+        if len(rows):
+            # 每个保留字节在原缓冲区中的位置：各段起点按段长重复后加上段内偏移
+            positions = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+            positions += np.arange(int(lengths.sum()))
+            self._buffer = bytearray(buffer[positions].tobytes())
+        else:
+            self._buffer = bytearray()
+        self._offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+        used, file_ids = np.unique(self._file_ids[rows], return_inverse=True)
+        self._files = [self._files[i] for i in used.tolist()]
+        self._file_keys = {json.dumps(m, ensure_ascii=False, sort_keys=True): i for i, m in enumerate(self._files)}
+        self._ids = self._ids[rows]
+        self._file_ids = file_ids.astype(np.int32)
+        self._chunk_columns = {key: column[rows] for key, column in self._chunk_columns.items()}
+        self._alive = np.ones(len(rows), dtype=bool)
+        self._mmapped = False
+
+    def save(self, persist_dir: str):
+        self._consolidate()
+        if not self._alive.all():
+            self.compact()
+        columns = {"ids": self._ids, "offsets": self._offsets, "file_ids": self._file_ids, **self._chunk_columns}
+        for name, column in columns.items():
+            path = os.path.join(persist_dir, COLUMNS_FILE.format(name))
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, column)
+            os.replace(path + ".tmp", path)
+        texts_path = os.path.join(persist_dir, TEXTS_FILE)
+        with open(texts_path + ".tmp", "wb") as f:
+            f.write(self._buffer)
+        os.replace(texts_path + ".tmp", texts_path)
+        files_path = os.path.join(persist_dir, FILES_FILE)
+        with open(files_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._files, f, ensure_ascii=False)
+        os.replace(files_path + ".tmp", files_path)
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, FILES_FILE))
+
+    @classmethod
+    def load(cls, persist_dir: str, mmap_mode: bool = True) -> "ChunkStore":
+        store = cls()
+        columns = {}
+        for name in COLUMNS:
+            path = os.path.join(persist_dir, COLUMNS_FILE.format(name))
+            if name in CHUNK_COLUMNS and not os.path.exists(path):
+                # 早期保存的文件没有 page、duplicate_of 等列，按全部缺失处理，下次保存时补写
+                columns[name] = np.full(len(columns["ids"]), -1, dtype=CHUNK_COLUMNS[name])
+                continue
+            columns[name] = np.load(path, mmap_mode="r" if mmap_mode else None)
+        store._ids, store._offsets, store._file_ids = columns.pop("ids"), columns.pop("offsets"), columns.pop("file_ids")
+        store._chunk_columns = columns
+        store._alive = np.ones(len(store._ids), dtype=bool)
+        with open(os.path.join(persist_dir, TEXTS_FILE), "rb") as f:
+            if mmap_mode and os.fstat(f.fileno()).st_size:
+                store._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                store._buffer = bytearray(f.read())
+        with open(os.path.join(persist_dir, FILES_FILE), "r", encoding="utf-8") as f:
+            store._files = json.load(f)
+        store._file_keys = {json.dumps(m, ensure_ascii=False, sort_keys=True): i for i, m in enumerate(store._files)}
+        store._count = len(store._ids)
+        store._mmapped = mmap_mode
+        return store
@@ -70,29 +70,24 @@
 
 import logging
 import os
+from bisect import bisect_right
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document as LCDocument
-import openai as OpenAI
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 SUPPORTED_FORMATS = {".pdf", ".docx", ".md", ".txt"}
+# 流式解析 PDF 时每处理这么多页重新打开一次 PdfReader，释放其缓存的已解析对象
+PDF_PAGES_PER_READER = 256
 
 def parse_document(file_path: str) -> str:
     logging.info('解析文档为纯文本')
     logger.info(f"解析支持的文档格式: {'、'.join(SUPPORTED_FORMATS)}")
-    if not os.path.exists(file_path):
-        logger.error(f"文件不存在: {file_path}")
-        raise FileNotFoundError(f"File not found: {file_path}")
-
-    ext = Path(file_path).suffix.lower()
-    if ext not in SUPPORTED_FORMATS:
-        logger.error(f"不支持的文件格式: {ext}")
-        raise ValueError(f"Unsupported file format: {ext}")
+    ext = _check_format(file_path)
 
     try:
         if ext == ".pdf":
@@ -111,17 +106,55 @@ def parse_document(file_path: str) -> str:
         logger.error(f"解析文件失败: {file_path}, 错误: {e}")
         raise
 
+def _check_format(file_path: str) -> str:
+    """检查文件存在且格式受支持，返回小写扩展名"""
+    if not os.path.exists(file_path):
+        logger.error(f"文件不存在: {file_path}")
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    ext = Path(file_path).suffix.lower()
+    if ext not in SUPPORTED_FORMATS:
+        logger.error(f"不支持的文件格式: {ext}")
+        raise ValueError(f"Unsupported file format: {ext}")
+    return ext
+
 # === 以下解析函数保持不变 ===
 def _parse_pdf(file_path: str) -> str:
+    # 各页文本先收集再一次拼接，避免逐页 += 在大文件上的二次方开销
+    parts = [page_text + "\n\n" for _, page_text in iter_pdf_pages(file_path)]
+    logger.info(f"成功解析 PDF 文件: {file_path} ({pdf_page_count(file_path)} 页)")
+    return "".join(parts)
+
+def pdf_page_count(file_path: str) -> int:
     from PyPDF2 import PdfReader
-    reader = PdfReader(file_path)
-    text = ""
-    for page_num, page in enumerate(reader.pages):
-        page_text = page.extract_text()
-        if page_text:
-            text += page_text + "\n\n"
-    logger.info(f"成功解析 PDF 文件: {file_path} ({len(reader.pages)} 页)")
-    return text
+    with open(file_path, "rb") as f:
+        return len(PdfReader(f).pages)
+
+def iter_pdf_pages(file_path: str, start: int = 0, end: Optional[int] = None,
+                   pages_per_reader: int = PDF_PAGES_PER_READER) -> Iterator[Tuple[int, str]]:
+    """
+    逐页产出 PDF [start, end) 页的 (页码, 文本)，页码从 1 开始，没有文本的页跳过。
+    PdfReader 会缓存已解析的对象，每处理 pages_per_reader 页重新打开一次，内存不随页数增长
+    """
+    from PyPDF2 import PdfReader
+    total = pdf_page_count(file_path)
+    end = total if end is None else min(end, total)
+    for block_start in range(start, end, pages_per_reader):
+        # 传入文件对象而非路径，PdfReader 按需 seek 读取，不会把整个文件读入内存
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f)
+            for page_num in range(block_start, min(block_start + pages_per_reader, end)):
+                page_text = reader.pages[page_num].extract_text()
+                if page_text:
+                    yield page_num + 1, page_text
+
+def parse_pdf_pages(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    只解析 PDF 的 [start, end) 页，返回 [(页码, 文本)]，供并行入库按页分片使用
+    """
+    pages = list(iter_pdf_pages(file_path, start, end))
+    logger.debug(f"成功解析 PDF 文件: {file_path} 第 {start + 1}-{end} 页")
+    return pages
 
 def _parse_docx(file_path: str) -> str:
     from docx import Document
@@ -130,6 +163,25 @@ def _parse_docx(file_path: str) -> str:
     logger.info(f"成功解析 Word 文件: {file_path}")
     return text
 
+def iter_docx_paragraphs(file_path: str) -> Iterator[Tuple[int, str]]:
+    """
+    逐段产出 Word 正文的 (页码, 段落文本)。docx 不保存分页结果，页码根据段落中的手动分页符
+    与 Word 上次排版时记录的分页标记（w:lastRenderedPageBreak）估算，仅供定位参考
+    """
+    from docx import Document
+    from docx.oxml.ns import qn
+    from docx.text.paragraph import Paragraph
+    doc = Document(file_path)
+    body = doc.element.body
+    page = 1
+    # 直接遍历正文的 w:p 元素，不构造 doc.paragraphs 的完整列表
+    for element in body.iterchildren(qn("w:p")):
+        text = Paragraph(element, doc).text
+        if text.strip():
+            yield page, text + "\n"
+        page += max(len(element.xpath('.//w:br[@w:type="page"]')),
+                    len(element.xpath('.//w:lastRenderedPageBreak')))
+
 def _parse_markdown(file_path: str) -> str:
     with open(file_path, 'r', encoding='utf-8') as f:
         text = f.read()
@@ -142,20 +194,40 @@ def _parse_txt(file_path: str) -> str:
     logger.info(f"成功解析 TXT 文件: {file_path}")
     return text
 
+def iter_text_blocks(file_path: str, block_size: int = 1 << 16) -> Iterator[Tuple[None, str]]:
+    """逐行读取 txt / md，在空行处按约 block_size 字符分块产出 (None, 文本)；纯文本没有页码"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines, size = [], 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= block_size and not line.strip():
+                yield None, "".join(lines)
+                lines, size = [], 0
+        if lines:
+            yield None, "".join(lines)
+
+def iter_document_segments(file_path: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    流式解析文档，按页（PDF）、段落（Word）或文本块（txt / md）产出 (页码, 文本)，
+    没有页码的格式页码为 None
+    """
+    ext = _check_format(file_path)
+    if ext == ".pdf":
+        yield from ((page, text + "\n\n") for page, text in iter_pdf_pages(file_path))
+    elif ext == ".docx":
+        yield from iter_docx_paragraphs(file_path)
+    else:
+        yield from iter_text_blocks(file_path)
+
 
 # ==============================
 # 新增：语义分段 + 向量化
 # ==============================
 
-def create_documents_with_metadata(file_path: str, chunk_size: int = 512, chunk_overlap: int = 80) -> List[LCDocument]:
-    """
-    解析文档并切分为带元数据的 LangChain Document 列表
-    """
-    raw_text = parse_document(file_path)
-    file_name = os.path.basename(file_path)
-
+def _make_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
     # 使用递归分段器（优先按 \n\n → \n → " " 切分，避免在句子中间切断）
-    text_splitter = RecursiveCharacterTextSplitter(
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         separators=["\n\n", "\n", "。", "；", " ", ""],
@@ -163,22 +235,105 @@ def create_documents_with_metadata(file_path: str, chunk_size: int = 512, chunk_
         keep_separator=True
     )
 
-    chunks = text_splitter.split_text(raw_text)
-    documents = []
-    for i, chunk in enumerate(chunks):
-        if chunk.strip():  # 跳过空块
-            doc = LCDocument(
-                page_content=chunk.strip(),
-                metadata={
-                    "source": file_path,
-                    "file_name": file_name,
-                    "chunk_index": i,
-                    "total_chunks": len(chunks)
-                }
-            )
-            documents.append(doc)
-
-    logger.info(f"文档 {file_name} 切分为 {len(documents)} 个语义块")
+
+class StreamingChunker:
+    """
+    增量切分：逐段 feed 文本及其页码，缓冲区超过 window 个字符时切分一次，产出除最后一块以外的
+    文本块；最后一块（含与前一块的重叠部分）留在缓冲区与后续文本拼接后再切分，因此重叠可以跨越
+    页边界，内存只与 window 有关。每个文本块的 page 为其起始位置所在的页
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = 512, chunk_overlap: int = 80,
+                 window: Optional[int] = None):
+        self.splitter = _make_splitter(chunk_size, chunk_overlap)
+        self.window = window or chunk_size * 8
+        self.metadata = {"source": file_path, "file_name": os.path.basename(file_path)}
+        self._buffer = ""
+        # 缓冲区内各页的起始偏移与页码，按偏移递增
+        self._page_offsets: List[int] = []
+        self._pages: List[Optional[int]] = []
+        self.chunk_index = 0
+
+    def feed(self, text: str, page: Optional[int] = None) -> List[LCDocument]:
+        if not text:
+            return []
+        if not self._pages or self._pages[-1] != page:
+            self._page_offsets.append(len(self._buffer))
+            self._pages.append(page)
+        self._buffer += text
+        if len(self._buffer) < self.window:
+            return []
+        return self._split(final=False)
+
+    def finish(self) -> List[LCDocument]:
+        """文件结束时调用，切分并产出缓冲区中剩余的全部文本"""
+        return self._split(final=True)
+
+    def _page_at(self, offset: int) -> Optional[int]:
+        return self._pages[max(bisect_right(self._page_offsets, offset) - 1, 0)] if self._pages else None
+
+    def _split(self, final: bool) -> List[LCDocument]:
+        chunks = self.splitter.split_text(self._buffer)
+        # 分段器会去掉块首尾空白，块之间又有重叠，从上一块的起点之后查找即可定位每块的起始偏移
+        starts, pos = [], 0
+        for chunk in chunks:
+            start = self._buffer.find(chunk, pos)
+            start = pos if start < 0 else start
+            starts.append(start)
+            pos = start + 1
+        emit = len(chunks) if final or not chunks else len(chunks) - 1
+
+        documents = []
+        for chunk, start in zip(chunks[:emit], starts[:emit]):
+            if chunk.strip():  # 跳过空块
+                metadata = {**self.metadata, "chunk_index": self.chunk_index}
+                page = self._page_at(start)
+                if page is not None:
+                    metadata["page"] = page
+                documents.append(LCDocument(page_content=chunk.strip(), metadata=metadata))
+                self.chunk_index += 1
+
+        cut = len(self._buffer) if emit == len(chunks) else starts[emit]
+        if cut:
+            first = max(bisect_right(self._page_offsets, cut) - 1, 0)
+            self._page_offsets = [max(offset - cut, 0) for offset in self._page_offsets[first:]]
+            self._pages = self._pages[first:]
+            self._buffer = self._buffer[cut:]
+            if not self._buffer:
+                self._page_offsets, self._pages = [], []
+        return documents
+
+
+def iter_documents(file_path: str, chunk_size: int = 512, chunk_overlap: int = 80) -> Iterator[LCDocument]:
+    """
+    流式解析并切分文档，逐个产出带元数据的 LangChain Document；整个文件的文本与全部文本块
+    不会同时留在内存中，调用方可以边产出边向量化
+    """
+    chunker = StreamingChunker(file_path, chunk_size, chunk_overlap)
+    try:
+        for page, text in iter_document_segments(file_path):
+            yield from chunker.feed(text, page)
+        yield from chunker.finish()
+    except Exception as e:
+        logger.error(f"解析文件失败: {file_path}, 错误: {e}")
+        raise
+    logger.info(f"文档 {chunker.metadata['file_name']} 切分为 {chunker.chunk_index} 个语义块")
+
+
+def create_documents_with_metadata(file_path: str, chunk_size: int = 512, chunk_overlap: int = 80) -> List[LCDocument]:
+    """
+    解析文档并切分为带元数据的 LangChain Document 列表
+    """
+    return list(iter_documents(file_path, chunk_size, chunk_overlap))
+
+
+def split_text_to_documents(raw_text: str, file_path: str, chunk_size: int = 512, chunk_overlap: int = 80) -> List[LCDocument]:
+    """
+    将已解析的纯文本切分为带元数据的 LangChain Document 列表
+    """
+    chunker = StreamingChunker(file_path, chunk_size, chunk_overlap, window=len(raw_text) + 1)
+    documents = chunker.feed(raw_text) + chunker.finish()
+    logger.info(f"文档 {chunker.metadata['file_name']} 切分为 {len(documents)} 个语义块")
     return documents
 
 
@@ -191,6 +346,8 @@ def embed_documents(documents: List[LCDocument]) -> List[Dict[str, Any]]:
     if not api_key:
         raise ValueError("请设置环境变量 qianwen_api_key")
 
+    import openai as OpenAI
+
     client = OpenAI(
         api_key=api_key,
         base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    基于内容寻址的向量缓存：以 (模型名, 文本 SHA1) 为键，将向量以原始字节存入 SQLite
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " hash BLOB NOT NULL,"
+            " dtype TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model_name: str, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+        """
+        返回 {文本下标: 向量}，只包含命中的文本
+        """
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        unique = list(set(hashes))
+        with self._lock:
+            # SQLite 单条语句的参数个数有限，分批查询
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, dtype, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model_name, *batch],
+                ).fetchall()
+                for h, dtype, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=dtype)
+
+        result = {i: found[h] for i, h in enumerate(hashes) if h in found}
+        self.hits += len(result)
+        self.misses += len(texts) - len(result)
+        return result
+
+    def put_many(self, model_name: str, texts: Sequence[str], vectors: np.ndarray):
+        rows = [
+            (model_name, text_hash(t), str(v.dtype), np.ascontiguousarray(v).tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, dtype, vector) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def encode(self, encode_fn: Callable[[List[str]], np.ndarray], model_name: str, texts: List[str]) -> np.ndarray:
+        """
+        先查缓存，只把未命中的文本交给 encode_fn 编码，再写回缓存；返回顺序与 texts 一致
+        """
+        cached = self.get_many(model_name, texts)
+        missing = [i for i in range(len(texts)) if i not in cached]
+        if missing:
+            # 同一批内重复的文本只编码一次
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = np.asarray(encode_fn(unique_texts))
+            self.put_many(model_name, unique_texts, encoded)
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                cached[i] = by_text[texts[i]]
+        logger.debug(f"向量缓存命中 {len(texts) - len(missing)}/{len(texts)}")
+        return np.stack([cached[i] for i in range(len(texts))])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
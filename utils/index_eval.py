@@ -0,0 +1,138 @@
+"""
+索引选型评估：在已持久化的向量库上，对比各索引类型相对精确 flat 检索的 recall@k、
+索引体积与单次检索耗时，用于在内存与召回率之间取舍。
+
+    python -m utils.index_eval --persist-dir storage/index --types flat,hnsw,sq8,fp16,ivf,ivfpq --k 10
+"""
+import argparse
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from config.cfg import INDEX_DIR, INDEX_RESCORE_FACTOR
+from utils.index_factory import (
+    LOSSY_INDEX_TYPES,
+    MIN_POINTS_PER_CENTROID,
+    apply_search_params,
+    build_index,
+    exact_search,
+    reconstruct_all,
+    rescore,
+)
+from utils.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray) -> float:
+    """truth、found 均为 (查询数, k) 的 id 矩阵，返回平均每个查询找回的真实近邻比例"""
+    hits = sum(len(set(t[t >= 0].tolist()) & set(f[f >= 0].tolist())) for t, f in zip(truth, found))
+    return hits / max(int((truth >= 0).sum()), 1)
+
+
+def sample_queries(store: VectorStore, n: int, seed: int = 0) -> np.ndarray:
+    """没有提供查询文件时，随机抽取文本块的前半段作为查询，模拟与库内文本部分相关的提问"""
+    ids = store.chunks.ids(indexed_only=True)
+    picked = np.sort(np.random.default_rng(seed).choice(ids, min(n, len(ids)), replace=False))
+    texts = [t[:max(len(t) // 2, 1)] for t in store.chunks.texts(picked)]
+    return np.asarray(store._encode(texts), dtype=np.float32)
+
+
+def evaluate(store: VectorStore, queries: np.ndarray, index_types: List[str], k: int = 10,
+             rescore_factor: int = INDEX_RESCORE_FACTOR) -> List[Dict[str, Optional[float]]]:
+    recovered = reconstruct_all(store.index)
+    if recovered is None:
+        ids = store.chunks.ids(indexed_only=True)
+        vectors = np.asarray(store._encode(store.chunks.texts(ids)), dtype=np.float32)
+    else:
+        ids, vectors = recovered
+    order = np.argsort(ids)
+    ids, vectors = ids[order], np.ascontiguousarray(vectors[order], dtype=np.float32)
+    metric = store.metric
+    _, truth = exact_search(queries, vectors, ids, k, metric)
+    flat_bytes = vectors.nbytes
+
+    def vectors_fn(wanted: np.ndarray) -> np.ndarray:
+        return vectors[np.searchsorted(ids, wanted)]
+
+    report = []
+    for index_type in index_types:
+        if index_type in ("ivf", "ivfpq") and len(ids) < MIN_POINTS_PER_CENTROID:
+            logger.warning(f"文本块过少，跳过 {index_type}")
+            continue
+        start = time.perf_counter()
+        index = build_index(index_type, vectors.shape[1], train_vectors=vectors, metric=metric)
+        index.add_with_ids(vectors, ids)
+        apply_search_params(index)
+        build_seconds = time.perf_counter() - start
+        index_bytes = len(faiss.serialize_index(index))
+        # 重打分需要在索引旁另存原始 float32 向量与 id（见 RawVectorStore），计入内存占用
+        rescored = index_type in LOSSY_INDEX_TYPES and bool(rescore_factor)
+        raw_bytes = vectors.nbytes + ids.nbytes if rescored else 0
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        row = {
+            "index_type": index_type,
+            "index_bytes": index_bytes,
+            "raw_vector_bytes": raw_bytes,
+            "compression": round(flat_bytes / (index_bytes + raw_bytes), 2),
+            "build_seconds": round(build_seconds, 3),
+            f"recall@{k}": round(recall_at_k(truth, found), 4),
+            "search_ms": round(search_ms, 3),
+            f"rescored_recall@{k}": None,
+            "rescored_search_ms": None,
+        }
+        if rescored:
+            start = time.perf_counter()
+            _, candidates = index.search(queries, k * rescore_factor)
+            _, found = rescore(queries, candidates, vectors_fn, k, metric)
+            row["rescored_search_ms"] = round((time.perf_counter() - start) * 1000 / len(queries), 3)
+            row[f"rescored_recall@{k}"] = round(recall_at_k(truth, found), 4)
+        report.append(row)
+        logger.info(f"{index_type}: {row}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="评估各索引类型相对精确检索的 recall@k 与内存占用")
+    parser.add_argument("--persist-dir", default=INDEX_DIR)
+    parser.add_argument("--types", default="flat,hnsw,sq8,fp16,ivf,ivfpq", help="逗号分隔的索引类型")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="未提供 --queries-file 时抽样的查询数")
+    parser.add_argument("--queries-file", help="每行一个查询的文本文件")
+    parser.add_argument("--rescore-factor", type=int, default=INDEX_RESCORE_FACTOR)
+    parser.add_argument("--output", help="将报告写入 JSON 文件")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    store = VectorStore.load(args.persist_dir, mmap=True)
+    if args.queries_file:
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries = np.asarray(store._encode(texts), dtype=np.float32)
+    else:
+        queries = sample_queries(store, args.queries)
+    report = evaluate(store, queries, args.types.split(","), args.k, args.rescore_factor)
+
+    # 体积含重打分所需的原始向量
+    print(f"{'索引类型':<8}{'体积(MB)':>10}{'压缩比':>8}{'recall':>8}{'重打分recall':>14}{'ms/查询':>10}")
+    for row in report:
+        rescored = row[f"rescored_recall@{args.k}"]
+        total_mb = (row["index_bytes"] + row["raw_vector_bytes"]) / 2 ** 20
+        print(f"{row['index_type']:<10}{total_mb:>10.2f}{row['compression']:>10.2f}"
+              f"{row[f'recall@{args.k}']:>10.4f}{rescored if rescored is not None else '-':>14}"
+              f"{row['search_ms']:>10.3f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"metric": store.metric, "k": args.k, "queries": len(queries), "results": report},
+                      f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import logging
+import math
+from typing import Callable, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from config.cfg import (
+    FILTER_EXACT_MAX_IDS,
+    FILTER_MAX_EF_SEARCH,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    HNSW_M,
+    IVF_NLIST,
+    IVF_NPROBE,
+    PQ_M,
+    PQ_NBITS,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = {"flat", "hnsw", "ivf", "ivfpq", "sq8", "fp16"}
+# 编码有损、检索后需要用原始向量重打分的索引类型
+LOSSY_INDEX_TYPES = {"ivfpq", "sq8"}
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+_SQ_TYPES = {"sq8": faiss.ScalarQuantizer.QT_8bit, "fp16": faiss.ScalarQuantizer.QT_fp16}
+
+# 每个聚类中心至少需要的训练样本数（低于该值 k-means 会告警且效果变差）
+MIN_POINTS_PER_CENTROID = 39
+MAX_TRAIN_POINTS_PER_CENTROID = 256
+
+
+def _auto_nlist(n: int) -> int:
+    nlist = IVF_NLIST or int(4 * math.sqrt(max(n, 1)))
+    # 保证训练样本足够
+    return max(1, min(nlist, n // MIN_POINTS_PER_CENTROID, 65536))
+
+
+def _pq_m(dim: int) -> int:
+    """PQ 子空间数必须整除向量维度，取不超过 PQ_M 的最大约数"""
+    return max(m for m in range(1, min(PQ_M, dim) + 1) if dim % m == 0)
+
+
+def _sample(train_vectors: np.ndarray, size: int) -> np.ndarray:
+    sample = train_vectors[np.random.default_rng(0).choice(len(train_vectors), size, replace=False)]
+    return np.ascontiguousarray(sample, dtype=np.float32)
+
+
+def build_index(index_type: str, dim: int, train_vectors: Optional[np.ndarray] = None,
+                metric: str = "l2") -> faiss.Index:
+    """
+    创建支持 add_with_ids 的空索引：flat/hnsw/sq8/fp16 外包 IndexIDMap2；IVF 类索引本身按 id 存储，
+    不再包装（IndexIDMap 删除时会假设子索引重新编号，与 IVF 不兼容）。需要训练的索引用
+    train_vectors 中的随机样本训练。metric 为 ip 时调用方需保证向量已归一化
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选: {'、'.join(sorted(INDEX_TYPES))}")
+    if metric not in METRICS:
+        raise ValueError(f"不支持的距离度量: {metric}，可选: {'、'.join(sorted(METRICS))}")
+    faiss_metric = METRICS[metric]
+
+    if index_type == "flat":
+        base = faiss.IndexFlat(dim, faiss_metric)
+    elif index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, HNSW_M, faiss_metric)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type in _SQ_TYPES:
+        base = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[index_type], faiss_metric)
+        if index_type == "sq8":
+            # SQ8 需要按维统计取值范围；没有样本时先用 flat 索引，之后由重建升级
+            if train_vectors is None or len(train_vectors) == 0:
+                raise ValueError("sq8 索引需要训练向量")
+            base.train(_sample(train_vectors, min(len(train_vectors), 100000)))
+    else:
+        if train_vectors is None or len(train_vectors) < MIN_POINTS_PER_CENTROID:
+            raise ValueError(f"{index_type} 索引需要至少 {MIN_POINTS_PER_CENTROID} 个训练向量")
+        nlist = _auto_nlist(len(train_vectors))
+        quantizer = faiss.IndexFlat(dim, faiss_metric)
+        if index_type == "ivf":
+            base = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss_metric)
+        else:
+            base = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim), PQ_NBITS, faiss_metric)
+        # 训练只用随机采样的子集，避免在大语料上 k-means 过慢
+        sample_size = min(len(train_vectors), nlist * MAX_TRAIN_POINTS_PER_CENTROID)
+        logger.info(f"训练 {index_type} 索引: nlist={nlist}, 样本数={sample_size}")
+        base.train(_sample(train_vectors, sample_size))
+        # 哈希表形式的 id -> 倒排位置映射，使 IVF 能按 id 取回向量（reconstruct_batch），且仍支持删除
+        base.set_direct_map_type(faiss.DirectMap.Hashtable)
+        apply_search_params(base)
+        return base
+
+    index = faiss.IndexIDMap2(base)
+    apply_search_params(index)
+    return index
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index: faiss.Index) -> str:
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return "fp16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def metric_of(index: faiss.Index) -> str:
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def is_lossy(index: faiss.Index) -> bool:
+    return index_type_of(index) in LOSSY_INDEX_TYPES
+
+
+def exact_search(queries: np.ndarray, vectors: np.ndarray, ids: np.ndarray, k: int,
+                 metric: str = "l2") -> Tuple[np.ndarray, np.ndarray]:
+    """在给定向量上精确检索，返回值与 index.search 相同（id 取自 ids，不足 k 个以 -1 填充）"""
+    D, rows = faiss.knn(np.ascontiguousarray(queries, dtype=np.float32),
+                        np.ascontiguousarray(vectors, dtype=np.float32), k, metric=METRICS[metric])
+    return D, np.where(rows >= 0, ids[np.maximum(rows, 0)], -1)
+
+
+def rescore(queries: np.ndarray, candidates: np.ndarray, vectors_fn: Callable[[np.ndarray], np.ndarray],
+            k: int, metric: str = "l2") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    用原始 float 向量对有损索引返回的候选重新打分：candidates 为 (查询数, 候选数) 的 id 矩阵，
+    vectors_fn 按 id 返回向量。所有查询的候选去重后一次取回
+    """
+    unique = np.unique(candidates[candidates >= 0])
+    D = np.full((len(queries), k), np.inf if metric == "l2" else -np.inf, dtype=np.float32)
+    I = np.full((len(queries), k), -1, dtype=np.int64)
+    if not len(unique):
+        return D, I
+    vectors = np.asarray(vectors_fn(unique), dtype=np.float32)
+    rows = np.searchsorted(unique, np.maximum(candidates, 0))
+    for q, (query, row, cand) in enumerate(zip(queries, rows, candidates)):
+        valid = cand >= 0
+        if not valid.any():
+            continue
+        candidate_vectors = vectors[row[valid]]
+        if metric == "l2":
+            scores = ((candidate_vectors - query) ** 2).sum(axis=1)
+        else:
+            scores = candidate_vectors @ query
+        order = np.argsort(scores if metric == "l2" else -scores)[:k]
+        D[q, :len(order)] = scores[order]
+        I[q, :len(order)] = cand[valid][order]
+    return D, I
+
+
+def ensure_direct_map(index: faiss.Index):
+    """旧版本构建的 IVF 索引没有 id 映射，加载后补建，之后才能按 id 取回向量"""
+    ivf = faiss.try_extract_index_ivf(_base_index(index))
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+
+def can_reconstruct(index: faiss.Index) -> bool:
+    """能否按 id 取回向量；有损索引取回的是解码后的近似向量"""
+    ivf = faiss.try_extract_index_ivf(_base_index(index))
+    return ivf is None or ivf.direct_map.type != faiss.DirectMap.NoMap
+
+
+def apply_search_params(index: faiss.Index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """设置检索时的 nprobe / efSearch（二者不会随索引文件持久化，加载后需重新设置）"""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+
+
+def filtered_search(index: faiss.Index, queries: np.ndarray, k: int, ids: np.ndarray,
+                    exact_max_ids: int = FILTER_EXACT_MAX_IDS,
+                    vectors_fn: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    只在给定 id 子集内检索，返回值与 index.search 相同。子集较小时按 id 取回子集向量精确计算
+    （传入 vectors_fn 时用它取回，否则从索引中 reconstruct），耗时只与子集大小相关；子集较大（或索引无法按 id 取回向量）时带 IDSelectorBatch 检索，
+    并按子集占比放大 efSearch / nprobe，避免被过滤掉的邻居过多导致结果不足 k 个
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                np.full((len(queries), k), -1, dtype=np.int64))
+    index_type = index_type_of(index)
+    base = _base_index(index)
+    if len(ids) <= exact_max_ids and (vectors_fn is not None or can_reconstruct(index)):
+        vectors = vectors_fn(ids) if vectors_fn is not None else index.reconstruct_batch(ids)
+        return exact_search(queries, vectors, ids, k, metric_of(index))
+
+    selector = faiss.IDSelectorBatch(ids)
+    fraction = len(ids) / max(index.ntotal, 1)
+    if index_type == "hnsw":
+        ef_search = int(min(max(base.hnsw.efSearch / fraction, k), FILTER_MAX_EF_SEARCH))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    elif index_type in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        nprobe = min(ivf.nlist, math.ceil(ivf.nprobe / fraction))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def search_excluding(index: faiss.Index, queries: np.ndarray, k: int,
+                     exclude_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """检索时跳过 exclude_ids（如 HNSW 中已删除但尚未压缩的墓碑 id），返回值与 index.search 相同"""
+    if len(exclude_ids) == 0:
+        return index.search(queries, k)
+    # 外层选择器只持有内层的指针，两者都需在检索期间保持引用
+    batch = faiss.IDSelectorBatch(np.asarray(exclude_ids, dtype=np.int64))
+    selector = faiss.IDSelectorNot(batch)
+    if index_type_of(index) == "hnsw":
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(_base_index(index).hnsw.efSearch, k))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """HNSW 图不支持删除节点，删除的 id 由调用方记为墓碑，检索时用 search_excluding 跳过"""
+    return index_type_of(index) != "hnsw"
+
+
+def reconstruct_all(index: faiss.Index) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    从索引中取回全部 (ids, 向量)；PQ、SQ8 等有损编码无法无损还原，返回 None
+    """
+    index_type = index_type_of(index)
+    if index_type in LOSSY_INDEX_TYPES:
+        return None
+    if index_type == "ivf":
+        # IVFFlat 的倒排表中直接存放 float32 原始向量，逐个列表读出
+        ivf = faiss.extract_index_ivf(index)
+        invlists = ivf.invlists
+        all_ids, all_vectors = [np.zeros(0, dtype=np.int64)], [np.zeros((0, ivf.d), dtype=np.float32)]
+        for list_no in range(ivf.nlist):
+            n = invlists.list_size(list_no)
+            if n == 0:
+                continue
+            all_ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), n).copy())
+            codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), n * invlists.code_size).copy()
+            all_vectors.append(codes.view(np.float32).reshape(n, ivf.d))
+        return np.concatenate(all_ids), np.concatenate(all_vectors)
+    index = faiss.downcast_index(index)
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    if index.ntotal == 0:
+        return ids, np.zeros((0, index.d), dtype=np.float32)
+    return ids, _base_index(index).reconstruct_n(0, index.ntotal)
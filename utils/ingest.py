@@ -0,0 +1,264 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config.cfg import INGEST_BATCH_SIZE, INGEST_WORKERS, PDF_PAGES_PER_TASK
+from utils.vector_store import VectorStore
+
+# utils.document_parser 依赖 langchain 等较重的包，在解析文件的函数内按需导入，只读取清单时无需加载
+
+logger = logging.getLogger(__name__)
+
+# 与持久化索引放在同一目录下
+MANIFEST_FILE = "manifest.json"
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    入库清单：按文件路径记录 size、mtime、内容哈希以及该文件写入索引的文本块 id
+    """
+
+    def __init__(self, path: str, files: Optional[Dict[str, dict]] = None):
+        self.path = path
+        self.files: Dict[str, dict] = files or {}
+
+    @classmethod
+    def load(cls, persist_dir: str) -> "IngestManifest":
+        path = os.path.join(persist_dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(path, json.load(f).get("files", {}))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+    def is_unchanged(self, file_path: str, stat: os.stat_result) -> bool:
+        """size 与 mtime 都未变则视为未修改，无需读取文件内容"""
+        entry = self.files.get(file_path)
+        return entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+
+def scan_documents(doc_dir: str) -> List[str]:
+    from utils.document_parser import SUPPORTED_FORMATS
+    return sorted(str(p) for p in Path(doc_dir).glob("*.*") if p.suffix.lower() in SUPPORTED_FORMATS)
+
+
+def _parse_and_chunk(file_path: str) -> Tuple[str, list]:
+    from utils.document_parser import create_documents_with_metadata
+    return file_path, create_documents_with_metadata(file_path)
+
+
+def _iter_file_batches(file_path: str, batch_size: int) -> Iterator[Tuple[str, Optional[list], bool]]:
+    """在当前进程流式解析切分单个文件，每 batch_size 个文本块产出一次"""
+    from utils.document_parser import iter_documents
+
+    batch = []
+    try:
+        for doc in iter_documents(file_path):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield file_path, batch, False
+                batch = []
+    except Exception as e:
+        logger.error(f"处理文件失败: {file_path}, 错误: {e}")
+        yield file_path, None, True
+        return
+    yield file_path, batch, True
+
+
+def iter_parsed_documents(file_paths: List[str], max_workers: int = INGEST_WORKERS,
+                          pdf_pages_per_task: int = PDF_PAGES_PER_TASK,
+                          batch_size: int = INGEST_BATCH_SIZE) -> Iterator[Tuple[str, Optional[list], bool]]:
+    """
+    解析并切分文件，流式产出 (file_path, documents, done)：同一文件可能分多次产出，
+    done=True 表示该文件已结束；解析失败时产出 (file_path, None, True)，此前已产出的文本块应作废。
+
+    max_workers > 1 时在进程池中并行处理。页数较多的 PDF 按页区间拆成多个任务，
+    每个文件同时最多提交 max_workers 个区间，按页序送入父进程中该文件的 StreamingChunker，
+    切出的文本块立即产出，因此内存与 PDF 页数无关
+    """
+    from utils.document_parser import StreamingChunker, parse_pdf_pages, pdf_page_count
+
+    if max_workers <= 1:
+        for file_path in file_paths:
+            yield from _iter_file_batches(file_path, batch_size)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        # 按页区间处理的 PDF: file_path -> 切分状态
+        streams: Dict[str, dict] = {}
+
+        def submit_range(file_path: str):
+            state = streams[file_path]
+            if state["next_submit"] >= len(state["starts"]):
+                return
+            part = state["next_submit"]
+            start = state["starts"][part]
+            future = executor.submit(parse_pdf_pages, file_path, start, min(start + pdf_pages_per_task, state["pages"]))
+            futures[future] = ("pages", file_path, part)
+            state["next_submit"] += 1
+
+        for file_path in file_paths:
+            try:
+                pages = pdf_page_count(file_path) if Path(file_path).suffix.lower() == ".pdf" else 0
+            except Exception as e:
+                logger.error(f"读取 PDF 页数失败: {file_path}, 错误: {e}")
+                yield file_path, None, True
+                continue
+            # 页数不多的 PDF 不拆分，避免同一文件被多个进程重复打开
+            if pages > 2 * pdf_pages_per_task:
+                streams[file_path] = {"pages": pages, "starts": range(0, pages, pdf_pages_per_task),
+                                      "next_submit": 0, "next_feed": 0, "done_parts": {},
+                                      "chunker": StreamingChunker(file_path)}
+                for _ in range(max_workers):
+                    submit_range(file_path)
+            else:
+                futures[executor.submit(_parse_and_chunk, file_path)] = ("file", file_path, None)
+
+        while futures:
+            future = next(as_completed(futures))
+            kind, file_path, part = futures.pop(future)
+            if kind == "pages" and file_path not in streams:
+                continue  # 该文件已有区间失败
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"处理文件失败: {file_path}, 错误: {e}")
+                streams.pop(file_path, None)
+                yield file_path, None, True
+                continue
+            if kind == "file":
+                yield result[0], result[1], True
+                continue
+
+            # 区间可能乱序完成，只有前面的区间都到齐后才按页序送入切分器
+            state = streams[file_path]
+            state["done_parts"][part] = result
+            documents = []
+            while state["next_feed"] in state["done_parts"]:
+                for page, text in state["done_parts"].pop(state["next_feed"]):
+                    documents.extend(state["chunker"].feed(text + "\n\n", page))
+                state["next_feed"] += 1
+                submit_range(file_path)
+            done = state["next_feed"] == len(state["starts"])
+            if done:
+                documents.extend(state["chunker"].finish())
+                del streams[file_path]
+            if documents or done:
+                yield file_path, documents, done
+
+
+def bulk_ingest(vector_store: VectorStore, file_paths: List[str], max_workers: int = INGEST_WORKERS,
+                batch_size: int = INGEST_BATCH_SIZE) -> Dict[str, Optional[List[int]]]:
+    """
+    批量入库：解析切分的结果流式汇入同一个向量化阶段，累计满 batch_size 个文本块
+    再调用一次 add_texts，大文件边解析边入库。返回 {file_path: 文本块 id 列表}，失败的文件为 None；
+    文件中途失败时，已写入索引的部分文本块会被删除
+    """
+    results: Dict[str, Optional[List[int]]] = {}
+    # 一个文件的文本块可能分布在多次 flush 中
+    buffer: List[Tuple[str, object]] = []
+
+    def fail(file_path: str):
+        buffer[:] = [(fp, doc) for fp, doc in buffer if fp != file_path]
+        if results.get(file_path):
+            vector_store.delete(results[file_path])
+        results[file_path] = None
+
+    def flush():
+        if not buffer:
+            return
+        batch = list(buffer)
+        buffer.clear()
+        ids = vector_store.add_texts([doc.page_content for _, doc in batch], [doc.metadata for _, doc in batch])
+        if not ids:
+            for file_path in {fp for fp, _ in batch}:
+                fail(file_path)
+        else:
+            for (file_path, _), chunk_id in zip(batch, ids):
+                results[file_path].append(chunk_id)
+
+    for file_path, documents, _done in iter_parsed_documents(file_paths, max_workers=max_workers,
+                                                              batch_size=batch_size):
+        if documents is None:
+            fail(file_path)
+            continue
+        if file_path in results and results[file_path] is None:
+            continue  # 该文件此前的批次写入失败，其余文本块丢弃
+        results.setdefault(file_path, [])
+        buffer.extend((file_path, doc) for doc in documents)
+        if len(buffer) >= batch_size:
+            flush()
+    flush()
+    return results
+
+
+def sync_directory(vector_store: VectorStore, doc_dir: str, manifest: IngestManifest,
+                   max_workers: int = INGEST_WORKERS) -> Dict[str, int]:
+    """
+    增量入库：跳过未修改的文件，重新切分并向量化内容已变化的文件，
+    并从索引中移除已删除文件的文本块。返回各类文件的数量统计
+    """
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    current = scan_documents(doc_dir)
+
+    for file_path in set(manifest.files) - set(current):
+        entry = manifest.files.pop(file_path)
+        vector_store.delete(entry["chunk_ids"])
+        stats["removed"] += 1
+        logger.info(f"文件已删除，移除其文本块: {file_path}")
+
+    changed: Dict[str, dict] = {}
+    for file_path in current:
+        try:
+            stat = os.stat(file_path)
+            if manifest.is_unchanged(file_path, stat):
+                stats["unchanged"] += 1
+                continue
+
+            entry = manifest.files.get(file_path)
+            sha256 = file_sha256(file_path)
+            if entry is not None and entry["sha256"] == sha256:
+                # 仅 mtime 变化（如被 touch 或重新拷贝），内容未变
+                entry.update(size=stat.st_size, mtime=stat.st_mtime)
+                stats["unchanged"] += 1
+                continue
+            changed[file_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error(f"处理文件失败: {file_path}, 错误: {e}")
+
+    if changed:
+        logger.info(f"需要重新入库的文件: {len(changed)} 个")
+        ingested = bulk_ingest(vector_store, list(changed), max_workers=max_workers)
+        for file_path, info in changed.items():
+            chunk_ids = ingested.get(file_path)
+            if chunk_ids is None:
+                stats["failed"] += 1
+                continue
+            # 新文本块写入成功后再移除旧块，失败时旧内容仍可检索
+            entry = manifest.files.get(file_path)
+            if entry is not None:
+                vector_store.delete(entry["chunk_ids"])
+            manifest.files[file_path] = {**info, "chunk_ids": chunk_ids}
+            stats["updated" if entry is not None else "added"] += 1
+
+    logger.info(f"增量入库完成: {stats}")
+    return stats
@@ -0,0 +1,154 @@
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """处理函数中抛出，以指定的状态码返回错误；headers 为额外的响应头（如 Retry-After）"""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class EventStream:
+    """
+    处理函数返回该对象时以 SSE（text/event-stream）逐条发送 events 中的 JSON 事件。
+    发送结束、出错或客户端断开时都会调用 close()：关闭 events 并调用一次 on_close，
+    即使 events 尚未开始迭代（此时生成器的 finally 不会执行）
+    """
+
+    def __init__(self, events: Iterable[dict], on_close: Optional[Callable[[], None]] = None):
+        self.events = events
+        self.on_close = on_close
+
+    def close(self):
+        try:
+            close = getattr(self.events, "close", None)
+            if close is not None:
+                close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class TextResponse:
+    """处理函数返回该对象时按 content_type 原样发送 body，如 Prometheus 文本格式的指标"""
+
+    def __init__(self, body: str, content_type: str = "text/plain; charset=utf-8"):
+        self.body = body
+        self.content_type = content_type
+
+
+class JSONServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认 listen 队列只有 5，高并发时会出现连接被拒后重试
+    request_queue_size = 1024
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """以 JSON 收发的请求处理基类：routes 把 (HTTP 方法, 路径) 映射到 server.app 上的方法名"""
+    protocol_version = "HTTP/1.1"
+    routes: Dict[tuple, str] = {}
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _dispatch(self, body: Optional[dict]):
+        handler = self.routes.get((self.command, self.path.rstrip("/")))
+        if handler is None:
+            self._send(404, {"error": f"未知接口: {self.command} {self.path}"})
+            return
+        try:
+            result = getattr(self.server.app, handler)(body or {})
+        except HTTPError as e:
+            self._send(e.status, {"error": str(e)}, e.headers)
+            return
+        except (KeyError, ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logger.exception(f"处理请求失败: {self.path}")
+            self._send(500, {"error": str(e)})
+            return
+        if isinstance(result, EventStream):
+            self._send_events(result)
+        elif isinstance(result, TextResponse):
+            self._send_text(result)
+        else:
+            self._send(200, result)
+
+    def _send(self, status: int, payload, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, response: TextResponse):
+        data = response.body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", response.content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_event(self, event: dict):
+        data = f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_events(self, stream: EventStream):
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for event in stream.events:
+                    self._write_event(event)
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                # 响应头已发出，无法再改状态码，以 error 事件告知客户端后正常结束流
+                logger.exception(f"流式响应失败: {self.path}")
+                self._write_event({"error": str(e)})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("客户端已断开流式连接")
+        finally:
+            stream.close()
+
+    def do_GET(self):
+        self._dispatch(None)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError(f"Content-Length 无效: {length}")
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("请求体须为 JSON 对象")
+        except ValueError as e:
+            # 包括 JSON 与 UTF-8 解码错误；请求体长度不可信时无法定位下一个请求，回复后关闭连接
+            self.close_connection = True
+            self._send(400, {"error": f"请求体无效: {e}"}, {"Connection": "close"})
+            return
+        self._dispatch(body)
+
+
+def serve(app, handler_class, host: str, port: int) -> JSONServer:
+    """创建绑定到 app 的服务（未启动），port=0 时自动分配端口"""
+    server = JSONServer((host, port), handler_class)
+    server.app = app
+    return server
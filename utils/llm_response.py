@@ -1,37 +1,92 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
+import asyncio
+import httpx
 import os
 import logging
+import threading
 import time
+import weakref
+from config.cfg import LLM_BASE_URL, LLM_MODEL, LLM_TIMEOUT, LLM_MAX_CONNECTIONS, HISTORY_SUMMARY_TOKENS
+from utils.prompt_builder import split_history
+from utils.metrics import LLM_ERRORS, observe_stage, stage, timed
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 # 使用 @traceable 自动上报到 LangSmith
 from langsmith import traceable
-@traceable(run_type="chain")
-def get_llm_answer(user_query, context_docs, chat_history):
-    try:
-        start_time = time.time()
-        if chat_history is None:
-            chat_history = []
-
-        api_key=os.getenv("qianwen_api_key")
-        if not api_key:
-            logger.error("不存在密钥，请在环境变量中设置 qianwen_api_key")
-            
-        client = OpenAI(
-            api_key=api_key, 
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+LLM_ERROR_ANSWER = "调用 LLM 回答失败。"
+
+# 进程内共享的客户端：复用 HTTP 连接池与 TLS 会话，避免每次调用重新建连
+_client = None
+_client_lock = threading.Lock()
+# AsyncOpenAI 的连接池绑定在创建它的事件循环上，按事件循环分别缓存
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _api_key():
+    api_key = os.getenv("qianwen_api_key")
+    if not api_key:
+        logger.error("不存在密钥，请在环境变量中设置 qianwen_api_key")
+    return api_key
+
+
+def _limits():
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=_api_key(),
+                    base_url=LLM_BASE_URL,
+                    timeout=LLM_TIMEOUT,
+                    http_client=DefaultHttpxClient(limits=_limits()),
+                )
+    return _client
+
+
+def configure_client(base_url: str):
+    """切换 LLM 服务地址（如压测时指向本地桩服务），之后的调用使用新建的客户端"""
+    global LLM_BASE_URL, _client
+    with _client_lock:
+        LLM_BASE_URL = base_url
+        _client = None
+        _async_clients.clear()
+
+
+def get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=_api_key(),
+            base_url=LLM_BASE_URL,
+            timeout=LLM_TIMEOUT,
+            http_client=DefaultAsyncHttpxClient(limits=_limits()),
         )
+        _async_clients[loop] = client
+    return client
+
 
-        # 拼接上下文
-        context = "\n\n".join([
-            f"【主题】{doc['metadata']['title']}\n"
-            f"【参考回答】{doc['page_content'].split('回答：')[-1].strip()}"
-            for doc in context_docs
-        ])
+@timed("prompt_build")
+def _build_messages(user_query, context_docs, chat_history, history_summary=None):
+    """拼接系统提示词、历史摘要、历史对话与当前问题，返回 (messages, context, 截断后的历史)"""
+    if chat_history is None:
+        chat_history = []
 
-        system_prompt = f"""
+    # 拼接上下文
+    context = "\n\n".join([
+        f"【主题】{doc['metadata']['title']}\n"
+        f"【参考回答】{doc['page_content'].split('回答：')[-1].strip()}"
+        for doc in context_docs
+    ])
+
+    system_prompt = f"""
         你是一名专业文档分析助手，请根据参考资料和对话历史回答用户问题。
         要求：
         1. 若问题与历史对话相关（如询问之前的提问、补充说明），优先使用对话历史回答；
@@ -44,50 +99,267 @@ def get_llm_answer(user_query, context_docs, chat_history):
 
         请用中文正式回答用户问题：
         """
-        MAX_HISTORY_MESSAGES = 10
-        if len(chat_history) > MAX_HISTORY_MESSAGES:
-            chat_history = chat_history[-MAX_HISTORY_MESSAGES:]
-
-        # 5. 构建完整 messages 列表
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        # 添加历史对话（user + assistant 交替）
-        messages.extend(chat_history)
-        # 添加当前用户新问题
-        messages.append({"role": "user", "content": user_query})
-
-        response = client.chat.completions.create(
-            model="qwen-plus",  # 推荐使用 qwen-plus 或 qwen-max，法律理解更强
-            messages=messages,
-            temperature=0.1,   # 低温度，减少幻觉
-            max_tokens=1024
-        )
-        answer = response.choices[0].message.content
-        lasttime = time.time() - start_time
-        result = {
-            "input": {
-                "user_query": user_query,
-                "context_doc_count": len(context_docs),
-                "chat_history_length": len(chat_history)
-            },
-            "output": {
-                "answer": answer,
-                "latency_seconds": round(lasttime, 3),
-                "context_used": bool(context.strip())
-            }
+    # 按 token 预算保留最近的历史，更早的内容由调用方以滚动摘要的形式传入
+    _, chat_history = split_history(chat_history)
+
+    # 构建完整 messages 列表
+    messages = [
+        {"role": "system", "content": system_prompt}
+    ]
+    if history_summary:
+        messages.append({"role": "system", "content": f"此前对话摘要：\n{history_summary}"})
+    # 添加历史对话（user + assistant 交替）
+    messages.extend(chat_history)
+    # 添加当前用户新问题
+    messages.append({"role": "user", "content": user_query})
+    return messages, context, chat_history
+
+
+def _completion_kwargs(messages):
+    return dict(
+        model=LLM_MODEL,  # 推荐使用 qwen-plus 或 qwen-max，法律理解更强
+        messages=messages,
+        temperature=0.1,   # 低温度，减少幻觉
+        max_tokens=1024
+    )
+
+
+def _result(user_query, context_docs, chat_history, context, answer, start_time):
+    lasttime = time.time() - start_time
+    return {
+        "input": {
+            "user_query": user_query,
+            "context_doc_count": len(context_docs),
+            "chat_history_length": len(chat_history)
+        },
+        "output": {
+            "answer": answer,
+            "latency_seconds": round(lasttime, 3),
+            "context_used": bool(context.strip())
         }
+    }
+
+
+def _error_result(user_query, error, start_time):
+    lasttime = time.time() - start_time
+    LLM_ERRORS.inc()
+    logger.error(f"调用llm回答失败: {error}")
+    return {
+        "input": {"user_query": user_query},
+        "output": {
+            "error": str(error),
+            "latency_seconds": round(lasttime, 3),
+            "answer": LLM_ERROR_ANSWER
+        }
+    }
+
+
+@traceable(run_type="chain")
+def get_llm_answer(user_query, context_docs, chat_history, history_summary=None):
+    start_time = time.time()
+    try:
+        messages, context, chat_history = _build_messages(user_query, context_docs, chat_history, history_summary)
+        with stage("llm"):
+            response = get_client().chat.completions.create(**_completion_kwargs(messages))
+        answer = response.choices[0].message.content
+        return _result(user_query, context_docs, chat_history, context, answer, start_time)
+    except Exception as e:
+        return _error_result(user_query, e, start_time)
+
+
+@traceable(run_type="chain")
+async def get_llm_answer_async(user_query, context_docs, chat_history, history_summary=None):
+    """get_llm_answer 的异步版本，使用共享的 AsyncOpenAI 客户端"""
+    start_time = time.time()
+    try:
+        messages, context, chat_history = _build_messages(user_query, context_docs, chat_history, history_summary)
+        with stage("llm"):
+            response = await get_async_client().chat.completions.create(**_completion_kwargs(messages))
+        answer = response.choices[0].message.content
+        return _result(user_query, context_docs, chat_history, context, answer, start_time)
+    except Exception as e:
+        return _error_result(user_query, e, start_time)
+
+
+class _BaseAnswerStream:
+    """
+    流式回答的公共部分：迭代结束后 result 中包含完整回答、首 token 延迟与总延迟；
+    then() 注册的函数按顺序变换最终结果（如写入对话历史、换成上层的结果格式）
+    """
+
+    # 是否把本次回答计入 LLM 耗时指标；命中缓存的回答不调用 LLM
+    calls_llm = True
+
+    def __init__(self, user_query, context_docs, chat_history, history_summary=None):
+        self.user_query = user_query
+        self.context_docs = context_docs
+        self.chat_history = chat_history
+        self.history_summary = history_summary
+        self.result = None
+        self._callbacks = []
+        self._finished = False
+
+    def then(self, fn):
+        self._callbacks.append(fn)
+        return self
+
+    def _prepare(self):
+        self._start_time = time.time()
+        self._first_token_latency = None
+        self._parts = []
+        messages, self._context, self._history = _build_messages(
+            self.user_query, self.context_docs, self.chat_history, self.history_summary)
+        return dict(_completion_kwargs(messages), stream=True)
+
+    def _on_token(self, token):
+        if self._first_token_latency is None:
+            self._first_token_latency = time.time() - self._start_time
+        self._parts.append(token)
+
+    @staticmethod
+    def _delta(chunk):
+        return chunk.choices[0].delta.content if chunk.choices else None
+
+    def _finish(self, error=None, interrupted=False):
+        """
+        生成最终结果并依次调用 then() 注册的函数，只执行一次。interrupted=True 表示调用方提前停止迭代
+        （break、客户端断开、close()），已产出的部分作为回答，并标记 interrupted 以免写入答案缓存
+        """
+        if self._finished:
+            return
+        self._finished = True
+        if error is None:
+            result = _result(self.user_query, self.context_docs, self._history, self._context,
+                             "".join(self._parts), self._start_time)
+        else:
+            result = _error_result(self.user_query, error, self._start_time)
+            if self._parts:
+                # 已输出部分内容时保留已生成的部分
+                result["output"]["answer"] = "".join(self._parts)
+        if interrupted:
+            result["output"]["interrupted"] = True
+        first = self._first_token_latency
+        result["output"]["first_token_latency_seconds"] = round(first, 3) if first is not None else None
+        if self.calls_llm:
+            # 流式回答跨越多次迭代，无法用 with 包裹，结束时补记总耗时与首 token 延迟
+            observe_stage("llm_stream", time.time() - self._start_time)
+            if first is not None:
+                observe_stage("llm_first_token", first)
+        for fn in self._callbacks:
+            result = fn(result)
+        self.result = result
+
+
+class AnswerStream(_BaseAnswerStream):
+    """同步流式回答，逐个产出 token"""
+
+    def __iter__(self):
+        try:
+            kwargs = self._prepare()
+            # 以 with 打开响应，提前停止迭代时立即关闭连接，归还连接池
+            with get_client().chat.completions.create(**kwargs) as response:
+                for chunk in response:
+                    token = self._delta(chunk)
+                    if token:
+                        self._on_token(token)
+                        yield token
+        except Exception as e:
+            # 先记录结果再产出兜底回答，调用方在兜底回答处停止迭代时结果也已完整
+            self._finish(e)
+            if not self._parts:
+                yield LLM_ERROR_ANSWER
+        else:
+            self._finish()
+        finally:
+            # 提前停止迭代时生成器收到 GeneratorExit（不是 Exception），在此补记结果；已完成时不做任何事
+            self._finish(interrupted=True)
+
+
+class AsyncAnswerStream(_BaseAnswerStream):
+    """异步流式回答，使用共享的 AsyncOpenAI 客户端逐个产出 token"""
+
+    async def __aiter__(self):
+        try:
+            kwargs = self._prepare()
+            async with await get_async_client().chat.completions.create(**kwargs) as response:
+                async for chunk in response:
+                    token = self._delta(chunk)
+                    if token:
+                        self._on_token(token)
+                        yield token
+        except Exception as e:
+            # 先记录结果再产出兜底回答，调用方在兜底回答处停止迭代时结果也已完整
+            self._finish(e)
+            if not self._parts:
+                yield LLM_ERROR_ANSWER
+        else:
+            self._finish()
+        finally:
+            # 提前停止迭代时，异步生成器在 aclose()（或事件循环回收它）时执行到这里，补记结果
+            self._finish(interrupted=True)
+
 
-        return result
+class CachedAnswerStream(_BaseAnswerStream):
+    """已有完整回答（如命中答案缓存）时使用，一次性产出全部内容，同步与异步迭代均可"""
+    calls_llm = False
 
+    def __init__(self, answer, user_query, context_docs, chat_history, history_summary=None):
+        super().__init__(user_query, context_docs, chat_history, history_summary)
+        self.answer = answer
+
+    def _emit(self):
+        self._prepare()
+        self._on_token(self.answer)
+        self._finish()
+
+    def __iter__(self):
+        self._emit()
+        yield self.answer
+
+    async def __aiter__(self):
+        self._emit()
+        yield self.answer
+
+
+def stream_llm_answer(user_query, context_docs, chat_history, history_summary=None) -> AnswerStream:
+    return AnswerStream(user_query, context_docs, chat_history, history_summary)
+
+
+def astream_llm_answer(user_query, context_docs, chat_history, history_summary=None) -> AsyncAnswerStream:
+    return AsyncAnswerStream(user_query, context_docs, chat_history, history_summary)
+
+
+def _summary_messages(previous_summary, messages):
+    transcript = "\n".join(f"{'用户' if m['role'] == 'user' else '助手'}：{m['content']}" for m in messages)
+    prompt = (
+        "请将以下对话压缩为简洁的中文摘要，保留用户关注的问题、已给出的关键结论和尚未解决的事项，"
+        "不要编造内容。\n\n"
+        f"已有摘要：\n{previous_summary or '无'}\n\n新增对话：\n{transcript}"
+    )
+    return [{"role": "user", "content": prompt}]
+
+
+def _summary_kwargs(previous_summary, messages):
+    return dict(model=LLM_MODEL, messages=_summary_messages(previous_summary, messages),
+                temperature=0.1, max_tokens=HISTORY_SUMMARY_TOKENS)
+
+
+def summarize_history(previous_summary, messages):
+    """把较早的对话与已有摘要合并为新的滚动摘要；失败时返回 None"""
+    try:
+        with stage("summarize"):
+            response = get_client().chat.completions.create(**_summary_kwargs(previous_summary, messages))
+        return response.choices[0].message.content
+    except Exception as e:
+        logger.error(f"生成对话摘要失败: {e}")
+        return None
+
+
+async def summarize_history_async(previous_summary, messages):
+    try:
+        with stage("summarize"):
+            response = await get_async_client().chat.completions.create(**_summary_kwargs(previous_summary, messages))
+        return response.choices[0].message.content
     except Exception as e:
-        lasttime = time.time() - start_time
-        logger.error(f"调用llm回答失败: {e}")
-        return {
-            "input": {"user_query": user_query},
-            "output": {
-                "error": str(e),
-                "latency_seconds": round(lasttime, 3),
-                "answer": "调用 LLM 回答失败。"
-            }
-        }
\ No newline at end of file
+        logger.error(f"生成对话摘要失败: {e}")
+        return None
@@ -0,0 +1,418 @@
+"""
+进程内指标与追踪：各阶段（编码、FAISS 检索、BM25、重排、拼装提示、LLM 调用等）的耗时直方图与计数器
+常驻内存，开销只有一次计时与一次加锁累加；可渲染为 Prometheus 文本格式（/metrics），
+也可按 OTLP/JSON 格式写入本地文件，供 OpenTelemetry Collector 的 otlpjsonfile 接收器读取。
+
+    with stage("faiss_search"):
+        D, I = index.search(queries, k)
+
+按请求采样（TRACE_SAMPLE_RATE）时，请求内的各阶段同时记录为 span，父子关系通过 contextvars 传递。
+"""
+import atexit
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config.cfg import METRICS_ENABLED, METRICS_PORT, OTEL_EXPORT_INTERVAL, OTEL_EXPORT_PATH, TRACE_SAMPLE_RATE
+from utils.json_http import JSONHandler, TextResponse, serve
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "rag-agent"
+# 秒级耗时的桶上界：覆盖亚毫秒级的 FAISS 检索到数十秒的 LLM 调用
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 待导出的 span 上限；导出跟不上时丢弃最早的 span，不让追踪占用无限内存
+MAX_PENDING_SPANS = 10000
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"标签应为 {labelnames}，实际为 {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _prometheus_labels(pairs: List[Tuple[str, str]]) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def _otlp_attributes(labelnames: Tuple[str, ...], key: Tuple[str, ...]) -> List[dict]:
+    return [{"key": k, "value": {"stringValue": v}} for k, v in zip(labelnames, key)]
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def render_prometheus(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_prometheus_labels(list(zip(self.labelnames, key)))} {value:g}")
+        return lines
+
+    def to_otlp(self, start_ns: int, now_ns: int) -> dict:
+        with self._lock:
+            values = list(self._values.items())
+        return {
+            "name": self.name,
+            "description": self.description,
+            "sum": {
+                "aggregationTemporality": 2,  # CUMULATIVE
+                "isMonotonic": True,
+                "dataPoints": [{"attributes": _otlp_attributes(self.labelnames, key), "asDouble": value,
+                                "startTimeUnixNano": str(start_ns), "timeUnixNano": str(now_ns)}
+                               for key, value in values],
+            },
+        }
+
+
+class Histogram:
+    """固定桶直方图；每个桶只计落在该区间内的观测数，渲染 Prometheus 格式时再累加"""
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, unit: str = "s"):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self.unit = unit
+        # 标签取值 -> [各桶计数（最后一个为 +Inf）, 总和, 总数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """按桶线性插值估算分位数，无观测时返回 None"""
+        series = self.snapshot().get(_label_key(self.labelnames, labels))
+        if series is None or not series[2]:
+            return None
+        counts, _, count = series
+        rank, seen = q * count, 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def render_prometheus(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.snapshot().items():
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_prometheus_labels(pairs + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_prometheus_labels(pairs)} {total:.6f}")
+            lines.append(f"{self.name}_count{_prometheus_labels(pairs)} {count}")
+        return lines
+
+    def to_otlp(self, start_ns: int, now_ns: int) -> dict:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "unit": self.unit,
+            "histogram": {
+                "aggregationTemporality": 2,  # CUMULATIVE
+                "dataPoints": [{"attributes": _otlp_attributes(self.labelnames, key),
+                                "startTimeUnixNano": str(start_ns), "timeUnixNano": str(now_ns),
+                                "count": str(count), "sum": total,
+                                "bucketCounts": [str(n) for n in counts], "explicitBounds": list(self.buckets)}
+                               for key, (counts, total, count) in self.snapshot().items()],
+            },
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.start_ns = time.time_ns()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {type(metric).__name__}")
+            return metric
+
+    def counter(self, name: str, description: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, description, labelnames)
+
+    def histogram(self, name: str, description: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, description, labelnames, buckets)
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render_prometheus()) + "\n"
+
+    def to_otlp(self) -> dict:
+        """OTLP/JSON 的 ExportMetricsServiceRequest"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        now_ns = time.time_ns()
+        return {"resourceMetrics": [{
+            "resource": _resource(),
+            "scopeMetrics": [{"scope": {"name": __name__},
+                              "metrics": [m.to_otlp(self.start_ns, now_ns) for m in metrics]}],
+        }]}
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "请求链路各阶段耗时（秒）", ("stage",))
+REQUESTS = REGISTRY.counter("rag_requests_total", "问答请求数", ("mode",))
+ANSWER_CACHE = REGISTRY.counter("rag_answer_cache_total", "答案缓存查询数", ("result",))
+LLM_ERRORS = REGISTRY.counter("rag_llm_errors_total", "LLM 调用失败次数")
+SEARCH_QUERIES = REGISTRY.counter("rag_search_queries_total", "向量库检索的查询数")
+EMBEDDED_TEXTS = REGISTRY.counter("rag_embedded_texts_total", "送入 Embedding 编码的文本数（含缓存命中）")
+QUERY_CACHE = REGISTRY.counter("rag_query_cache_total", "查询缓存查找数", ("cache", "result"))
+DUPLICATE_CHUNKS = REGISTRY.counter("rag_duplicate_chunks_total", "入库时判定为近似重复、未向量化的文本块数")
+
+
+def stage_summary() -> Dict[str, dict]:
+    """各阶段的调用次数、平均耗时与 p95（按桶估算），单位毫秒"""
+    summary = {}
+    for (name,), (_, total, count) in sorted(STAGE_SECONDS.snapshot().items()):
+        if count:
+            summary[name] = {"count": count, "mean_ms": round(total / count * 1000, 3),
+                             "p95_ms": round(STAGE_SECONDS.quantile(0.95, stage=name) * 1000, 3)}
+    return summary
+
+
+def _resource() -> dict:
+    return {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                           {"key": "process.pid", "value": {"intValue": str(os.getpid())}}]}
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "start_ns", "end_ns", "attributes",
+                 "duration", "child_seconds")
+
+    def __init__(self, name: str, parent: Optional["Span"], sampled: bool, attributes: Optional[dict] = None):
+        self.name = name
+        self.sampled = sampled
+        self.trace_id = parent.trace_id if parent is not None else (random.getrandbits(128) if sampled else 0)
+        self.span_id = random.getrandbits(64) if sampled else 0
+        self.parent_id = parent.span_id if parent is not None else 0
+        self.start_ns = time.time_ns() if sampled else 0
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.duration = 0.0
+        # 直接子阶段的耗时之和；请求总耗时减去它即为编排框架（LangGraph）等自身的开销
+        self.child_seconds = 0.0
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": f"{self.trace_id:032x}",
+            "spanId": f"{self.span_id:016x}",
+            "name": self.name,
+            "kind": 1,  # INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = f"{self.parent_id:016x}"
+        return span
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("rag_current_span", default=None)
+
+
+class OTLPFileExporter:
+    """
+    把采样的 span 与指标快照按 OTLP/JSON 格式逐行追加到本地文件（每行一个 Export*ServiceRequest），
+    由后台线程每隔 interval 秒写一次；进程退出时写出剩余内容
+    """
+
+    def __init__(self, path: str = OTEL_EXPORT_PATH, interval: float = OTEL_EXPORT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._spans: deque = deque(maxlen=MAX_PENDING_SPANS)
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_span(self, span: Span):
+        self._spans.append(span)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self, include_metrics: bool = True):
+        spans = []
+        while self._spans:
+            try:
+                spans.append(self._spans.popleft())
+            except IndexError:
+                break
+        lines = []
+        if spans:
+            lines.append({"resourceSpans": [{"resource": _resource(), "scopeSpans": [
+                {"scope": {"name": __name__}, "spans": [s.to_otlp() for s in spans]}]}]})
+        if include_metrics:
+            lines.append(REGISTRY.to_otlp())
+        if not lines:
+            return
+        try:
+            with self._write_lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for line in lines:
+                        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"写入 OTLP 导出文件失败: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+_exporter: Optional[OTLPFileExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def start_exporter(path: str = OTEL_EXPORT_PATH,
+                   interval: float = OTEL_EXPORT_INTERVAL) -> Optional[OTLPFileExporter]:
+    """
+    启动进程内唯一的 OTLP 文件导出器（重复调用返回同一个）；path 为空时不导出，返回 None。
+    未启动导出器时不做追踪采样，只累计指标
+    """
+    global _exporter
+    if not path:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = OTLPFileExporter(path, interval)
+            _exporter.start()
+            logger.info(f"OTLP 导出已启用: {path}，间隔 {interval}s，追踪采样率 {TRACE_SAMPLE_RATE}")
+        return _exporter
+
+
+def observe_stage(name: str, seconds: float):
+    """直接记录一个阶段的耗时（用于无法用 with 包裹的场景，如流式回答）"""
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+@contextmanager
+def stage(name: str, root: bool = False, **attributes) -> Iterator[Optional[Span]]:
+    """
+    计时一个阶段并记入 rag_stage_seconds{stage=name}。root=True 表示一次请求的入口，
+    按 TRACE_SAMPLE_RATE 决定该请求是否导出追踪；请求内嵌套的阶段成为其子 span
+    """
+    if not METRICS_ENABLED:
+        yield None
+        return
+    parent = None if root else _current_span.get()
+    sampled = parent.sampled if parent is not None else (
+        root and _exporter is not None and random.random() < TRACE_SAMPLE_RATE)
+    span = Span(name, parent, sampled, attributes)
+    token = _current_span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        STAGE_SECONDS.observe(span.duration, stage=name)
+        if parent is not None:
+            parent.child_seconds += span.duration
+        if sampled and _exporter is not None:
+            span.end_ns = span.start_ns + int(span.duration * 1e9)
+            _exporter.add_span(span)
+
+
+def timed(name: str):
+    """函数装饰器版本的 stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_in_context(fn):
+    """把当前 contextvars 上下文绑定到 fn，交给线程池执行时子阶段仍能找到所属的请求 span"""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, fn)
+
+
+def prometheus_response() -> TextResponse:
+    """供各 HTTP 服务的 GET /metrics 返回"""
+    return TextResponse(REGISTRY.render_prometheus(), PROMETHEUS_CONTENT_TYPE)
+
+
+class _MetricsApp:
+    def metrics(self, _body) -> TextResponse:
+        return prometheus_response()
+
+
+class _MetricsHandler(JSONHandler):
+    routes = {("GET", "/metrics"): "metrics"}
+
+
+def start_metrics_server(host: str = "127.0.0.1", port: int = METRICS_PORT):
+    """在后台线程启动只提供 GET /metrics 的服务，供没有 HTTP 接口的进程（如 main.py 交互模式）使用"""
+    server = serve(_MetricsApp(), _MetricsHandler, host, port)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"指标服务已启动: http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,145 @@
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from config.cfg import DEDUP_BANDS, DEDUP_NUM_PERM, DEDUP_SHINGLE_SIZE, DEDUP_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUP_FILE = "near_dup.npz"
+
+# MinHash 的排列函数为 (a * x + b) mod p；p 取 2^31 - 1，32 位的 shingle 哈希与 a 相乘不会溢出 uint64
+_PRIME = np.uint64((1 << 31) - 1)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def shingle_hashes(text: str, size: int = DEDUP_SHINGLE_SIZE) -> np.ndarray:
+    """
+    文本的字符 size 元组集合的 32 位哈希（去重后）。先转小写并合并空白，
+    中英文都按字符切分，无需分词；以 numpy 滚动哈希计算，不逐个构造子串
+    """
+    text = _SPACE_RE.sub(" ", text.lower()).strip()
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if not len(codes):
+        return np.zeros(1, dtype=np.uint64)
+    n = max(len(codes) - size + 1, 1)
+    hashes = np.zeros(n, dtype=np.uint64)
+    for j in range(min(size, len(codes))):
+        hashes = (hashes * np.uint64(1000003) + codes[j:j + n]) & np.uint64(0xFFFFFFFF)
+    return np.unique(hashes)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash + LSH 近似重复索引：每个文本块一个 num_perm 维的 MinHash 签名，签名切成 bands 段，
+    任一段完全相同的文本块互为候选，只对候选比较签名，查找耗时与库大小无关。
+    两个签名相同位置取值相等的比例即 Jaccard 相似度的估计
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = DEDUP_NUM_PERM,
+                 bands: int = DEDUP_BANDS, shingle_size: int = DEDUP_SHINGLE_SIZE, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) 须为 bands ({bands}) 的整数倍")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._signatures: Dict[int, np.ndarray] = {}
+        # 每段一个桶表：段内容的哈希 -> 文本块 id 列表
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return chunk_id in self._signatures
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text, self.shingle_size)
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def signatures(self, texts: Iterable[str]) -> List[np.ndarray]:
+        return [self.signature(text) for text in texts]
+
+    def signature_of(self, chunk_id: int) -> Optional[np.ndarray]:
+        return self._signatures.get(chunk_id)
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """两个签名估计的 Jaccard 相似度"""
+        return float(np.count_nonzero(a == b)) / len(a)
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        return [hash(signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    def find(self, signature: np.ndarray) -> Optional[int]:
+        """返回与该签名相似度不低于阈值且最相似的已有文本块 id，没有则返回 None"""
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_similarity = None, -1.0
+        for chunk_id in sorted(candidates):
+            similarity = self.similarity(signature, self._signatures[chunk_id])
+            if similarity > best_similarity:
+                best, best_similarity = chunk_id, similarity
+        return best if best_similarity >= self.threshold else None
+
+    def add(self, chunk_id: int, signature: np.ndarray):
+        self._signatures[chunk_id] = signature
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(chunk_id)
+
+    def add_texts(self, ids: Iterable[int], texts: Iterable[str]):
+        for chunk_id, text in zip(ids, texts):
+            self.add(chunk_id, self.signature(text))
+
+    def remove(self, ids: Iterable[int]):
+        for chunk_id in ids:
+            signature = self._signatures.pop(chunk_id, None)
+            if signature is None:
+                continue
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                members = bucket.get(key)
+                if members is not None and chunk_id in members:
+                    members.remove(chunk_id)
+                    if not members:
+                        del bucket[key]
+
+    def save(self, persist_dir: str):
+        """只保存签名矩阵，桶表在加载时按签名重建"""
+        ids = np.fromiter(self._signatures.keys(), dtype=np.int64, count=len(self._signatures))
+        signatures = (np.stack(list(self._signatures.values())) if self._signatures
+                      else np.zeros((0, self.num_perm), dtype=np.uint32))
+        path = os.path.join(persist_dir, NEAR_DUP_FILE)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, ids=ids, signatures=signatures,
+                     params=np.array([self.threshold, self.num_perm, self.bands, self.shingle_size, self.seed]))
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, NEAR_DUP_FILE))
+
+    @classmethod
+    def load(cls, persist_dir: str, **kwargs) -> "NearDuplicateIndex":
+        """
+        加载签名。签名参数（排列数、shingle 长度、随机种子）与当前配置不同时签名不可比，
+        返回空索引，由调用方按文本重建
+        """
+        index = cls(**kwargs)
+        data = np.load(os.path.join(persist_dir, NEAR_DUP_FILE))
+        _, num_perm, _, shingle_size, seed = data["params"].tolist()
+        if (int(num_perm), int(shingle_size), int(seed)) != (index.num_perm, index.shingle_size, index.seed):
+            logger.info("近似重复索引的签名参数已变化，需要重建")
+            return index
+        for chunk_id, signature in zip(data["ids"].tolist(), data["signatures"]):
+            index.add(chunk_id, signature)
+        return index
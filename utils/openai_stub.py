@@ -0,0 +1,128 @@
+"""
+本地 OpenAI 兼容桩服务，用于在无外网、无密钥的环境下测试与压测问答链路。
+
+    python -m utils.openai_stub --port 8001 --delay 0.5 --token-delay 0.02
+    LLM_BASE_URL=http://127.0.0.1:8001/v1 python main.py
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认 listen 队列只有 5，高并发压测时会出现连接被拒后重试
+    request_queue_size = 1024
+
+
+def _make_handler(delay: float, token_delay: float = 0.0):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive，与真实服务一致
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            question = next((m["content"] for m in reversed(body.get("messages", [])) if m["role"] == "user"), "")
+            answer = f"桩服务回答：{question}"
+            time.sleep(delay)
+            if body.get("stream"):
+                self._send_stream(body, answer)
+                return
+
+            payload = json.dumps({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(answer), "total_tokens": len(answer)},
+            }, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self, body: dict, answer: str):
+            """以 SSE 分块返回，每 2 个字符一个 chunk，chunk 之间间隔 token_delay"""
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_event(data: str):
+                event = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+                self.wfile.flush()
+
+            pieces = [answer[i:i + 2] for i in range(0, len(answer), 2)]
+            for i, piece in enumerate(pieces):
+                if i and token_delay:
+                    time.sleep(token_delay)
+                write_event(json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }, ensure_ascii=False))
+            write_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }))
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return StubHandler
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, delay: float = 0.0,
+                      token_delay: float = 0.0) -> Tuple[StubServer, str]:
+    """
+    在后台线程启动桩服务，返回 (server, base_url)；port=0 时自动分配端口，用完调用 server.shutdown()
+    """
+    server = StubServer((host, port), _make_handler(delay, token_delay))
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    logger.info(f"OpenAI 桩服务已启动: {base_url}，响应延迟 {delay}s")
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.0, help="每次响应前的固定延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="流式响应中 chunk 之间的间隔（秒）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = StubServer((args.host, args.port), _make_handler(args.delay, args.token_delay))
+    logger.info(f"OpenAI 桩服务监听 http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import logging
+import re
+from typing import Dict, List, Tuple
+
+from config.cfg import PROMPT_CONTEXT_TOKENS, PROMPT_HISTORY_TOKENS
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken 为可选依赖，缺失或无法加载词表时使用估算
+    _encoding = None
+
+# 中日韩字符按 1 字 1 token 估算，其余连续字符按约 4 字符 1 token 估算
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+# 截断后剩余不足该 token 数的参考资料不再保留
+MIN_CHUNK_TOKENS = 32
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按 token 预算截断，尽量在句末（。！？；换行）处断开"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    boundary = max(cut.rfind(p) for p in ("。", "！", "？", "；", "\n", ". "))
+    return cut[:boundary + 1] if boundary > len(cut) // 2 else cut
+
+
+def message_tokens(message: Dict) -> int:
+    # 每条消息额外计入角色等格式开销
+    return count_tokens(message.get("content") or "") + 4
+
+
+def select_context(documents: List[dict], budget: int = PROMPT_CONTEXT_TOKENS) -> List[str]:
+    """
+    按检索排名依次放入参考资料，直到用完 token 预算；放不下的第一条截断保留，其余丢弃
+    """
+    selected, used = [], 0
+    for doc in documents:
+        text = doc["text"]
+        tokens = count_tokens(text)
+        if used + tokens <= budget:
+            selected.append(text)
+            used += tokens
+            continue
+        remaining = budget - used
+        if remaining >= MIN_CHUNK_TOKENS:
+            selected.append(truncate_to_tokens(text, remaining))
+        break
+    if len(selected) < len(documents):
+        logger.debug(f"参考资料超出 token 预算，保留 {len(selected)}/{len(documents)} 条")
+    return selected
+
+
+def split_history(chat_history: List[Dict], budget: int = PROMPT_HISTORY_TOKENS) -> Tuple[List[Dict], List[Dict]]:
+    """
+    从最近的消息往前保留不超过预算的部分，返回 (较早的消息, 保留的最近消息)；
+    保留部分从 user 消息开始，不拆开一轮问答
+    """
+    used, start = 0, len(chat_history)
+    for i in range(len(chat_history) - 1, -1, -1):
+        used += message_tokens(chat_history[i])
+        if used > budget:
+            break
+        start = i
+    while start < len(chat_history) and chat_history[start]["role"] != "user":
+        start += 1
+    return chat_history[:start], chat_history[start:]
+
+
+def history_tokens(chat_history: List[Dict]) -> int:
+    return sum(message_tokens(m) for m in chat_history)
@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from config.cfg import QUERY_CACHE_SIZE, QUERY_EMBEDDING_CACHE_SIZE
+from utils.metrics import QUERY_CACHE
+
+# 结果缓存只保存命中的 id 与分数等字段，文本与元数据命中后再从 ChunkStore 取回
+_HYDRATED_KEYS = ("text", "metadata")
+
+
+class QueryCache:
+    """
+    VectorStore 前的两级进程内 LRU：
+    结果缓存 (查询文本, k, 过滤条件) -> (版本号, 命中列表)，只有版本号与向量库当前版本一致时才命中，
+    因此写入或删除之后不会返回旧结果；向量缓存 查询文本 -> 查询向量，向量只取决于模型，与索引内容无关，
+    不需要版本号。两者各自按条目数淘汰最久未使用的条目
+    """
+
+    def __init__(self, max_results: int = QUERY_CACHE_SIZE, max_embeddings: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.max_results = max_results
+        self.max_embeddings = max_embeddings
+        self._results: "OrderedDict[Hashable, Tuple[int, List[dict]]]" = OrderedDict()
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.result_hits = 0
+        self.result_misses = 0
+        # 因版本号过期而未命中的次数（已计入 result_misses）
+        self.result_stale = 0
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+
+    def get_results(self, key: Hashable, version: int) -> Optional[List[dict]]:
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] != version:
+                del self._results[key]
+                self.result_stale += 1
+                entry = None
+            if entry is None:
+                self.result_misses += 1
+            else:
+                self._results.move_to_end(key)
+                self.result_hits += 1
+        QUERY_CACHE.inc(cache="results", result="miss" if entry is None else "hit")
+        return None if entry is None else entry[1]
+
+    def put_results(self, key: Hashable, version: int, hits: List[dict]):
+        if self.max_results <= 0:
+            return
+        entry = (version, [{k: v for k, v in hit.items() if k not in _HYDRATED_KEYS} for hit in hits])
+        with self._lock:
+            self._results[key] = entry
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def get_embedding(self, query: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._embeddings.get(query)
+            if vector is None:
+                self.embedding_misses += 1
+            else:
+                self._embeddings.move_to_end(query)
+                self.embedding_hits += 1
+        QUERY_CACHE.inc(cache="embeddings", result="miss" if vector is None else "hit")
+        return vector
+
+    def put_embedding(self, query: str, vector: np.ndarray):
+        if self.max_embeddings <= 0:
+            return
+        with self._lock:
+            self._embeddings[query] = vector
+            self._embeddings.move_to_end(query)
+            while len(self._embeddings) > self.max_embeddings:
+                self._embeddings.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._embeddings.clear()
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        result_lookups = self.result_hits + self.result_misses
+        embedding_lookups = self.embedding_hits + self.embedding_misses
+        return {
+            "results": len(self._results),
+            "result_hit_rate": self.result_hits / result_lookups if result_lookups else None,
+            "result_stale": self.result_stale,
+            "embeddings": len(self._embeddings),
+            "embedding_hit_rate": self.embedding_hits / embedding_lookups if embedding_lookups else None,
+        }
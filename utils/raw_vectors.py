@@ -0,0 +1,129 @@
+import logging
+import os
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 持久化文件名（与索引放在同一目录）
+RAW_IDS_FILE = "raw_vectors.ids.npy"
+RAW_VECTORS_FILE = "raw_vectors.npy"
+# 已删除的向量占比超过该值时压缩存储
+COMPACT_RATIO = 0.25
+
+
+class RawVectorStore:
+    """
+    有损索引（sq8、ivfpq）旁保存的原始 float32 向量，按 id 升序排列，查找用二分。
+    供重打分与重建索引按 id 取回，无需重新编码文本；持久化为 .npy，可以 mmap 方式加载，
+    首次写入时再读入内存。删除只打墓碑标记，积累到一定比例后再压缩
+    """
+
+    def __init__(self, dim: int = 0):
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        # 追加时先放入分段列表，读取前再合并，避免每批写入都复制整个矩阵
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._count = 0
+        self._mmapped = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _ensure_writable(self):
+        if self._mmapped:
+            self._ids, self._vectors = np.array(self._ids), np.array(self._vectors)
+            self._mmapped = False
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        ids = np.concatenate([self._ids] + [part[0] for part in self._pending])
+        vectors = np.concatenate([self._vectors] + [part[1] for part in self._pending])
+        alive = np.concatenate([self._alive, np.ones(len(ids) - len(self._alive), dtype=bool)])
+        self._pending.clear()
+        if len(ids) > 1 and (np.diff(ids) < 0).any():
+            # 近似重复的文本块在原文本块删除后才写入，id 可能小于已有 id，按 id 重新排序
+            order = np.argsort(ids, kind="stable")
+            ids, vectors, alive = ids[order], vectors[order], alive[order]
+        self._ids, self._vectors, self._alive = ids, vectors, alive
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return
+        self._ensure_writable()
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(self._vectors) and not self._pending:
+            self._vectors = np.empty((0, vectors.shape[1]), dtype=np.float32)
+        self._pending.append((ids, vectors))
+        self._count += len(ids)
+
+    def _rows(self, ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (存在的 id, 对应的行号)"""
+        self._consolidate()
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self._ids):
+            return ids[:0], ids[:0]
+        rows = np.minimum(np.searchsorted(self._ids, ids), len(self._ids) - 1)
+        found = (self._ids[rows] == ids) & self._alive[rows]
+        return ids[found], rows[found]
+
+    def vectors(self, ids: Iterable[int]) -> np.ndarray:
+        """按 id 取回向量，顺序与 ids 相同；有 id 不存在时抛出 KeyError"""
+        ids = np.asarray(ids, dtype=np.int64)
+        found, rows = self._rows(ids)
+        if len(found) != len(ids):
+            raise KeyError(np.setdiff1d(ids, found)[:10].tolist())
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def items(self) -> Tuple[np.ndarray, np.ndarray]:
+        """返回全部 (ids, 向量)，按 id 升序"""
+        self._consolidate()
+        return self._ids[self._alive], np.asarray(self._vectors[self._alive])
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """标记删除，返回实际删除的数量（重复的 id 只计一次）"""
+        found, rows = self._rows(np.unique(np.asarray(list(ids), dtype=np.int64)))
+        if not len(found):
+            return 0
+        self._ensure_writable()
+        self._alive[rows] = False
+        self._count -= len(found)
+        if len(self._ids) - self._count > COMPACT_RATIO * len(self._ids):
+            self.compact()
+        return len(found)
+
+    def compact(self):
+        self._consolidate()
+        self._ids, self._vectors = self._ids[self._alive], np.asarray(self._vectors[self._alive])
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._mmapped = False
+
+    def save(self, persist_dir: str):
+        self._consolidate()
+        if not self._alive.all():
+            self.compact()
+        for name, array in ((RAW_IDS_FILE, self._ids), (RAW_VECTORS_FILE, self._vectors)):
+            path = os.path.join(persist_dir, name)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return (os.path.exists(os.path.join(persist_dir, RAW_IDS_FILE))
+                and os.path.exists(os.path.join(persist_dir, RAW_VECTORS_FILE)))
+
+    @classmethod
+    def load(cls, persist_dir: str, mmap_mode: bool = True) -> "RawVectorStore":
+        store = cls()
+        mode = "r" if mmap_mode else None
+        store._ids = np.load(os.path.join(persist_dir, RAW_IDS_FILE), mmap_mode=mode)
+        store._vectors = np.load(os.path.join(persist_dir, RAW_VECTORS_FILE), mmap_mode=mode)
+        store._alive = np.ones(len(store._ids), dtype=bool)
+        store._count = len(store._ids)
+        store._mmapped = mmap_mode
+        return store
@@ -0,0 +1,81 @@
+import logging
+from typing import Callable, Iterable, List, Optional
+
+import httpx
+import numpy as np
+
+from config.cfg import RETRIEVAL_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteVectorStore:
+    """
+    分片检索服务（utils.retrieval_server）的客户端，提供与 VectorStore 相同的检索、写入接口，
+    可直接传给 RAGAgent、SearchBatcher 或 sync_directory。
+    注意变更回调只在经由本客户端删除文本块时触发，其他客户端的删除不会通知到这里
+    """
+
+    def __init__(self, base_url: str, timeout: float = RETRIEVAL_TIMEOUT, max_connections: int = 100):
+        self.base_url = base_url.rstrip("/")
+        self.client = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=max_connections,
+                                                                         max_keepalive_connections=max_connections))
+        self._change_listeners: List[Callable[[List[int]], None]] = []
+        health = self._call("GET", "/health")
+        self.store_id = health["store_id"]
+        self.metric = health["metric"]
+        logger.info(f"已连接检索服务 {self.base_url}，{len(health['shards'])} 个分片，共 {health['count']} 个文本块")
+
+    def _call(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        response = self.client.request(method, self.base_url + path, json=body)
+        if response.status_code >= 400:
+            raise RuntimeError(f"检索服务返回错误 {response.status_code}: {response.text}")
+        return response.json()
+
+    def __len__(self) -> int:
+        return self._call("GET", "/health")["count"]
+
+    def add_change_listener(self, listener: Callable[[List[int]], None]):
+        self._change_listeners.append(listener)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return np.asarray(self._call("POST", "/embed", {"query": query})["embedding"], dtype=np.float32)
+
+    def search(self, query: str, k: int = 3, where: Optional[dict] = None) -> List[dict]:
+        return self.search_batch([query], k, where)[0]
+
+    def cached_search(self, query: str, k: int = 3, where: Optional[dict] = None) -> Optional[List[dict]]:
+        """查询结果缓存在各分片上，本地没有缓存，总是返回 None；供 SearchBatcher 调用"""
+        return None
+
+    def search_batch(self, queries: List[str], k: int = 3, where: Optional[dict] = None) -> List[List[dict]]:
+        if not queries:
+            return []
+        if where:
+            # range 无法序列化为 JSON，展开为取值列表
+            where = {key: list(value) if isinstance(value, range) else value for key, value in where.items()}
+        return self._call("POST", "/search", {"queries": queries, "k": k, "where": where})["results"]
+
+    def add_texts(self, texts: List[str], metadata: Optional[List[dict]] = None) -> List[int]:
+        try:
+            return self._call("POST", "/add", {"texts": texts, "metadata": metadata})["ids"]
+        except Exception as e:
+            logger.error(f"添加文本失败: {e}")
+            return []
+
+    def delete(self, ids: Iterable[int]) -> int:
+        ids = list(ids)
+        if not ids:
+            return 0
+        removed = self._call("POST", "/delete", {"ids": ids})["removed"]
+        for listener in self._change_listeners:
+            listener(ids)
+        return removed
+
+    def save(self, persist_dir: Optional[str] = None):
+        """各分片保存到服务端各自的目录，persist_dir 仅为与 VectorStore 接口兼容"""
+        count = self._call("POST", "/save")["count"]
+        logger.info(f"检索服务已保存，共 {count} 个文本块")
+
+    def close(self):
+        self.client.close()
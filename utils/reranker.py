@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.cfg import RERANK_BATCH_SIZE, RERANK_BUDGET_MS, RERANK_CACHE_SIZE, RERANK_MODEL
+
+logger = logging.getLogger(__name__)
+
+# 用于统计延迟分位数的最近样本数
+LATENCY_WINDOW = 1000
+
+
+class CrossEncoderReranker:
+    """
+    本地交叉编码器重排：对 (问题, 候选文本) 分批打分，分数按 (问题哈希, 文本块 id) 缓存。
+    单次重排超出 budget_ms 时放弃本次重排、保持第一阶段顺序，已算出的分数仍写入缓存
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS, cache_size: int = RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000
+        self.cache_size = cache_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[bytes, int], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.fallbacks = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"加载重排模型: {self.model_name}")
+                    self._model = CrossEncoder(self.model_name)
+        return self._model
+
+    def _cached_scores(self, query_key: bytes, hits: List[dict]) -> Dict[int, float]:
+        scores = {}
+        with self._cache_lock:
+            for hit in hits:
+                score = self._cache.get((query_key, hit["id"]))
+                if score is not None:
+                    self._cache.move_to_end((query_key, hit["id"]))
+                    scores[hit["id"]] = score
+        self.cache_hits += len(scores)
+        self.cache_misses += len(hits) - len(scores)
+        return scores
+
+    def _store(self, query_key: bytes, scores: Dict[int, float]):
+        with self._cache_lock:
+            for chunk_id, score in scores.items():
+                self._cache[(query_key, chunk_id)] = score
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, hits: List[dict], top_k: int) -> List[dict]:
+        if len(hits) <= 1:
+            return hits[:top_k]
+        model = self.model  # 首次加载模型的耗时不计入预算
+        start_time = time.perf_counter()
+        query_key = hashlib.sha1(query.encode("utf-8")).digest()
+        scores = self._cached_scores(query_key, hits)
+        pending = [h for h in hits if h["id"] not in scores]
+
+        new_scores: Dict[int, float] = {}
+        over_budget = False
+        for start in range(0, len(pending), self.batch_size):
+            if time.perf_counter() - start_time > self.budget:
+                over_budget = True
+                break
+            batch = pending[start:start + self.batch_size]
+            predicted = model.predict([(query, h["text"]) for h in batch], batch_size=len(batch),
+                                      show_progress_bar=False)
+            new_scores.update(zip((h["id"] for h in batch), np.asarray(predicted, dtype=np.float32).tolist()))
+        self._store(query_key, new_scores)
+        scores.update(new_scores)
+
+        elapsed = time.perf_counter() - start_time
+        self._latencies.append(elapsed)
+        self.calls += 1
+        if over_budget or len(scores) < len(hits):
+            self.fallbacks += 1
+            logger.warning(f"重排超出时间预算（{elapsed * 1000:.0f}ms），使用第一阶段排序")
+            return hits[:top_k]
+        ranked = sorted(hits, key=lambda h: scores[h["id"]], reverse=True)[:top_k]
+        return [{**h, "rerank_score": scores[h["id"]]} for h in ranked]
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        latencies = np.array(self._latencies) * 1000
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "calls": self.calls,
+            "fallbacks": self.fallbacks,
+            "cache_hit_rate": self.cache_hits / lookups if lookups else None,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        }
@@ -0,0 +1,311 @@
+"""
+分片检索服务：按文档（source）哈希把文本块划分到 N 个分片，每个分片由独立的工作进程持有
+一份 VectorStore；协调进程对外提供 HTTP 接口，检索时并行分发到各分片（scatter）再合并 top-k
+（gather）。客户端见 utils.remote_store.RemoteVectorStore。
+
+    python -m utils.retrieval_server --shards 4 --port 8100 --persist-dir storage/shards --doc-dir data
+    RETRIEVAL_SERVER_URL=http://127.0.0.1:8100 python main.py
+
+文本块的全局 id = 分片内 id * 分片数 + 分片号。各分片独立编码查询、独立计算 BM25 统计量，
+因此混合检索的 RRF 分数在分片之间只是近似可比。
+"""
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import httpx
+
+from config.cfg import EMBEDDING_CACHE_PATH, OTEL_EXPORT_PATH, RETRIEVAL_SHARDS, RETRIEVAL_TIMEOUT
+from utils.json_http import JSONHandler, JSONServer, serve
+from utils.metrics import prometheus_response, start_exporter
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR = "shard_{}"
+
+
+def shard_of(source: str, num_shards: int) -> int:
+    """同一文档的文本块总落在同一分片，按文件删除、更新时只涉及一个分片"""
+    return int.from_bytes(hashlib.sha1(source.encode("utf-8")).digest()[:8], "big") % num_shards
+
+
+def to_global_id(local_id: int, shard: int, num_shards: int) -> int:
+    return local_id * num_shards + shard
+
+
+def to_local_id(global_id: int, num_shards: int):
+    """返回 (分片号, 分片内 id)"""
+    return global_id % num_shards, global_id // num_shards
+
+
+class Handler(JSONHandler):
+    routes = {
+        ("GET", "/health"): "health",
+        ("GET", "/metrics"): "metrics",
+        ("POST", "/search"): "search",
+        ("POST", "/embed"): "embed",
+        ("POST", "/add"): "add",
+        ("POST", "/delete"): "delete",
+        ("POST", "/save"): "save",
+    }
+
+
+def _serve(app, host: str, port: int) -> JSONServer:
+    return serve(app, Handler, host, port)
+
+
+class ShardApp:
+    """单个分片：持有一份 VectorStore，检索请求经 SearchBatcher 合并后执行"""
+
+    def __init__(self, shard: int, num_shards: int, persist_dir: str):
+        from utils.embedding_cache import EmbeddingCache
+        from utils.search_batcher import SearchBatcher
+        from utils.vector_store import VectorStore
+
+        self.shard = shard
+        self.num_shards = num_shards
+        self.persist_dir = os.path.join(persist_dir, SHARD_DIR.format(shard))
+        # 向量缓存按内容寻址，各分片共用同一个 SQLite 文件（WAL 模式支持多进程读写）
+        embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+        if VectorStore.exists(self.persist_dir):
+            self.store = VectorStore.load(self.persist_dir, embedding_cache=embedding_cache)
+        else:
+            self.store = VectorStore(embedding_cache=embedding_cache)
+        # 检索与写入共用一把锁：写入、删除（可能触发重建）期间不能并发检索
+        self._lock = threading.Lock()
+        self.batcher = SearchBatcher(self.store, lock=self._lock)
+
+    def _globalize(self, hits: List[dict]) -> List[dict]:
+        return [{**h, "id": to_global_id(h["id"], self.shard, self.num_shards)} for h in hits]
+
+    def metrics(self, _body):
+        return prometheus_response()
+
+    def health(self, _body) -> dict:
+        query_cache = self.store.query_cache
+        return {"shard": self.shard, "count": len(self.store), "store_id": self.store.store_id,
+                "metric": self.store.metric, "hybrid": self.store.bm25 is not None,
+                "query_cache": query_cache.stats() if query_cache is not None else None}
+
+    def search(self, body) -> dict:
+        queries, k, where = body["queries"], int(body.get("k", 3)), body.get("where")
+        if len(queries) == 1:
+            results = [self.batcher.search(queries[0], k, where)]
+        else:
+            with self._lock:
+                results = self.store.search_batch(queries, k, where)
+        return {"results": [self._globalize(hits) for hits in results]}
+
+    def embed(self, body) -> dict:
+        return {"embedding": self.store.embed_query(body["query"]).tolist()}
+
+    def add(self, body) -> dict:
+        with self._lock:
+            ids = self.store.add_texts(body["texts"], body.get("metadata"))
+        return {"ids": [to_global_id(i, self.shard, self.num_shards) for i in ids]}
+
+    def delete(self, body) -> dict:
+        with self._lock:
+            return {"removed": self.store.delete(body["ids"])}
+
+    def save(self, _body) -> dict:
+        with self._lock:
+            self.store.save(self.persist_dir)
+        return {"count": len(self.store)}
+
+
+def _shard_main(shard: int, num_shards: int, persist_dir: str, host: str, ready):
+    from config.logging_config import setup_logging
+    setup_logging(log_file=f"shard_{shard}.log")
+    if OTEL_EXPORT_PATH:
+        # 各分片写入各自的导出文件，避免多进程同时追加同一个文件
+        start_exporter(f"{OTEL_EXPORT_PATH}.shard_{shard}")
+    app = ShardApp(shard, num_shards, persist_dir)
+    server = _serve(app, host, 0)
+    ready.put((shard, server.server_address[1]))
+    logger.info(f"分片 {shard} 已启动，端口 {server.server_address[1]}，共 {len(app.store)} 个文本块")
+    server.serve_forever()
+
+
+class CoordinatorApp:
+    """协调进程：写请求按文档哈希路由到对应分片，检索请求分发到全部分片后合并"""
+
+    def __init__(self, shard_urls: List[str], timeout: float = RETRIEVAL_TIMEOUT):
+        self.shard_urls = shard_urls
+        self.num_shards = len(shard_urls)
+        self.client = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=64 * self.num_shards))
+        self.executor = ThreadPoolExecutor(max_workers=8 * self.num_shards, thread_name_prefix="scatter")
+        shards = [self._call(i, "GET", "/health") for i in range(self.num_shards)]
+        # 由各分片的 store_id 派生；任一分片重建后随之变化，外部缓存据此区分文本块
+        self.store_id = uuid.uuid5(uuid.NAMESPACE_OID, ",".join(s["store_id"] for s in shards)).hex
+        self.metric = shards[0]["metric"]
+        # RRF 分数与内积越大越好，L2 距离越小越好
+        self.higher_is_better = shards[0]["hybrid"] or self.metric == "ip"
+
+    def _call(self, shard: int, method: str, path: str, body: Optional[dict] = None) -> dict:
+        response = self.client.request(method, self.shard_urls[shard] + path, json=body)
+        response.raise_for_status()
+        return response.json()
+
+    def _scatter(self, shards: List[int], path: str, bodies: Dict[int, dict]) -> Dict[int, dict]:
+        futures = {s: self.executor.submit(self._call, s, "POST", path, bodies[s]) for s in shards}
+        return {s: f.result() for s, f in futures.items()}
+
+    def metrics(self, _body):
+        # 只含协调进程自身的指标；各分片的检索指标在分片自己的 /metrics 上
+        return prometheus_response()
+
+    def health(self, _body) -> dict:
+        shards = [self._call(i, "GET", "/health") for i in range(self.num_shards)]
+        return {"shards": shards, "count": sum(s["count"] for s in shards), "store_id": self.store_id,
+                "metric": self.metric}
+
+    def search(self, body) -> dict:
+        queries, k, where = body["queries"], int(body.get("k", 3)), body.get("where")
+        shards = list(range(self.num_shards))
+        source = (where or {}).get("source")
+        if isinstance(source, str):
+            # 按 source 过滤时只需查询该文档所在的分片
+            shards = [shard_of(source, self.num_shards)]
+        request = {"queries": queries, "k": k, "where": where}
+        replies = self._scatter(shards, "/search", {s: request for s in shards})
+        merged = []
+        for i in range(len(queries)):
+            hits = [h for reply in replies.values() for h in reply["results"][i]]
+            hits.sort(key=lambda h: h["score"], reverse=self.higher_is_better)
+            merged.append(hits[:k])
+        return {"results": merged}
+
+    def embed(self, body) -> dict:
+        # 各分片使用同一个模型，任取一个分片编码即可；按问题哈希分散负载
+        return self._call(shard_of(body["query"], self.num_shards), "POST", "/embed", body)
+
+    def add(self, body) -> dict:
+        texts, metadata = body["texts"], body.get("metadata") or [{} for _ in body["texts"]]
+        positions: Dict[int, List[int]] = {}
+        for pos, meta in enumerate(metadata):
+            positions.setdefault(shard_of(meta.get("source", ""), self.num_shards), []).append(pos)
+        bodies = {s: {"texts": [texts[p] for p in ps], "metadata": [metadata[p] for p in ps]}
+                  for s, ps in positions.items()}
+        futures = {s: self.executor.submit(self._call, s, "POST", "/add", b) for s, b in bodies.items()}
+        replies, errors = {}, []
+        for s, future in futures.items():
+            try:
+                reply = future.result()
+            except Exception as e:
+                errors.append(f"分片 {s}: {e}")
+                continue
+            if len(reply["ids"]) != len(positions[s]):
+                errors.append(f"分片 {s}: 写入 {len(reply['ids'])}/{len(positions[s])} 个文本块")
+            replies[s] = reply
+        if errors:
+            # 任一分片写入失败时整体视为失败（与 VectorStore.add_texts 的约定一致），撤销其余分片已写入的文本块
+            self._rollback_add(replies)
+            logger.error(f"添加文本失败，已回滚: {'；'.join(errors)}")
+            return {"ids": [], "error": "；".join(errors)}
+        ids = [None] * len(texts)
+        for s, reply in replies.items():
+            for pos, chunk_id in zip(positions[s], reply["ids"]):
+                ids[pos] = chunk_id
+        return {"ids": ids}
+
+    def _rollback_add(self, replies: Dict[int, dict]):
+        by_shard = {s: [to_local_id(i, self.num_shards)[1] for i in reply["ids"]]
+                    for s, reply in replies.items() if reply["ids"]}
+        futures = {s: self.executor.submit(self._call, s, "POST", "/delete", {"ids": ids})
+                   for s, ids in by_shard.items()}
+        for s, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"回滚分片 {s} 的写入失败，{len(by_shard[s])} 个文本块残留: {e}")
+
+    def delete(self, body) -> dict:
+        by_shard: Dict[int, List[int]] = {}
+        for chunk_id in body["ids"]:
+            shard, local_id = to_local_id(chunk_id, self.num_shards)
+            by_shard.setdefault(shard, []).append(local_id)
+        replies = self._scatter(list(by_shard), "/delete", {s: {"ids": ids} for s, ids in by_shard.items()})
+        return {"removed": sum(r["removed"] for r in replies.values())}
+
+    def save(self, _body) -> dict:
+        replies = self._scatter(list(range(self.num_shards)), "/save", {s: {} for s in range(self.num_shards)})
+        return {"count": sum(r["count"] for r in replies.values())}
+
+
+class RetrievalCluster:
+    """在本机启动 N 个分片进程与协调服务；协调服务运行在当前进程的后台线程中"""
+
+    def __init__(self, persist_dir: str, num_shards: int = RETRIEVAL_SHARDS, host: str = "127.0.0.1",
+                 port: int = 0):
+        ctx = multiprocessing.get_context("spawn")
+        ready = ctx.Queue()
+        self.processes = [
+            ctx.Process(target=_shard_main, args=(i, num_shards, persist_dir, host, ready),
+                        name=f"retrieval-shard-{i}", daemon=True)
+            for i in range(num_shards)
+        ]
+        for process in self.processes:
+            process.start()
+        ports = {}
+        while len(ports) < num_shards:
+            try:
+                shard, shard_port = ready.get(timeout=1)
+                ports[shard] = shard_port
+            except queue.Empty:
+                dead = [p.name for p in self.processes if not p.is_alive()]
+                if dead:
+                    self.shutdown()
+                    raise RuntimeError(f"分片进程启动失败: {', '.join(dead)}，详见 logs/ 下的分片日志")
+        self.app = CoordinatorApp([f"http://{host}:{ports[i]}" for i in range(num_shards)])
+        self.server = _serve(self.app, host, port)
+        threading.Thread(target=self.server.serve_forever, name="retrieval-coordinator", daemon=True).start()
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        logger.info(f"检索服务已启动: {self.base_url}，{num_shards} 个分片")
+
+    def shutdown(self):
+        if getattr(self, "server", None) is not None:
+            self.server.shutdown()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片检索服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--shards", type=int, default=RETRIEVAL_SHARDS)
+    parser.add_argument("--persist-dir", default="storage/shards")
+    parser.add_argument("--doc-dir", help="启动时将该目录增量同步入库")
+    args = parser.parse_args()
+    from config.logging_config import setup_logging
+    setup_logging()
+    start_exporter()
+
+    cluster = RetrievalCluster(args.persist_dir, args.shards, args.host, args.port)
+    if args.doc_dir:
+        from utils.ingest import IngestManifest, sync_directory
+        from utils.remote_store import RemoteVectorStore
+        store = RemoteVectorStore(cluster.base_url)
+        manifest = IngestManifest.load(args.persist_dir)
+        stats = sync_directory(store, args.doc_dir, manifest)
+        if stats["added"] or stats["updated"] or stats["removed"]:
+            store.save()
+        manifest.save()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
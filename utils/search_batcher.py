@@ -0,0 +1,106 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import List, Optional
+
+from config.cfg import SEARCH_BATCH_MAX_SIZE, SEARCH_BATCH_WAIT_MS
+from utils.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class SearchBatcher:
+    """
+    检索微批：把几毫秒内到达的并发 search 调用合并为一次 VectorStore.search_batch，
+    共享一次编码器前向计算和一次 FAISS 检索。接口与 VectorStore.search 相同
+    """
+
+    def __init__(self, vector_store: VectorStore, max_batch_size: int = SEARCH_BATCH_MAX_SIZE,
+                 max_wait_ms: float = SEARCH_BATCH_WAIT_MS, lock: Optional[threading.Lock] = None):
+        self.vector_store = vector_store
+        # 与写入共用的锁：FAISS 与 ChunkStore 都不支持检索与写入、重建并发进行，
+        # 向量库另有写入方时传入其锁，读取向量库的调用都在锁内执行
+        self._lock = lock if lock is not None else nullcontext()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="search-batcher", daemon=True)
+        self._worker.start()
+
+    def search(self, query: str, k: int = 3, where: Optional[dict] = None) -> List[dict]:
+        if self._closed:
+            raise RuntimeError("SearchBatcher 已关闭")
+        # 命中查询缓存的热点查询直接返回，不必等待合批窗口
+        with self._lock:
+            cached = self.vector_store.cached_search(query, k, where)
+        if cached is not None:
+            return cached
+        future: Future = Future()
+        self._queue.put((query, k, where, future))
+        return future.result()
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, batch: list):
+        """在等待窗口内继续取出查询追加到 batch；原地追加，中途出错时已取出的查询仍在 batch 中"""
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭信号放回队列，处理完当前批次后退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            try:
+                self._collect(batch)
+                # 已被调用方取消的查询不再检索；其余的 future 标记为运行中，之后无法再取消
+                batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+                # 过滤条件相同的查询合并为一组，每组以组内最大的 k 检索一次，再按各自的 k 截断
+                groups = []
+                for item in batch:
+                    group = next((g for g in groups if g[0] == item[2]), None)
+                    if group is None:
+                        groups.append((item[2], [item]))
+                    else:
+                        group[1].append(item)
+                for where, items in groups:
+                    self._search_group(where, items)
+                logger.debug(f"合并检索 {len(batch)} 个查询")
+            except Exception as e:
+                # 只有一个工作线程，任何异常都不能让它退出，否则之后的 search() 会一直阻塞
+                logger.exception("合并检索失败")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _search_group(self, where: Optional[dict], items: list):
+        max_k = max(k for _, k, _, _ in items)
+        try:
+            with self._lock:
+                results = self.vector_store.search_batch([q for q, _, _, _ in items], max_k, where)
+        except Exception as e:
+            for *_, future in items:
+                future.set_exception(e)
+            return
+        for (_, k, _, future), hits in zip(items, results):
+            future.set_result(hits[:k])
@@ -1,63 +1,652 @@
 import logging
+import json
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, List, Optional
 import os
+import threading
+import time
+import uuid
+from utils.embedding_cache import EmbeddingCache
+from utils.embedder import EmbeddingExecutor
+from utils.index_factory import (
+    LOSSY_INDEX_TYPES,
+    apply_search_params,
+    build_index,
+    ensure_direct_map,
+    filtered_search,
+    index_type_of,
+    is_lossy,
+    metric_of,
+    reconstruct_all,
+    rescore,
+    search_excluding,
+    supports_remove,
+)
+from utils.bm25_index import BM25Index
+from utils.chunk_store import DUPLICATE_OF_KEY, ChunkStore
+from utils.metrics import DUPLICATE_CHUNKS, EMBEDDED_TEXTS, SEARCH_QUERIES, stage
+from utils.near_duplicates import NearDuplicateIndex
+from utils.query_cache import QueryCache
+from utils.raw_vectors import RawVectorStore
+from config.cfg import (
+    DEDUP_COLLAPSE_THRESHOLD,
+    DEDUP_ENABLED,
+    HYBRID_FETCH_K,
+    HYBRID_SEARCH,
+    INDEX_METRIC,
+    INDEX_REBUILD_THRESHOLD,
+    INDEX_RESCORE_FACTOR,
+    INDEX_TOMBSTONE_RATIO,
+    INDEX_TYPE,
+    MODEL_DIR,
+    QUERY_CACHE_SIZE,
+    RRF_K,
+)
 
 logger = logging.getLogger(__name__)
 
+# 持久化文件名
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.json"
+TOMBSTONES_FILE = "index_tombstones.npy"
+# docstore 格式版本：2 起索引为 IndexIDMap2，文本块以稳定的 id 寻址；
+# 3 起文本与元数据改存为 ChunkStore 的列式文件，docstore 只保留描述信息
+FORMAT_VERSION = 3
+SUPPORTED_FORMAT_VERSIONS = (2, 3)
+
 class VectorStore:
-    def __init__(self, embedding_model_name: str = "all-MiniLM-L6-v2",local_path='.\models'):
-        if not os.path.exists(local_path):
-            os.makedirs(local_path)
-        model_path = os.path.join(local_path, embedding_model_name)
-        if not os.path.exists(model_path):
-            logger.info(f"Embedding 模型不存在，正在下载: {embedding_model_name}")
-            self.model = SentenceTransformer(embedding_model_name)
-            self.model.save(model_path)
-        else:
-            self.model = SentenceTransformer(model_path)
+    def __init__(self, embedding_model_name: str = "all-MiniLM-L6-v2", local_path: str = MODEL_DIR,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 embedder: Optional[EmbeddingExecutor] = None,
+                 index_type: str = INDEX_TYPE, rebuild_threshold: int = INDEX_REBUILD_THRESHOLD,
+                 hybrid: bool = HYBRID_SEARCH, metric: str = INDEX_METRIC,
+                 rescore_factor: int = INDEX_RESCORE_FACTOR, dedup: bool = DEDUP_ENABLED,
+                 query_cache_size: int = QUERY_CACHE_SIZE):
+        # Embedding 模型在首次编码时才加载（见 model 属性），只读取索引的场景不会导入 torch
+        self.local_path = local_path
+        self._model = None
+        self._model_lock = threading.Lock()
         self.index = None
-        self.embeddings = []
-        self.metadata = []
-        self.texts = []
+        # HNSW 中已删除、尚未压缩掉的 id（升序），检索时跳过
+        self._tombstones = np.zeros(0, dtype=np.int64)
+        # 文本块以 id 寻址；id 单调递增且不复用，删除后其余块的 id 不变。
+        # 向量只存在 FAISS 索引中，文本与元数据存于列式的 ChunkStore
+        self.chunks = ChunkStore()
+        self._next_id = 0
+        # 向量库实例标识：重新构建的向量库会从 0 重新分配 id，外部缓存以 (store_id, id) 区分文本块
+        self.store_id = uuid.uuid4().hex
+        # 文本块被删除时回调 listener(ids)，供答案缓存等失效使用
+        self._change_listeners: List[Callable[[List[int]], None]] = []
+        self.embedding_model_name = embedding_model_name
+        self.embedding_cache = embedding_cache
+        self.embedder = embedder or EmbeddingExecutor()
+        # 目标索引类型；文本块数达到 rebuild_threshold 前先用精确的 flat 索引
+        self.index_type = index_type
+        self.rebuild_threshold = rebuild_threshold
+        # ip 时向量归一化后按内积（余弦相似度）检索，score 越大越相似；l2 时 score 为距离，越小越相似
+        self.metric = metric
+        # 有损索引的候选放大倍数；重打分所需的原始 float 向量保存在索引旁的 RawVectorStore 中。
+        # 是否保存由当前索引类型决定：flat 等无损索引可直接取回向量，重建为有损索引时才创建
+        self.rescore_factor = rescore_factor
+        self.raw_vectors: Optional[RawVectorStore] = None
+        self._warned_reencode = False
+        # 混合检索时与向量索引同步维护的 BM25 倒排索引
+        self.bm25: Optional[BM25Index] = BM25Index() if hybrid else None
+        # 近似重复检测：只为写入向量索引的文本块保存 MinHash 签名，重复的文本块不向量化
+        self.near_dup: Optional[NearDuplicateIndex] = NearDuplicateIndex() if dedup else None
+        # 版本号：每次写入、删除或重建索引后加一，查询结果缓存以此判断条目是否过期
+        self.version = 0
+        self.query_cache: Optional[QueryCache] = QueryCache(query_cache_size) if query_cache_size > 0 else None
+        # 通过 mmap 加载的索引是只读的，写入前需要先载入内存
+        self._index_path = None
+        self._index_mmapped = False
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def num_indexed(self) -> int:
+        """索引中有效的向量数（不含墓碑）"""
+        return 0 if self.index is None else self.index.ntotal - len(self._tombstones)
+
+    @property
+    def model(self):
+        """首次访问时加载 Embedding 模型；本地目录中没有时下载并保存"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+
+        start_time = time.time()
+        model_path = os.path.join(self.local_path, self.embedding_model_name)
+        if os.path.exists(model_path):
+            model = SentenceTransformer(model_path)
+        else:
+            logger.info(f"Embedding 模型不存在，正在下载: {self.embedding_model_name}")
+            model = SentenceTransformer(self.embedding_model_name)
+            os.makedirs(self.local_path, exist_ok=True)
+            model.save(model_path)
+        logger.info(f"Embedding 模型已加载: {self.embedding_model_name}，耗时 {time.time() - start_time:.2f}s")
+        return model
+
+    def warmup(self, background: bool = True) -> Optional[threading.Thread]:
+        """
+        预先加载模型并编码一条查询，使首个问题不再承担模型加载与首次推理的开销。
+        background=True 时在后台线程执行并返回该线程
+        """
+        def run():
+            try:
+                self.embedder.encode(self.model, ["warmup"])
+            except Exception as e:
+                logger.warning(f"Embedding 模型预热失败: {e}")
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="embedding-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def add_change_listener(self, listener: Callable[[List[int]], None]):
+        self._change_listeners.append(listener)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self._encode_queries([query])[0]
 
-    def add_texts(self, texts: List[str], metadata: Optional[List[dict]] = None):
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """编码查询；配置了查询缓存时先查进程内 LRU，只对未命中的查询调用模型"""
+        if self.query_cache is None:
+            return np.asarray(self._encode(queries), dtype=np.float32)
+        vectors = [self.query_cache.get_embedding(query) for query in queries]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = np.asarray(self._encode([queries[i] for i in missing]), dtype=np.float32)
+            for i, vector in zip(missing, encoded):
+                self.query_cache.put_embedding(queries[i], vector)
+                vectors[i] = vector
+        return np.stack(vectors)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """编码文本；配置了向量缓存时只对未命中的文本调用模型"""
+        def encode_fn(batch: List[str]) -> np.ndarray:
+            return self.embedder.encode(self.model, batch)
+
+        EMBEDDED_TEXTS.inc(len(texts))
+        with stage("embed"):
+            if self.embedding_cache is None:
+                vectors = encode_fn(texts)
+            else:
+                # 归一化与否得到的向量不同，缓存键需区分
+                cache_key = self.embedding_model_name + ("#normalized" if self.embedder.normalize else "")
+                vectors = self.embedding_cache.encode(encode_fn, cache_key, texts)
+        if self.metric == "ip" and not self.embedder.normalize:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def _ensure_writable(self):
+        """mmap 加载的索引不可修改，首次写入时完整读入内存"""
+        if self._index_mmapped:
+            logger.info(f"索引以 mmap 方式加载，写入前载入内存: {self._index_path}")
+            self.index = faiss.read_index(self._index_path)
+            self._index_mmapped = False
+
+    def add_texts(self, texts: List[str], metadata: Optional[List[dict]] = None) -> List[int]:
+        """
+        向量化并写入索引，返回分配给各文本块的 id。与库内已有文本块近似重复的文本块
+        同样分配 id 并保存文本，元数据中记录 duplicate_of，但不向量化、不写入索引
+        """
+        ids = []
         try:
             logging.info("添加文本并构建向量索引")
             if not texts:
                 logger.warning("没有提供文本进行添加")
-                return
-            embeddings = self.model.encode(texts)
-            self.embeddings.extend(embeddings)
-            self.texts.extend(texts)
-            self.metadata.extend(metadata or [{} for _ in texts])
-
-            if self.index is None:
-                dimension = embeddings.shape[1]
-                self.index = faiss.IndexFlatL2(dimension)
-            self.index.add(np.array(embeddings))
+                return []
+            ids = list(range(self._next_id, self._next_id + len(texts)))
+            metadata = [dict(meta) for meta in metadata] if metadata else [{} for _ in texts]
+            rows = self._mark_duplicates(ids, texts, metadata) if self.near_dup is not None else range(len(texts))
+            indexed_ids = [ids[row] for row in rows]
+            indexed_texts = [texts[row] for row in rows]
+            if indexed_texts:
+                embeddings = self._encode(indexed_texts)
+                self._ensure_writable()
+                if self.index is None:
+                    dimension = embeddings.shape[1]
+                    self.index = build_index("flat", dimension, metric=self.metric)
+                self.index.add_with_ids(np.asarray(embeddings, dtype=np.float32),
+                                        np.array(indexed_ids, dtype=np.int64))
+                if self.raw_vectors is not None:
+                    self.raw_vectors.add(indexed_ids, embeddings)
+            self._next_id += len(texts)
+            self.chunks.add(ids, texts, metadata)
+            if self.bm25 is not None:
+                self.bm25.add(indexed_ids, indexed_texts)
 
             logger.info(f"已添加 {len(texts)} 个文本到向量库")
+            if indexed_texts:
+                self._maybe_upgrade_index()
+            self.version += 1
+            return ids
         except Exception as e:
             logger.error(f"添加文本失败: {e}")
+            if self.near_dup is not None:
+                self.near_dup.remove(ids)
+            return []
+
+    def _mark_duplicates(self, ids: List[int], texts: List[str], metadata: List[dict]) -> List[int]:
+        """
+        用 MinHash + LSH 查找与库内（及本批中靠前的）文本块近似重复的文本，在其元数据中记录
+        duplicate_of；其余文本的签名加入近似重复索引。返回需要向量化并写入索引的下标
+        """
+        rows = []
+        with stage("dedup"):
+            for row, (chunk_id, signature) in enumerate(zip(ids, self.near_dup.signatures(texts))):
+                original = self.near_dup.find(signature)
+                if original is None:
+                    self.near_dup.add(chunk_id, signature)
+                    rows.append(row)
+                else:
+                    metadata[row][DUPLICATE_OF_KEY] = original
+        if len(rows) < len(texts):
+            DUPLICATE_CHUNKS.inc(len(texts) - len(rows))
+            logger.info(f"跳过 {len(texts) - len(rows)} 个近似重复的文本块")
+        return rows
+
+    def delete(self, ids: Iterable[int]) -> int:
+        """
+        按 id 从索引中移除文本块，返回实际移除的数量
+        """
+        ids = [i for i in dict.fromkeys(ids) if i in self.chunks]
+        if not ids or self.index is None:
+            return 0
+        # 近似重复的文本块不在索引中，只需从 ChunkStore 移除
+        indexed_ids = [i for i, original in zip(ids, self.chunks.values(DUPLICATE_OF_KEY, ids).tolist())
+                       if original < 0]
+        if indexed_ids:
+            if supports_remove(self.index):
+                self._ensure_writable()
+                self.index.remove_ids(np.array(indexed_ids, dtype=np.int64))
+            else:
+                # HNSW 不支持删除：记为墓碑，检索时跳过，墓碑过多时再重建压缩
+                self._tombstones = np.union1d(self._tombstones, np.array(indexed_ids, dtype=np.int64))
+            if self.raw_vectors is not None:
+                self.raw_vectors.remove(indexed_ids)
+            if self.bm25 is not None:
+                self.bm25.remove(indexed_ids, self.chunks.texts(indexed_ids))
+            if self.near_dup is not None:
+                self.near_dup.remove(indexed_ids)
+        self.chunks.remove(ids)
+        if indexed_ids:
+            self._promote_duplicates(indexed_ids)
+        if len(self._tombstones) > INDEX_TOMBSTONE_RATIO * self.index.ntotal:
+            self.rebuild(index_type_of(self.index))
+        self.version += 1
+        logger.info(f"已从向量库移除 {len(ids)} 个文本块")
+        for listener in self._change_listeners:
+            listener(ids)
+        return len(ids)
+
+    def _promote_duplicates(self, removed_ids: List[int]):
+        """
+        被删除的文本块若仍有近似重复的文本块，这些文本块依次重新查重：与现存文本块仍近似重复的
+        改指向该文本块，否则向量化后写入索引取而代之，保证内容不会因原文本块被删除而无法检索
+        """
+        orphans = self.chunks.select({DUPLICATE_OF_KEY: removed_ids})
+        if not len(orphans):
+            return
+        orphans = orphans.tolist()
+        texts = self.chunks.texts(orphans)
+        promoted, promoted_texts = [], []
+        signatures = self.near_dup.signatures(texts) if self.near_dup is not None else [None] * len(texts)
+        for chunk_id, text, signature in zip(orphans, texts, signatures):
+            original = self.near_dup.find(signature) if signature is not None else None
+            if original is None:
+                if signature is not None:
+                    self.near_dup.add(chunk_id, signature)
+                promoted.append(chunk_id)
+                promoted_texts.append(text)
+            self.chunks.set_values(DUPLICATE_OF_KEY, [chunk_id], -1 if original is None else original)
+        if promoted:
+            self._ensure_writable()
+            embeddings = np.asarray(self._encode(promoted_texts), dtype=np.float32)
+            self.index.add_with_ids(embeddings, np.array(promoted, dtype=np.int64))
+            if self.raw_vectors is not None:
+                self.raw_vectors.add(promoted, embeddings)
+            if self.bm25 is not None:
+                self.bm25.add(promoted, promoted_texts)
+            logger.info(f"{len(promoted)} 个近似重复的文本块因原文本块被删除而写入索引")
+
+    def _maybe_upgrade_index(self):
+        """文本块数超过阈值且当前仍是 flat 索引时，重建为目标类型的近似索引"""
+        if self.index_type == index_type_of(self.index) or self.num_indexed < self.rebuild_threshold:
+            return
+        try:
+            self.rebuild(self.index_type)
+        except Exception as e:
+            logger.error(f"重建 {self.index_type} 索引失败，继续使用当前索引: {e}")
 
-    def search(self, query: str, k: int = 3) -> List[dict]:
-        logger.info("基于查询进行向量检索")
-        query_embedding = self.model.encode([query])
-        D, I = self.index.search(query_embedding, k)
-        logger.info(f'{D}\n{I}\n')
-        results = []
-        for idx in range(len(I[0])):
-            score = D[0][idx]
-            text = self.metadata[I[0][idx]].get("text", "")
-            # logger.debug(f'文本：{text[:100]}')
-            results.append({
-  
-                "score": float(score),
-                "text":  self.texts[idx],
-                "metadata": self.metadata[idx]
-            })
-        logger.debug(f"检索结果数量: {len(results)}")
-        return results
\ No newline at end of file
+    def rebuild(self, index_type: Optional[str] = None, exclude_ids: Iterable[int] = ()):
+        """
+        以指定类型（默认目标类型）重建索引，同时压缩掉墓碑。向量优先从现有索引中无损取回，
+        有损索引（如 PQ）从 RawVectorStore 取回，都没有时按文本重新编码（命中向量缓存时无需调用模型）
+        """
+        index_type = index_type or self.index_type
+        recovered = reconstruct_all(self.index)
+        if recovered is None and self.raw_vectors is not None:
+            recovered = self.raw_vectors.items()
+        if recovered is None:
+            ids = self.chunks.ids(indexed_only=True)
+            vectors = np.asarray(self._encode(self.chunks.texts(ids)), dtype=np.float32)
+        else:
+            ids, vectors = recovered
+        exclude = np.union1d(self._tombstones, np.array(list(exclude_ids), dtype=np.int64))
+        if len(exclude):
+            keep = ~np.isin(ids, exclude)
+            ids, vectors = ids[keep], vectors[keep]
+
+        logger.info(f"重建索引: {index_type_of(self.index)} -> {index_type}，共 {len(ids)} 个向量")
+        index = build_index(index_type, self.index.d, train_vectors=vectors, metric=metric_of(self.index))
+        if len(ids):
+            index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+        raw_vectors = None
+        if self.rescore_factor and index_type in LOSSY_INDEX_TYPES:
+            raw_vectors = RawVectorStore()
+            raw_vectors.add(ids, vectors)
+        self.index = index
+        self.raw_vectors = raw_vectors
+        self._tombstones = np.zeros(0, dtype=np.int64)
+        self._index_mmapped = False
+        self.version += 1
+
+    def search(self, query: str, k: int = 3, where: Optional[dict] = None) -> List[dict]:
+        return self.search_batch([query], k, where)[0]
+
+    def search_batch(self, queries: List[str], k: int = 3, where: Optional[dict] = None) -> List[List[dict]]:
+        """
+        批量检索：所有查询一次编码、一次 FAISS 检索，返回与 queries 等长的结果列表。
+        where 为元数据过滤条件（见 ChunkStore.select），如 {"file_name": "sanziqi.docx"}，
+        过滤在 FAISS 检索内部通过 ID 选择器完成，不会因事后过滤而结果不足。
+        启用近似重复检测时多取一倍候选，近似相同的结果折叠为一条，被折叠的 id 记入 duplicates
+        """
+        if self.num_indexed == 0:
+            logger.warning("向量库为空")
+            return [[] for _ in queries]
+        if not queries:
+            return []
+        SEARCH_QUERIES.inc(len(queries))
+        with stage("search"):
+            if self.query_cache is None:
+                return self._search_batch(queries, k, where)
+            # 版本号在检索前读取：检索期间若有写入，结果以旧版本号入缓存，之后不会命中
+            version = self.version
+            keys = [self._cache_key(query, k, where) for query in queries]
+            results = [self._cached_results(key, version) for key in keys]
+            missing = [i for i, hits in enumerate(results) if hits is None]
+            if missing:
+                for i, hits in zip(missing, self._search_batch([queries[i] for i in missing], k, where)):
+                    self.query_cache.put_results(keys[i], version, hits)
+                    results[i] = hits
+            return results
+
+    def cached_search(self, query: str, k: int = 3, where: Optional[dict] = None) -> Optional[List[dict]]:
+        """只查结果缓存，未命中返回 None；供 SearchBatcher 在排队前直接返回热点查询"""
+        if self.query_cache is None or self.index is None:
+            return None
+        return self._cached_results(self._cache_key(query, k, where), self.version)
+
+    @staticmethod
+    def _cache_key(query: str, k: int, where: Optional[dict]) -> tuple:
+        # 过滤条件的取值可能是列表或 range，序列化为字符串作为键
+        return query, k, json.dumps(where, ensure_ascii=False, sort_keys=True, default=str) if where else None
+
+    def _cached_results(self, key: tuple, version: int) -> Optional[List[dict]]:
+        hits = self.query_cache.get_results(key, version)
+        if hits is None:
+            return None
+        chunks = self.chunks
+        return [{**hit, "text": chunks.text(hit["id"]), "metadata": chunks.metadata(hit["id"])} for hit in hits]
+
+    def _search_batch(self, queries: List[str], k: int, where: Optional[dict]) -> List[List[dict]]:
+        """search_batch 的检索部分，不经过查询结果缓存"""
+        allowed_ids, substitutes = None, {}
+        if where:
+            with stage("filter_select"):
+                allowed_ids, substitutes = self._resolve_duplicates(self.chunks.select(where))
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            logger.warning(f"没有满足过滤条件的文本块: {where}")
+            return [[] for _ in queries]
+        collapse = self.near_dup is not None and DEDUP_COLLAPSE_THRESHOLD <= 1
+        top_k = k * 2 if collapse else k
+        query_embeddings = self._encode_queries(queries)
+        if self.bm25 is None:
+            results = self.search_by_vectors(query_embeddings, top_k, allowed_ids)
+        else:
+            fetch_k = max(top_k, HYBRID_FETCH_K)
+            vector_results = self.search_by_vectors(query_embeddings, fetch_k, allowed_ids)
+            with stage("bm25"):
+                bm25_results = [self.bm25.search(query, fetch_k, allowed_ids) for query in queries]
+            with stage("fuse"):
+                results = [self._fuse(hits, bm25_hits, top_k)
+                           for hits, bm25_hits in zip(vector_results, bm25_results)]
+        if substitutes:
+            results = [[self._substitute(hit, substitutes) for hit in hits] for hits in results]
+        if collapse:
+            with stage("collapse"):
+                results = [self._collapse(hits, k) for hits in results]
+        return results
+
+    def _resolve_duplicates(self, selected: np.ndarray):
+        """
+        近似重复的文本块不在索引中，过滤条件选中它们时改为在其 duplicate_of 上检索。
+        返回 (检索用的升序 id, {索引中的 id: 被选中的重复文本块 id})，后者用于把命中替换回选中的文本块
+        """
+        originals = self.chunks.values(DUPLICATE_OF_KEY, selected)
+        duplicate = originals >= 0
+        if not duplicate.any():
+            return selected, {}
+        indexed = selected[~duplicate]
+        substitutes = {}
+        for chunk_id, original in zip(selected[duplicate].tolist(), originals[duplicate].tolist()):
+            substitutes.setdefault(original, chunk_id)
+        for chunk_id in indexed.tolist():
+            substitutes.pop(chunk_id, None)
+        return np.union1d(indexed, originals[duplicate]), substitutes
+
+    def _substitute(self, hit: dict, substitutes: Dict[int, int]) -> dict:
+        chunk_id = substitutes.get(hit["id"])
+        if chunk_id is None:
+            return hit
+        return {**hit, "id": chunk_id, "text": self.chunks.text(chunk_id), "metadata": self.chunks.metadata(chunk_id)}
+
+    def _collapse(self, hits: List[dict], k: int) -> List[dict]:
+        """按名次保留结果，与已保留结果的 MinHash 相似度达到 DEDUP_COLLAPSE_THRESHOLD 的命中并入其 duplicates"""
+        kept, signatures = [], []
+        for hit in hits:
+            signature = self.near_dup.signature_of(hit["id"])
+            if signature is None:  # 替换为重复文本块的命中不在近似重复索引中
+                signature = self.near_dup.signature(hit["text"])
+            for other, other_signature in zip(kept, signatures):
+                if self.near_dup.similarity(signature, other_signature) >= DEDUP_COLLAPSE_THRESHOLD:
+                    other.setdefault("duplicates", []).append(hit["id"])
+                    break
+            else:
+                if len(kept) == k:
+                    break
+                kept.append(hit)
+                signatures.append(signature)
+        return kept
+
+    def _fuse(self, vector_hits: List[dict], bm25_hits: List[tuple], k: int) -> List[dict]:
+        """
+        倒数排名融合（RRF）：score = Σ 1 / (RRF_K + 排名)。只依赖两路结果的名次，
+        无需对向量距离与 BM25 分数做归一化；原始分数保留在 vector_score / bm25_score 中
+        """
+        fused: Dict[int, dict] = {}
+        for rank, hit in enumerate(vector_hits):
+            fused[hit["id"]] = {**hit, "vector_score": hit["score"], "score": 1 / (RRF_K + rank + 1)}
+        for rank, (chunk_id, bm25_score) in enumerate(bm25_hits):
+            hit = fused.get(chunk_id)
+            if hit is None:
+                hit = fused[chunk_id] = {"id": chunk_id, "score": 0.0, "text": self.chunks.text(chunk_id),
+                                         "metadata": self.chunks.metadata(chunk_id)}
+            hit["bm25_score"] = bm25_score
+            hit["score"] += 1 / (RRF_K + rank + 1)
+        return sorted(fused.values(), key=lambda h: h["score"], reverse=True)[:k]
+
+    def search_by_vectors(self, query_embeddings: np.ndarray, k: int = 3,
+                          allowed_ids: Optional[np.ndarray] = None) -> List[List[dict]]:
+        """allowed_ids 不为空时只在这些文本块中检索"""
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        fetch_k = k * self.rescore_factor if self.rescore_factor and is_lossy(self.index) else k
+        with stage("faiss_search"):
+            if allowed_ids is None:
+                D, I = search_excluding(self.index, query_embeddings, fetch_k, self._tombstones)
+            else:
+                # 有损索引取回的是解码后的近似向量，子集较小时改用原始向量精确检索
+                vectors_fn = self.raw_vectors.vectors if fetch_k != k and self.raw_vectors is not None else None
+                D, I = filtered_search(self.index, query_embeddings, fetch_k, allowed_ids, vectors_fn=vectors_fn)
+        if fetch_k != k:
+            with stage("rescore"):
+                D, I = rescore(query_embeddings, I, self._vectors_for, k, metric_of(self.index))
+        # 延迟格式化：未开启 DEBUG 时不把距离与 id 矩阵转成字符串
+        logger.debug('%s\n%s\n', D, I)
+        chunks = self.chunks
+        # tolist() 一次性转成 Python 标量，避免逐个访问 numpy 元素；结果不足 k 个时 FAISS 以 -1 填充
+        with stage("fetch_chunks"):
+            results = [
+                [{"id": chunk_id, "score": score, "text": chunks.text(chunk_id), "metadata": chunks.metadata(chunk_id)}
+                 for score, chunk_id in zip(scores, ids) if chunk_id >= 0]
+                for scores, ids in zip(D.tolist(), I.tolist())
+            ]
+        logger.debug("检索结果数量: %s", [len(r) for r in results])
+        return results
+
+    def _vectors_for(self, ids: np.ndarray) -> np.ndarray:
+        """按 id 取回原始 float 向量；旧版本保存的向量库没有 RawVectorStore 时按文本重新编码"""
+        if self.raw_vectors is not None:
+            return self.raw_vectors.vectors(ids)
+        if not self._warned_reencode:
+            logger.warning("向量库未保存原始向量，重打分需重新编码候选文本；重建索引后可避免")
+            self._warned_reencode = True
+        return self._encode(self.chunks.texts(ids))
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return (os.path.exists(os.path.join(persist_dir, INDEX_FILE))
+                and os.path.exists(os.path.join(persist_dir, DOCSTORE_FILE)))
+
+    def save(self, persist_dir: str):
+        """
+        将 FAISS 索引与 ChunkStore 保存到目录（先写临时文件再替换，避免写坏已有索引）
+        """
+        if self.index is None:
+            logger.warning("向量库为空，跳过保存")
+            return
+        os.makedirs(persist_dir, exist_ok=True)
+        index_path = os.path.join(persist_dir, INDEX_FILE)
+        docstore_path = os.path.join(persist_dir, DOCSTORE_FILE)
+
+        self._ensure_writable()
+        faiss.write_index(self.index, index_path + ".tmp")
+        self.chunks.save(persist_dir)
+        with open(docstore_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "format_version": FORMAT_VERSION,
+                "embedding_model_name": self.embedding_model_name,
+                "next_id": self._next_id,
+                "store_id": self.store_id,
+                "count": len(self.chunks),
+            }, f, ensure_ascii=False)
+        tombstones_path = os.path.join(persist_dir, TOMBSTONES_FILE)
+        if len(self._tombstones):
+            with open(tombstones_path + ".tmp", "wb") as f:
+                np.save(f, self._tombstones)
+        os.replace(index_path + ".tmp", index_path)
+        if len(self._tombstones):
+            os.replace(tombstones_path + ".tmp", tombstones_path)
+        elif os.path.exists(tombstones_path):
+            os.remove(tombstones_path)
+        os.replace(docstore_path + ".tmp", docstore_path)
+        if self.bm25 is not None:
+            self.bm25.save(persist_dir)
+        if self.near_dup is not None:
+            self.near_dup.save(persist_dir)
+        if self.raw_vectors is not None:
+            self.raw_vectors.save(persist_dir)
+        logger.info(f"向量库已保存到 {persist_dir}，共 {len(self)} 个文本块")
+
+    @classmethod
+    def load(cls, persist_dir: str, mmap: bool = True, **kwargs) -> "VectorStore":
+        """
+        从目录加载向量库。mmap=True 时以 IO_FLAG_MMAP 映射索引文件，
+        多个工作进程可共享页缓存中的同一份索引，无需重新向量化
+        """
+        index_path = os.path.join(persist_dir, INDEX_FILE)
+        docstore_path = os.path.join(persist_dir, DOCSTORE_FILE)
+        with open(docstore_path, "r", encoding="utf-8") as f:
+            docstore = json.load(f)
+        if docstore.get("format_version") not in SUPPORTED_FORMAT_VERSIONS:
+            raise ValueError(f"不支持的向量库格式版本: {docstore.get('format_version')}")
+
+        kwargs.setdefault("embedding_model_name", docstore["embedding_model_name"])
+        store = cls(**kwargs)
+        if mmap:
+            store.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        else:
+            store.index = faiss.read_index(index_path)
+        apply_search_params(store.index)
+        ensure_direct_map(store.index)
+        # 度量随索引持久化，以索引为准，保证查询向量与库内向量的归一化方式一致
+        store.metric = metric_of(store.index)
+        store._index_path = index_path
+        store._index_mmapped = mmap
+        tombstones_path = os.path.join(persist_dir, TOMBSTONES_FILE)
+        if os.path.exists(tombstones_path):
+            store._tombstones = np.load(tombstones_path)
+        if docstore["format_version"] == 2:
+            # 旧格式的文本与元数据内联在 docstore.json 中，转入 ChunkStore，下次保存时写为新格式
+            store.chunks.add(docstore["ids"], docstore["texts"], docstore["metadata"])
+        else:
+            store.chunks = ChunkStore.load(persist_dir, mmap_mode=mmap)
+        store._next_id = docstore["next_id"]
+        store.store_id = docstore.get("store_id", store.store_id)
+        # 近似重复的文本块只存于 ChunkStore，不在索引中
+        indexed = len(store.chunks.ids(indexed_only=True))
+        if store.num_indexed != indexed:
+            raise ValueError(f"索引与文本数量不一致: {store.num_indexed} != {indexed}")
+        if store.bm25 is not None:
+            if BM25Index.exists(persist_dir):
+                store.bm25 = BM25Index.load(persist_dir)
+            if len(store.bm25) != indexed:
+                # 旧版本保存的向量库没有 BM25 索引（或与文本不一致），按文本重建
+                logger.info("重建 BM25 索引")
+                store.bm25 = BM25Index()
+                ids, texts = zip(*store.chunks.items(indexed_only=True)) if indexed else ((), ())
+                store.bm25.add(list(ids), list(texts))
+        if store.rescore_factor and is_lossy(store.index):
+            store._load_raw_vectors(persist_dir, mmap, indexed)
+        if store.near_dup is not None:
+            if NearDuplicateIndex.exists(persist_dir):
+                store.near_dup = NearDuplicateIndex.load(persist_dir)
+            if len(store.near_dup) != indexed:
+                # 旧版本保存的向量库没有签名（或签名参数已变化），按文本重新计算；已入库的重复内容保持不变
+                logger.info("重建近似重复索引")
+                store.near_dup = NearDuplicateIndex()
+                ids, texts = zip(*store.chunks.items(indexed_only=True)) if indexed else ((), ())
+                store.near_dup.add_texts(ids, texts)
+        logger.info(f"已从 {persist_dir} 加载向量库，共 {len(store)} 个文本块")
+        return store
+
+    def _load_raw_vectors(self, persist_dir: str, mmap: bool, indexed: int):
+        """加载有损索引旁的原始向量；文件缺失或与索引不一致时退回按文本重新编码候选"""
+        if RawVectorStore.exists(persist_dir):
+            raw_vectors = RawVectorStore.load(persist_dir, mmap_mode=mmap)
+            if len(raw_vectors) == indexed:
+                self.raw_vectors = raw_vectors
+                return
+        logger.warning("向量库缺少原始向量，重打分将重新编码候选文本")